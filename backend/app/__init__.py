@@ -0,0 +1,45 @@
+# Flask app factory: config, blueprints and the two info routes.
+# One-off server startup (RAG indexes, catalog of earlier uploads, model preload) isn't
+# done here but in main.py's __main__ block. Tests build apps with create_app(), and
+# sandbox workers import the app package and re-run main.py as __mp_main__; neither
+# should redo that work.
+
+import os
+from flask import Flask, jsonify
+from flask_cors import CORS
+
+
+def create_app(upload_folder=None):
+    # imported here so `import app.utils...` (sandbox workers) doesn't pull in the routes
+    from app.routes.file_routes import file_routes
+    from app.routes.query_routes import query_bp
+    from app.utils.file_handler import DEFAULT_UPLOAD_FOLDER
+
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = upload_folder or DEFAULT_UPLOAD_FOLDER
+    # Allow larger files sizes, anything bigger should go through the chunked /uploads endpoints
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 50 * 1024 * 1024))
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+    app.register_blueprint(file_routes)
+    app.register_blueprint(query_bp)
+
+    @app.route('/health', methods=['GET'])
+    def health_check():
+        return jsonify({"status": "healthy", "message": "Server is running"}), 200
+
+    @app.route('/', methods=['GET'])
+    def root():
+        return jsonify({
+            "message": "Welcome to the Terranova API",
+            "endpoints": {
+                "file_upload": "/upload",
+                "chunked_upload": "/uploads",
+                "active_file": "/active-file",
+                "query": "/query",
+                "results": "/results/<handle>",
+                "explanation": "/explain/<explanation_id>"
+            },
+            "version": "1.0.0"
+        })
+
+    return app
@@ -1,6 +1,9 @@
 import os
 from flask import Blueprint, request, jsonify
-from app.utils.file_handler import save_file
+from app.utils.file_handler import (
+    save_file, create_upload_session, get_upload_session, append_upload_chunk, complete_upload_session
+)
+from app.utils.upload_ingest import UploadError, CHUNK_SIZE
 
 file_routes = Blueprint("file_routes", __name__, url_prefix="/")  
 
@@ -12,4 +15,64 @@ def upload_file():
     if not file:
         return jsonify({"error": "No file uploaded"}), 400
     result = save_file(file)
+    if not result.get("success", False):
+        return jsonify(result), 400
     return jsonify(result), 200
+
+# Resumable chunked uploads for files too big for a single request:
+#   POST /uploads {"filename": "orders.csv", "size": 123}  -> upload_id
+#     (content that is already stored is only deduplicated once its bytes came in and
+#      hashed the same, a hash alone doesn't get a client access to someone's upload)
+#   PUT /uploads/<id> with raw bytes + "Content-Range: bytes <start>-<end>/<total>" (repeat)
+#   GET /uploads/<id> -> offset received so far, to resume after a failure
+#   POST /uploads/<id>/complete -> same response as /upload
+def _upload_error(e):
+    return jsonify({"success": False, "error": str(e)}), e.status
+
+def _chunk_offset():
+    content_range = request.headers.get("Content-Range", "")
+    if content_range.startswith("bytes "):
+        try:
+            return int(content_range[len("bytes "):].split("-", 1)[0])
+        except ValueError:
+            raise UploadError("Invalid Content-Range header")
+    offset = request.headers.get("Upload-Offset", request.args.get("offset"))
+    if offset is None:
+        raise UploadError("Content-Range or Upload-Offset header required")
+    try:
+        return int(offset)
+    except ValueError:
+        raise UploadError("Invalid upload offset")
+
+@file_routes.route("/uploads", methods=["POST"])
+def start_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        state = create_upload_session(data.get("filename"), data.get("size"))
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify({"success": True, "upload_id": state["upload_id"], "offset": 0, "chunk_size": CHUNK_SIZE}), 201
+
+@file_routes.route("/uploads/<upload_id>", methods=["GET"])
+def chunked_upload_status(upload_id):
+    try:
+        state = get_upload_session(upload_id)
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify({"success": True, "upload_id": upload_id, "offset": state["offset"], "size": state["total_size"]}), 200
+
+@file_routes.route("/uploads/<upload_id>", methods=["PUT"])
+def put_upload_chunk(upload_id):
+    try:
+        state = append_upload_chunk(upload_id, request.stream, _chunk_offset())
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify({"success": True, "upload_id": upload_id, "offset": state["offset"]}), 200
+
+@file_routes.route("/uploads/<upload_id>/complete", methods=["POST"])
+def finish_chunked_upload(upload_id):
+    try:
+        result = complete_upload_session(upload_id)
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify(result), 200
\ No newline at end of file
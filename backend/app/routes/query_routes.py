@@ -1,9 +1,19 @@
 import os
 import sys  
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import logging
-from app.services.ollama_service import get_sql_query, get_pandas_query, explain_query_results, QUERY_TYPE_PANDAS
-from app.utils.db_handler import get_database_schema, execute_query, execute_pandas_query, format_results, get_enhanced_schema_with_samples
+from app.services.ollama_service import get_sql_query, get_pandas_query, explain_query_results, stream_query_explanation, QUERY_TYPE_PANDAS, remember_query, forget_query
+from app.services.explanation_jobs import submit_explanation, get_explanation
+from app.services.llm_cache import llm_cache
+from app.utils.dataset_cache import dataset_cache
+from app.utils.result_cache import result_cache
+from app.utils.code_sandbox import cancel_job
+from app.utils.result_encoding import (
+    negotiate_format, encode_columnar, encode_arrow, json_with_raw_results,
+    FORMAT_RECORDS, FORMAT_COLUMNAR, FORMAT_ARROW, ARROW_MIME
+)
+from app.utils.db_handler import get_database_schema, execute_query, execute_pandas_query, format_results, get_enhanced_schema_with_samples, get_result_page
 from app.utils.rag_examples import guess_relevant_files
 import numpy as np  
 
@@ -16,6 +26,13 @@ logger = logging.getLogger(__name__)
 query_bp = Blueprint("query_bp", __name__, url_prefix="/")
 active_filepath = None
 
+STREAM_NDJSON = "application/x-ndjson"
+STREAM_SSE = "text/event-stream"
+STREAM_ROW_CHUNK = 500
+# rows sent back per request unless the client asks for a different page size
+RESULT_ROW_CAP = int(os.getenv('RESULT_ROW_CAP', 1000))
+RESULT_MAX_PAGE = int(os.getenv('RESULT_MAX_PAGE', 10000))
+
 @query_bp.route("/active-file", methods=["GET"])
 def get_active_file():
     global active_filepath
@@ -58,30 +75,18 @@ def set_active_file():
         "message": f"Active file set to {os.path.basename(full_path)}"
     }), 200
 
-@query_bp.route("/query", methods=["POST"])
-def handle_query():
-    data = request.json
-    user_query = data.get("query")
-    filepath = data.get("filePath", active_filepath)
-    if not user_query:
-        print("User query is missing!") 
-        return jsonify({"error": "Query required"}), 400
-        
-    if not filepath:
-        return jsonify({"error": "No file path provided"}), 400
-    
+def _resolve_query_file(filepath):
     # kept getting backend prefix duplication errors
     if filepath.startswith(os.path.join("backend", "")):
         filepath = filepath[len("backend/"):]
+    return os.path.join(os.getcwd(), filepath)
 
-    filepath = os.path.join(os.getcwd(), filepath)
-    logger.debug(f"using file: {filepath}")
-    
-    # RAG
+def _generate_query(user_query, filepath):
+    """RAG + LLM code generation, returns (query_result, error_response)"""
     schema = get_enhanced_schema_with_samples(filepath)
     if isinstance(schema, dict) and "error" in schema:
         print(f"Error in schema: {schema['error']}")
-        return jsonify({"error": schema["error"]}), 400
+        return None, ({"error": schema["error"]}, 400)
     
     print("Enhanced schema with samples prepared for RAG...")
     
@@ -97,21 +102,182 @@ def handle_query():
         query_result = get_sql_query(user_query, schema, filepath)
     
     if not query_result.get("success", False):
-        return jsonify({
+        return None, ({
             "success": False,
             "error": query_result.get("error", "Failed to generate query")
-        }), 500
+        }, 500)
+    return query_result, None
+
+def _page_params(params):
+    """offset/limit from the body or query string, limit defaults to RESULT_ROW_CAP"""
+    try:
+        offset = max(int(params.get("offset", 0)), 0)
+        limit = int(params.get("limit", RESULT_ROW_CAP))
+    except (TypeError, ValueError):
+        raise ValueError("offset and limit must be integers")
+    return offset, min(max(limit, 0), RESULT_MAX_PAGE)
+
+def _result_format(params):
+    return negotiate_format(params, request.headers.get("Accept", ""))
+
+def _results_response(envelope, query_results, fmt):
+    """envelope + the result page in the negotiated encoding"""
+    if fmt == FORMAT_RECORDS:
+        return jsonify(dict(envelope, results=query_results.get("results"))), 200
+    page = query_results["page"]
+    if fmt == FORMAT_ARROW:
+        try:
+            return _arrow_response(envelope, page)
+        except RuntimeError as e:
+            return jsonify({"success": False, "error": str(e)}), 406
+        except (TypeError, ValueError) as e:
+            # pyarrow's ArrowInvalid / ArrowTypeError, e.g. a column mixing numbers and text
+            logger.info(f"Result doesn't fit Arrow, sending it columnar: {str(e)}")
+    body = json_with_raw_results(dict(envelope, format=FORMAT_COLUMNAR), encode_columnar(page))
+    return Response(body, mimetype="application/json"), 200
+
+def _arrow_response(envelope, page):
+    body = encode_arrow(page, metadata=envelope)
+    headers = {
+        # empty when the result stopped at the page and the count isn't known
+        "X-Total-Rows": "" if envelope.get("total_rows") is None else str(envelope["total_rows"]),
+        "X-Truncated": str(bool(envelope.get("truncated"))).lower(),
+        "X-Result-Handle": envelope.get("handle") or ""
+    }
+    return Response(body, mimetype=ARROW_MIME, headers=headers), 200
+
+def _execute_generated(query_result, filepath, offset=0, limit=None, records=True, cancel_key=None):
+    """Runs the generated code, returns (query_type, generated_code, query_results)"""
     query_type = query_result.get("query_type")
     
     if query_type == "pandas":
         pandas_query = query_result.get("pandas_query")
-        query_results = execute_pandas_query(filepath, pandas_query)
+        query_results = execute_pandas_query(filepath, pandas_query, offset, limit, records, cancel_key=cancel_key)
         generated_code = pandas_query 
     else:
         sql_query = query_result.get("sql_query")
         print(f"Running SQL: {sql_query}")
-        query_results = execute_query(filepath, sql_query)
+        query_results = execute_query(filepath, sql_query, offset, limit, records)
         generated_code = sql_query 
+    # only code that ran stays in the LLM cache
+    if query_results.get("success", False):
+        remember_query(query_result)
+    else:
+        forget_query(query_result)
+    return query_type, generated_code, query_results
+
+def _wants_stream(data):
+    accept = request.headers.get("Accept", "")
+    return bool(data.get("stream")) or STREAM_NDJSON in accept or STREAM_SSE in accept
+
+def _page_fields(query_results):
+    return {key: query_results.get(key) for key in ("handle", "offset", "limit", "total_rows", "truncated")}
+
+def _stream_query(user_query, filepath, use_sse, offset, limit, cancel_key=None):
+    """Streams code -> result rows in chunks -> explanation tokens, one event per line"""
+    def event(payload):
+        line = json.dumps(payload, default=str)
+        return f"data: {line}\n\n" if use_sse else line + "\n"
+
+    query_result, error = _generate_query(user_query, filepath)
+    if error:
+        yield event({"type": "error", "error": error[0].get("error")})
+        return
+    query_type = query_result.get("query_type")
+    generated_code = query_result.get("pandas_query") if query_type == "pandas" else query_result.get("sql_query")
+    yield event({"type": "query", "query_type": query_type, "generated_code": generated_code})
+
+    query_type, generated_code, query_results = _execute_generated(
+        query_result, filepath, offset, limit, cancel_key=cancel_key
+    )
+    if not query_results.get("success", False):
+        yield event({"type": "error", "error": query_results.get("error", "Unknown error occurred")})
+        return
+    rows = query_results.get("results") or []
+    columns = query_results.get("columns")
+    for i in range(0, max(len(rows), 1), STREAM_ROW_CHUNK):
+        yield event({"type": "rows", "columns": columns, "offset": i, "rows": rows[i:i + STREAM_ROW_CHUNK]})
+
+    for token in stream_query_explanation(query_results, user_query):
+        yield event({"type": "explanation", "token": token})
+    yield event(dict(_page_fields(query_results), type="done"))
+
+@query_bp.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "llm": llm_cache.stats(),
+        "datasets": dataset_cache.stats(),
+        "results": result_cache.stats()
+    }), 200
+
+@query_bp.route("/results/<handle>", methods=["GET"])
+def fetch_results(handle):
+    # more pages of an earlier /query result, served from the cached result frame
+    try:
+        offset, limit = _page_params(request.args)
+        fmt = _result_format(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    page = get_result_page(handle, offset, limit, records=fmt == FORMAT_RECORDS)
+    if not page.get("success", False):
+        return jsonify(page), 404
+    envelope = dict(_page_fields(page), success=True, columns=page.get("columns"))
+    return _results_response(envelope, page, fmt)
+
+@query_bp.route("/explain/<explanation_id>", methods=["GET"])
+def fetch_explanation(explanation_id):
+    # ?wait=N blocks for up to N seconds (capped at 30) instead of polling
+    wait = min(request.args.get("wait", 0, type=float), 30)
+    job = get_explanation(explanation_id, wait=wait)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown explanation id"}), 404
+    status_code = 202 if job["status"] == "pending" else 200
+    return jsonify(dict(job, success=job["status"] != "error")), status_code
+
+@query_bp.route("/query/<request_id>", methods=["DELETE"])
+def cancel_query(request_id):
+    # stops the generated code of a running /query that was sent with this "requestId"
+    if not cancel_job(request_id):
+        return jsonify({"success": False, "error": "No running query with that id"}), 404
+    return jsonify({"success": True, "cancelled": request_id}), 200
+
+@query_bp.route("/query", methods=["POST"])
+def handle_query():
+    data = request.json
+    user_query = data.get("query")
+    filepath = data.get("filePath", active_filepath)
+    if not user_query:
+        print("User query is missing!") 
+        return jsonify({"error": "Query required"}), 400
+        
+    if not filepath:
+        return jsonify({"error": "No file path provided"}), 400
+    
+    filepath = _resolve_query_file(filepath)
+    logger.debug(f"using file: {filepath}")
+    try:
+        offset, limit = _page_params(data)
+        fmt = _result_format({"format": request.args.get("format") or data.get("format")})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Streaming mode (NDJSON, or SSE if asked for), rows show up before the explanation is ready
+    if _wants_stream(data):
+        use_sse = STREAM_SSE in request.headers.get("Accept", "")
+        return Response(
+            stream_with_context(_stream_query(user_query, filepath, use_sse, offset, limit, data.get("requestId"))),
+            mimetype=STREAM_SSE if use_sse else STREAM_NDJSON
+        )
+    
+    # RAG
+    query_result, error = _generate_query(user_query, filepath)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    # "requestId" lets the client stop the generated code with DELETE /query/<requestId>
+    query_type, generated_code, query_results = _execute_generated(
+        query_result, filepath, offset, limit, records=fmt == FORMAT_RECORDS, cancel_key=data.get("requestId")
+    )
     
     if not query_results.get("success", False):
         return jsonify({
@@ -121,16 +287,23 @@ def handle_query():
             "generated_code": generated_code 
         }), 500
     
-    # Generate natural language explanation for results
-    explanation = explain_query_results(query_results, user_query)
+    # Explanation is a whole extra LLM call, so by default it runs in the background
+    # and the client fetches it from /explain/<id>. "explain": "inline" waits for it like before
+    explanation = None
+    explanation_id = None
+    if data.get("explain", "deferred") == "inline":
+        explanation = explain_query_results(query_results, user_query)
+    else:
+        explanation_id = submit_explanation(query_results, user_query)
     
     response_data = {
         "success": True,
         "query_type": query_type,
         "generated_code": generated_code,
-        "results": query_results.get("results"),
         "columns": query_results.get("columns"),
-        "explanation": explanation
+        "explanation": explanation,
+        "explanation_id": explanation_id,
+        **_page_fields(query_results)
     }
     
-    return jsonify(response_data), 200
\ No newline at end of file
+    return _results_response(response_data, query_results, fmt)
\ No newline at end of file
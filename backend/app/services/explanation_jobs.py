@@ -0,0 +1,59 @@
+# Background jobs for the natural language explanation of query results.
+# The explanation is a whole extra LLM round trip, so /query no longer waits for it.
+# It gets started on a small thread pool and the client picks it up from /explain/<id>.
+
+import os
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from app.services.ollama_service import explain_query_results
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+EXPLAIN_WORKERS = int(os.getenv('EXPLAIN_WORKERS', 2))
+# finished explanations nobody came back for get dropped after this many seconds
+EXPLAIN_TTL = int(os.getenv('EXPLAIN_TTL', 3600))
+
+_executor = ThreadPoolExecutor(max_workers=EXPLAIN_WORKERS, thread_name_prefix="explain")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _drop_expired(now):
+    expired = [job_id for job_id, job in _jobs.items() if now - job["created"] > EXPLAIN_TTL]
+    for job_id in expired:
+        _jobs.pop(job_id).get("future").cancel()
+
+
+def submit_explanation(results, user_query):
+    """Starts explaining in the background, returns the id to fetch it with"""
+    explanation_id = uuid.uuid4().hex
+    future = _executor.submit(explain_query_results, results, user_query)
+    now = time.time()
+    with _jobs_lock:
+        _drop_expired(now)
+        _jobs[explanation_id] = {"future": future, "created": now}
+    return explanation_id
+
+
+def get_explanation(explanation_id, wait=0):
+    """None if the id is unknown, otherwise the job status (waits up to `wait` seconds for it)"""
+    with _jobs_lock:
+        job = _jobs.get(explanation_id)
+    if job is None:
+        return None
+    future = job["future"]
+    try:
+        explanation = future.result(timeout=wait)
+    except FutureTimeout:
+        return {"status": "pending", "explanation": None}
+    except Exception as e:
+        logger.exception(f"Explanation job failed: {str(e)}")
+        return {"status": "error", "explanation": None, "error": str(e)}
+    return {"status": "done", "explanation": explanation}
@@ -0,0 +1,113 @@
+# Cache for generated queries.
+# People ask the same questions against the same files all day, and each one used to
+# cost a full Ollama round trip. Responses are keyed by
+# (model, query type, normalised question, dataset fingerprint, prompt version).
+# There's an in-memory LRU tier and an optional SQLite tier with a TTL (LLM_CACHE_PATH).
+# Only code that ran is cached (remember_query), a cached answer that fails is dropped.
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from app.utils.dataset_cache import LRUByteCache
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 1000))
+# leave unset to only cache in memory
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH')
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600))
+
+
+def normalize_question(question):
+    # "How many customers per state?" == "how many  customers per state"
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?.! ")
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries=LLM_CACHE_SIZE, db_path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL):
+        # every entry counts as 1, so the byte budget is really an entry budget
+        self._memory = LRUByteCache(max_entries, sizeof=lambda value: 1)
+        self.db_path = db_path
+        self.ttl = ttl
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(model, query_type, question, dataset_fingerprint, prompt_version):
+        raw = json.dumps([model, query_type, normalize_question(question), dataset_fingerprint, prompt_version])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        value = self._memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self._conn is not None:
+            with self._db_lock:
+                row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and time.time() - row[1] <= self.ttl:
+                value = json.loads(row[0])
+                self._memory.put(key, value)
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._memory.put(key, value)
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time())
+                )
+                # expired rows are dead weight, clear them out while we have the lock
+                self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+                self._conn.commit()
+
+    def delete(self, key):
+        self._memory.discard(lambda k: k == key)
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def clear(self):
+        self._memory.clear()
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._conn is not None
+        }
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,103 @@
+# Shared HTTP client for talking to Ollama.
+# Every LLM call used to do a bare requests.post (new TCP connection each time and no
+# timeout, so a stuck model could hang a worker forever). All calls now go through one
+# pooled keep-alive session with connect/read timeouts.
+#
+# Every request also carries the same keep_alive and num_ctx. keep_alive keeps the model
+# loaded between questions (Ollama unloads it after 5 idle minutes by default), and with
+# num_ctx fixed, requests never ask for a different context size, which would make
+# Ollama reload the model and drop the KV cache of the previous prompt. With both, the
+# prompt prefix it already evaluated (instructions + schema) is reused.
+
+import os
+import json
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', 'http://localhost:11434/api/chat')
+# seconds, generation can take a while on small machines so the read timeout is generous
+CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('OLLAMA_READ_TIMEOUT', 120))
+POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', 10))
+
+
+def _keep_alive(value):
+    # Ollama takes seconds as a number (negative = forever) or a duration string like "30m"
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+# "" = Ollama's default (5m)
+OLLAMA_KEEP_ALIVE = _keep_alive(os.getenv('OLLAMA_KEEP_ALIVE', '30m'))
+# room for PROMPT_TOKEN_BUDGET plus the answer; 0 = Ollama's default, which truncates
+# longer prompts from the start
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', 4096))
+
+
+def with_ollama_defaults(payload):
+    """The payload with keep_alive and num_ctx set, unless it sets them itself"""
+    payload = dict(payload)
+    if OLLAMA_KEEP_ALIVE != "":
+        payload.setdefault("keep_alive", OLLAMA_KEEP_ALIVE)
+    if OLLAMA_NUM_CTX:
+        payload["options"] = {"num_ctx": OLLAMA_NUM_CTX, **payload.get("options", {})}
+    return payload
+
+
+class LLMClient:
+    def __init__(self, api_url=None, connect_timeout=None, read_timeout=None, pool_size=None):
+        self.api_url = api_url or OLLAMA_API_URL
+        self.timeout = (connect_timeout or CONNECT_TIMEOUT, read_timeout or READ_TIMEOUT)
+        pool_size = pool_size or POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def chat(self, payload):
+        """POST a chat payload and return the decoded JSON response"""
+        res = self.session.post(self.api_url, json=with_ollama_defaults(payload), timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def chat_stream(self, payload):
+        """Same as chat() but with Ollama streaming on, yields each decoded NDJSON chunk"""
+        payload = with_ollama_defaults(dict(payload, stream=True))
+        with self.session.post(self.api_url, json=payload, timeout=self.timeout, stream=True) as res:
+            res.raise_for_status()
+            for line in res.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def preload(self, model):
+        """Loads the model without generating anything, so the first question doesn't wait for it"""
+        self.chat({"model": model, "messages": [], "stream": False})
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Process wide client so every request reuses the same connection pool"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
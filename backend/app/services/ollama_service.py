@@ -1,4 +1,3 @@
-import requests
 import json
 import os
 import re
@@ -10,7 +9,13 @@ from app.utils.rag_examples import (
     get_file_connections,
     format_examples_for_prompt
 )
-from app.utils.db_handler import get_enhanced_schema_with_samples
+from app.utils.db_handler import get_prompt_schema, get_question_columns
+from app.utils.prompt_budget import estimate_tokens, schema_budget, PROMPT_TOKEN_BUDGET
+from app.utils.dataset_catalog import dataset_catalog
+from app.services.llm_client import get_llm_client
+from app.services.llm_cache import llm_cache
+from app.utils.dataset_cache import dataset_fingerprint
+from app.utils.result_encoding import encode_records
 
 logging.basicConfig(
     level=logging.DEBUG, 
@@ -18,28 +23,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 load_dotenv()
-OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', 'http://localhost:11434/api/chat')
 MODEL_NAME = os.getenv('MODEL_NAME', 'llama3')
 
 QUERY_TYPE_SQL = 'sql'
 QUERY_TYPE_PANDAS = 'pandas'
 
-def get_sql_query(user_query, schema_info, file_path=None):
-  # enhanced schema with sample data 
-  if file_path:
-    enhanced_schema = get_enhanced_schema_with_samples(file_path)
-    file_name = os.path.splitext(os.path.basename(file_path))[0]
-    examples = find_examples(user_query, file_name)
-    examples_text = format_examples_for_prompt(examples)
-  else:
-    enhanced_schema = schema_info
-    examples_text = ""
-  
-  # Prompt needs to be super specific, following prompt worked better during testing
-  prompt = f"""You're an SQL assistant. Using the following database schema and sample data:
+# Bump whenever the prompts below change so cached responses from old prompts aren't reused
+PROMPT_VERSION = 4
+
+# Prompts are two messages. The system message (instructions, then the dataset and its
+# schema) is the same for every question on a dataset, so Ollama reuses the KV cache it
+# built for it and only evaluates the user message: examples, the columns the question
+# needs and the question. Anything that depends on the question stays out of the system
+# message, or the cached prefix ends there.
 
-{enhanced_schema}
-{examples_text}
+# Prompt needs to be super specific, following prompt worked better during testing
+SQL_INSTRUCTIONS = """You're an SQL assistant. You write queries using the database schema and sample data given below.
 
 When writing the query, follow these guidelines carefully:
 
@@ -61,28 +60,129 @@ Specific handling for common queries:
 - For "count" or "how many" questions, use COUNT() with appropriate GROUP BY
 - For "average" questions, use AVG() function
 
-return **only** the SQL query — no explanations, comments, or markdown.
+return **only** the SQL query — no explanations, comments, or markdown."""
 
-Finally, please generate a valid SQL query to answer this question: "{user_query}"
-"""
-  stuff_to_send = {
+PANDAS_INSTRUCTIONS = """You are a data query assistant that helps translate natural language questions into Pandas code, using the CSV file schema and sample data given below.
+
+When generating Pandas queries, please follow these guidelines:
+1. The CSV file is already loaded into a Pandas DataFrame called df — use it directly in your query.
+2. Use the exact string values shown in the examples — don't shorten or tweak them.
+3. Use the exact column names from the schema — don't rename, abbreviate, or modify them.
+4. For filtering operations, use the appropriate Pandas methods (df.loc, df.query, etc.).
+5. For aggregation queries, use groupby(), agg(), etc. appropriately.
+6. For queries involving states or locations (like 'GO', 'CA', or 'NY'), make comparisons case-insensitive when needed.
+7. For popularity or frequency analysis, use value_counts() or groupby() with size() or count().
+8. Just return the columns that are actually relevant
+9. Limit the number of results when appropriate (e.g., using .head(N) for top N queries).
+10. Use proper Pandas syntax and best practices.
+11. Write your code as a single expression that returns either a DataFrame or a Series — no multi-step code.
+
+Specific handling for common queries:
+- When asked for "first N rows", always use "df.head(N)"
+- For "total" or "sum" questions, use df.groupby().sum() with appropriate column
+- For "count" or "how many" questions, use len(), count(), or value_counts()
+- For "average" or "mean" questions, use mean() function on appropriate column
+- For order information (like "when was order X delivered"), use appropriate filtering on order_id
+
+Return only the pandas code to execute — no explanations, comments, or markdown. Use a one-line expression that can be directly executed."""
+
+def _cache_key(query_type, user_query, file_path):
+  if not file_path:
+    return None
+  try:
+    return llm_cache.make_key(MODEL_NAME, query_type, user_query, dataset_fingerprint(file_path), PROMPT_VERSION)
+  except OSError:
+    return None
+
+def _cached_response(cache_key):
+  cached = llm_cache.get(cache_key) if cache_key else None
+  if cached:
+    logger.debug("LLM response cache hit")
+    return dict(cached, cache_key=cache_key, cached=True)
+  return None
+
+def remember_query(query_result):
+  """Caches generated code once it ran fine, wrong answers would stick for the whole TTL otherwise"""
+  cache_key = query_result.get("cache_key")
+  if cache_key and not query_result.get("cached"):
+    llm_cache.put(cache_key, {k: v for k, v in query_result.items() if k not in ("cache_key", "cached")})
+
+def forget_query(query_result):
+  """Drops the cached code of a query whose code failed, the next ask goes to the model again"""
+  cache_key = query_result.get("cache_key")
+  if cache_key and query_result.get("cached"):
+    llm_cache.delete(cache_key)
+
+def _dataset_context(file_path):
+  """(catalog name, RAG file type, description line) of an upload"""
+  try:
+    entry = dataset_catalog.entry_for(file_path)
+    return entry["name"], entry["file_type"], f"Dataset: {entry['description']}\n"
+  except Exception as e:
+    logger.info(f"No catalog entry for {file_path}: {str(e)}")
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+    return file_name, file_name, ""
+
+def _prompt_schema(prefix_text, user_query, schema_info, file_path):
+  """(schema for the system message, stats of the columns the question needs for the user message).
+  The schema gets the tokens the rest of the system message leaves and doesn't depend on the question."""
+  if not file_path:
+    return str(schema_info), ""
+  schema = str(get_prompt_schema(file_path, schema_budget(prefix_text)))
+  return schema, get_question_columns(file_path, user_query, schema)
+
+def _chat_payload(system_prompt, user_prompt):
+  logger.info(f"Prompt is ~{estimate_tokens(system_prompt)} + {estimate_tokens(user_prompt)} tokens "
+              f"(cached prefix + question, budget {PROMPT_TOKEN_BUDGET})")
+  return {
     "model": MODEL_NAME,
     "messages": [
-      {"role": "user", "content": prompt}
+      {"role": "system", "content": system_prompt},
+      {"role": "user", "content": user_prompt}
     ],
     "stream": False
   }
+
+def build_sql_payload(user_query, schema_info, file_path=None):
+  # enhanced schema with sample data, as much of it as fits the token budget
+  if file_path:
+    _, file_type, dataset_text = _dataset_context(file_path)
+    examples = find_examples(user_query, file_type)
+    examples_text = format_examples_for_prompt(examples)
+  else:
+    dataset_text = ""
+    examples_text = ""
+  schema, columns_text = _prompt_schema(SQL_INSTRUCTIONS + dataset_text, user_query, schema_info, file_path)
+
+  system_prompt = f"""{SQL_INSTRUCTIONS}
+
+Database schema and sample data:
+
+{dataset_text}{schema}"""
+  user_prompt = f"""{examples_text}{columns_text}
+Finally, please generate a valid SQL query to answer this question: "{user_query}"
+"""
+  return _chat_payload(system_prompt, user_prompt)
+
+def get_sql_query(user_query, schema_info, file_path=None):
+  cache_key = _cache_key(QUERY_TYPE_SQL, user_query, file_path)
+  cached = _cached_response(cache_key)
+  if cached:
+    return cached
   
+  stuff_to_send = build_sql_payload(user_query, schema_info, file_path)
   try:
-    res = requests.post(OLLAMA_API_URL, json=stuff_to_send)
-    res.raise_for_status() 
-    data = res.json()
+    data = get_llm_client().chat(stuff_to_send)
     query = data.get('message', {}).get('content', '').strip()
-    return {
+    result = {
       "success": True,
       "query_type": QUERY_TYPE_SQL,
       "sql_query": query
     }
+    # cached by remember_query once the query ran
+    if cache_key and query:
+      result["cache_key"] = cache_key
+    return result
   except Exception as e:
     return {
       "success": False,
@@ -90,83 +190,62 @@ Finally, please generate a valid SQL query to answer this question: "{user_query
       "message": "Failed to generate SQL query"
     }
 
-def get_pandas_query(user_query, schema_info, file_path=None):
-  export_meta = {"is_export": False}
-  
+def build_pandas_payload(user_query, schema_info, file_path=None):
   if file_path:
-    enhanced_schema = get_enhanced_schema_with_samples(file_path)
-    file_name = os.path.splitext(os.path.basename(file_path))[0]
-    relationship_info = get_file_connections(file_name)
-    examples = find_examples(user_query, file_name)
+    dataset_name, file_type, dataset_text = _dataset_context(file_path)
+    relationship_info = get_file_connections(dataset_name)
+    examples = find_examples(user_query, file_type)
     examples_text = format_examples_for_prompt(examples)
   else:
-    enhanced_schema = schema_info
+    dataset_text = ""
     relationship_info = ""
     examples_text = ""
-  
+  schema, columns_text = _prompt_schema(PANDAS_INSTRUCTIONS + dataset_text + relationship_info,
+                                        user_query, schema_info, file_path)
+
   cols = []  
-  if "Database Schema:" in enhanced_schema:
-    lines = enhanced_schema.split('\n')
+  if "Database Schema:" in schema:
+    lines = schema.split('\n')
     for l in lines:  
       if "Columns:" in l:
         cols_part = l.split("Columns:")[1].strip()
         cols = [c.strip() for c in cols_part.split(',')]  
   logger.debug(f"Available columns: {cols}")
-  
-  prompt = f"""You are a data query assistant that helps translate natural language questions into Pandas code.
-
-Given the following CSV file schema and sample data:
-
-{enhanced_schema}
-{relationship_info}
-{examples_text}
-
-When generating Pandas queries, please follow these guidelines:
-1. The CSV file is already loaded into a Pandas DataFrame called df — use it directly in your query.
-2. Use the exact string values shown in the examples — don't shorten or tweak them.
-3. Use the exact column names from the schema — don't rename, abbreviate, or modify them.
-4. For filtering operations, use the appropriate Pandas methods (df.loc, df.query, etc.).
-5. For aggregation queries, use groupby(), agg(), etc. appropriately.
-6. For queries involving states or locations (like 'GO', 'CA', or 'NY'), make comparisons case-insensitive when needed.
-7. For popularity or frequency analysis, use value_counts() or groupby() with size() or count().
-8. Just return the columns that are actually relevant
-9. Limit the number of results when appropriate (e.g., using .head(N) for top N queries).
-10. Use proper Pandas syntax and best practices.
-11. Write your code as a single expression that returns either a DataFrame or a Series — no multi-step code.
 
-Specific handling for common queries:
-- When asked for "first N rows", always use "df.head(N)"
-- For "total" or "sum" questions, use df.groupby().sum() with appropriate column
-- For "count" or "how many" questions, use len(), count(), or value_counts()
-- For "average" or "mean" questions, use mean() function on appropriate column
-- For order information (like "when was order X delivered"), use appropriate filtering on order_id
+  system_prompt = f"""{PANDAS_INSTRUCTIONS}
 
-Return only the pandas code to execute — no explanations, comments, or markdown. Use a one-line expression that can be directly executed:
+CSV file schema and sample data:
 
+{dataset_text}{schema}
+{relationship_info}"""
+  user_prompt = f"""{examples_text}{columns_text}
 Translate this question: "{user_query}"
 """
+  return _chat_payload(system_prompt, user_prompt)
 
-  stuff_to_send = {
-    "model": MODEL_NAME,
-    "messages": [
-      {"role": "user", "content": prompt}
-    ],
-    "stream": False
-  }
+def get_pandas_query(user_query, schema_info, file_path=None):
+  export_meta = {"is_export": False}
+  cache_key = _cache_key(QUERY_TYPE_PANDAS, user_query, file_path)
+  cached = _cached_response(cache_key)
+  if cached:
+    return cached
   
+  stuff_to_send = build_pandas_payload(user_query, schema_info, file_path)
   try:
-    res = requests.post(OLLAMA_API_URL, json=stuff_to_send)
-    res.raise_for_status()
-    data = res.json()
+    data = get_llm_client().chat(stuff_to_send)
     query = data.get('message', {}).get('content', '').strip()
     query = clean_code_response(query)
     
-    return {
+    result = {
       "success": True,
       "query_type": QUERY_TYPE_PANDAS,
       "pandas_query": query,
       "export_meta": export_meta
     }
+    # cached by remember_query once the code ran
+    if cache_key and query:
+      result["cache_key"] = cache_key
+    return result
   except Exception as e:
     logger.exception(f"Error in get_pandas_query: {str(e)}")
     return {
@@ -175,6 +254,14 @@ Translate this question: "{user_query}"
       "message": "Failed to generate pandas query"
     }
 
+def preload_model():
+  """Loads the model so the first question doesn't wait for it, keep_alive keeps it loaded after"""
+  try:
+    get_llm_client().preload(MODEL_NAME)
+    logger.info(f"Model {MODEL_NAME} loaded")
+  except Exception as e:
+    logger.info(f"Couldn't preload {MODEL_NAME}: {str(e)}")
+
 # Clean the LLM code response to remove markdown and other annotations
 def clean_code_response(response):
   code = re.sub(r'```python\s*', '', response)
@@ -200,43 +287,65 @@ def clean_code_response(response):
   
   return code.strip()
 
-# Generate a natural language explanation 
-def explain_query_results(results, user_query):
-  try:
-    if not results.get("success", False):
-      return f"Problem executing: {results.get('error', 'Unknown error')}"
-    
-    # Limit the amount of data we send to the model
-    data_preview = results.get("data", [])
-    if isinstance(data_preview, list) and len(data_preview) > 5:
-      data_preview = data_preview[:5]
-      trunc_note = "(showing first 5 rows)"
-    else:
-      trunc_note = ""
-    
-    prompt = f"""Given the following query and results, provide a clear and concise explanation of the data:
+def build_explanation_payload(results, user_query, stream=False):
+  # Limit the amount of data we send to the model
+  data_preview = results.get("results")
+  if data_preview is None and results.get("page") is not None:
+    # columnar/arrow responses don't build records, only the first few rows are needed here
+    data_preview = encode_records(results["page"].head(6))
+  data_preview = data_preview or []
+  if isinstance(data_preview, list) and len(data_preview) > 5:
+    data_preview = data_preview[:5]
+    trunc_note = "(showing first 5 rows)"
+  else:
+    trunc_note = ""
+  
+  prompt = f"""Given the following query and results, provide a clear and concise explanation of the data:
 
 Query: "{user_query}"
 
-Results: {json.dumps(data_preview, indent=2)} {trunc_note}
+Results: {json.dumps(data_preview, indent=2, default=str)} {trunc_note}
 
 Explain what these results mean in plain language. Be concise but informative. Focus on highlighting key insights or patterns:
 """
 
-    stuff_to_send = {
-      "model": MODEL_NAME,
-      "messages": [
-        {"role": "user", "content": prompt}
-      ],
-      "stream": False
-    }
+  return {
+    "model": MODEL_NAME,
+    "messages": [
+      {"role": "user", "content": prompt}
+    ],
+    "stream": stream
+  }
+
+# Generate a natural language explanation 
+def explain_query_results(results, user_query):
+  try:
+    if not results.get("success", False):
+      return f"Problem executing: {results.get('error', 'Unknown error')}"
     
-    res = requests.post(OLLAMA_API_URL, json=stuff_to_send)
-    res.raise_for_status()
-    data = res.json()
+    stuff_to_send = build_explanation_payload(results, user_query)
+    data = get_llm_client().chat(stuff_to_send)
     explanation = data.get('message', {}).get('content', '').strip()
     
     return explanation
   except Exception as e:
     logger.exception(f"Error explaining results: {str(e)}")
     return "I can't generate an explanation for these results."
+
+# Same as explain_query_results but yields the explanation token by token as Ollama generates it
+def stream_query_explanation(results, user_query):
+  if not results.get("success", False):
+    yield f"Problem executing: {results.get('error', 'Unknown error')}"
+    return
+  
+  stuff_to_send = build_explanation_payload(results, user_query, stream=True)
+  try:
+    for chunk in get_llm_client().chat_stream(stuff_to_send):
+      token = chunk.get('message', {}).get('content', '')
+      if token:
+        yield token
+      if chunk.get('done'):
+        break
+  except Exception as e:
+    logger.exception(f"Error streaming explanation: {str(e)}")
+    yield "I can't generate an explanation for these results."
@@ -5,6 +5,9 @@ from langchain_core.messages import AIMessage
 from langchain.schema.runnable import RunnableLambda
 from app.services.langchain_service import generate_sql_query, generate_pandas_query
 from app.utils.shared_state import SharedState 
+from app.utils import code_sandbox
+from app.utils.sqlite_pool import sqlite_pool
+from app.utils.sql_backends import fetch_batches
 import logging
 import os
 
@@ -15,21 +18,29 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def run_sql_query(query, db_path):
+def run_sql_query(query, db_path, max_rows=None):
     abs_db_path = os.path.abspath(db_path) 
     logger.info(f"running SQL on -> {abs_db_path}")
     if not os.path.exists(abs_db_path):
         return f"Database file not found at {abs_db_path}"
     
-    conn = sqlite3.connect(abs_db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    logger.info(f" query -> {query.strip()}")
-    cursor.execute(query.strip())
-    results = cursor.fetchall()
-    conn.close()
+    with sqlite_pool.connection(abs_db_path) as conn:
+        cursor = conn.cursor()
+        # on the cursor, pooled connections are shared
+        cursor.row_factory = sqlite3.Row
+        logger.info(f" query -> {query.strip()}")
+        cursor.execute(query.strip())
+        # in batches, stopping at max_rows rather than reading the whole result
+        results = [dict(row) for batch in fetch_batches(cursor, max_rows) for row in batch]
+        cursor.close()
 
-    return [dict(row) for row in results] if results else []
+    return results
+
+def _evaluate(query, df):
+    # generated code runs in a sandbox worker (time/memory limits), not in this process
+    if code_sandbox.SANDBOX_ENABLED:
+        return code_sandbox.eval_on_frame(df, query)
+    return eval(query, {"df": df})
 
 def run_pandas_query(query, df):
     try:
@@ -40,7 +51,7 @@ def run_pandas_query(query, df):
         
         # Handle other functions that return scalar values
         if any(agg_func in query for agg_func in ['.mean()', '.sum()', '.min()', '.max()', '.count()']):
-            result = eval(query, {"df": df})
+            result = _evaluate(query, df)
             if not isinstance(result, pd.DataFrame):
                 label = 'Value'
                 if '.mean()' in query:
@@ -63,7 +74,7 @@ def run_pandas_query(query, df):
                     return pd.DataFrame({f"{label} of {col_name}": [result]})
                 else:
                     return pd.DataFrame({label: [result]})
-        result = eval(query, {"df": df})
+        result = _evaluate(query, df)
         if isinstance(result, pd.DataFrame):
             return result
         return pd.DataFrame({"Result": [result]})
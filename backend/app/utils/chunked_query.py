@@ -0,0 +1,657 @@
+# Out-of-core execution of generated pandas code, for CSVs too big to load whole.
+# Generated code is nearly always one chain on df: row filters / column picks first,
+# then head, value_counts, groupby().agg, sort_values().head(n) or a plain reduction,
+# then some tidying (reset_index, rename, another sort...). The chain is split into
+#   map     - the row-local part, run on every chunk (read_csv chunksize)
+#   reduce  - partial results per chunk, combined as the chunks come in
+#   finish  - the rest, run once on the (small) combined result
+# Code that doesn't fit raises NotDecomposable and the caller loads the whole file.
+
+import os
+import ast
+import copy
+import logging
+import numpy as np
+import pandas as pd
+from app.utils.upload_ingest import read_uploaded_csv
+from app.utils.parquet_copy import get_parquet_copy, iter_parquet_chunks
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# CSVs at least this big (bytes on disk) are never loaded whole if it can be avoided
+CHUNKED_CSV_BYTES = int(os.getenv('CHUNKED_CSV_BYTES', 1024 * 1024 * 1024))
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', 250000))
+
+# same environment the generated code gets in db_handler
+EVAL_GLOBALS = {'pd': pd, 'np': np, '__builtins__': {}}
+
+# methods that work value by value, so chunk results line up with the full result
+ELEMENTWISE_METHODS = {
+    "isin", "isna", "notna", "isnull", "notnull", "between", "abs", "round", "fillna",
+    "astype", "clip", "eq", "ne", "lt", "le", "gt", "ge", "add", "sub", "mul", "div"
+}
+STR_METHODS = {
+    "contains", "startswith", "endswith", "lower", "upper", "strip", "lstrip", "rstrip",
+    "len", "replace", "slice", "match", "fullmatch", "title", "capitalize", "split", "get", "zfill"
+}
+DT_FIELDS = {
+    "year", "month", "day", "hour", "minute", "second", "date", "dayofweek", "day_of_week",
+    "weekday", "quarter", "dayofyear", "day_of_year"
+}
+DT_METHODS = {"strftime", "normalize", "floor", "ceil", "round", "day_name", "month_name"}
+NP_FUNCTIONS = {"where", "abs", "log", "log1p", "log10", "sqrt", "exp", "round", "floor", "ceil", "isnan"}
+PD_FUNCTIONS = {"to_datetime", "to_numeric", "isna", "notna"}
+# groupby aggregations that can be combined from per chunk partials
+GROUP_FUNCTIONS = {"sum", "count", "size", "min", "max", "mean"}
+SCALAR_FUNCTIONS = {"sum", "count", "min", "max", "mean", "nunique", "unique"}
+
+
+class NotDecomposable(Exception):
+    """The code can't be run chunk by chunk, load the whole file instead"""
+
+
+def is_large_csv(file_path):
+    return file_path.lower().endswith(".csv") and os.path.getsize(file_path) >= CHUNKED_CSV_BYTES
+
+
+def iter_csv_chunks(file_path, chunk_rows=None, filters=None, **kwargs):
+    """Chunks of the upload, from its Parquet copy when there is one. `filters` (see
+    row_filters) lets the Parquet copy skip row groups, the CSV is read whole."""
+    parquet_path = get_parquet_copy(file_path) if set(kwargs) <= {"usecols"} else None
+    if parquet_path:
+        yield from iter_parquet_chunks(parquet_path, chunk_rows or CSV_CHUNK_ROWS, kwargs.get("usecols"), filters)
+        return
+    with read_uploaded_csv(file_path, chunksize=chunk_rows or CSV_CHUNK_ROWS, **kwargs) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def csv_columns(file_path):
+    return read_uploaded_csv(file_path, nrows=0).columns.tolist()
+
+
+def _is_name(node, name):
+    return isinstance(node, ast.Name) and node.id == name
+
+
+def _is_constant(node):
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return all(_is_constant(elt) for elt in node.elts)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return _is_constant(node.operand)
+    # np.nan, pd.NaT...
+    return isinstance(node, ast.Attribute) and (_is_name(node.value, "np") or _is_name(node.value, "pd"))
+
+
+def _constant_labels(node):
+    """'col' or ['a', 'b'] -> the labels, None for anything else"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, (ast.List, ast.Tuple)) and node.elts and \
+            all(isinstance(elt, ast.Constant) and isinstance(elt.value, str) for elt in node.elts):
+        return [elt.value for elt in node.elts]
+    return None
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        raise NotDecomposable("non literal argument")
+
+
+def _call_args_row_local(call, columns):
+    return all(_is_constant(arg) or _row_local(arg, columns) for arg in call.args) and \
+        all(_is_constant(kw.value) or _row_local(kw.value, columns) for kw in call.keywords)
+
+
+def _row_local(node, columns):
+    """True when evaluating node on a chunk gives that chunk's rows of the full result"""
+    if _is_name(node, "df"):
+        return True
+    if isinstance(node, ast.Attribute):
+        if _is_name(node.value, "df"):
+            return node.attr in columns
+        if isinstance(node.value, ast.Attribute) and node.value.attr == "dt":
+            return node.attr in DT_FIELDS and _row_local(node.value.value, columns)
+        return False
+    if isinstance(node, ast.Subscript):
+        target = node.value
+        key = node.slice
+        if isinstance(target, ast.Attribute) and target.attr == "loc":
+            if not _row_local(target.value, columns):
+                return False
+            if isinstance(key, ast.Tuple) and len(key.elts) == 2:
+                rows, cols = key.elts
+                full_rows = isinstance(rows, ast.Slice) and rows.lower is None and rows.upper is None
+                return (full_rows or _row_local(rows, columns)) and _constant_labels(cols) is not None
+            return not _is_constant(key) and _row_local(key, columns)
+        if not _row_local(target, columns):
+            return False
+        # column pick, or a boolean mask
+        return _constant_labels(key) is not None or (not _is_constant(key) and _row_local(key, columns))
+    if isinstance(node, ast.Compare):
+        operands = [node.left] + node.comparators
+        return any(not _is_constant(op) for op in operands) and \
+            all(_is_constant(op) or _row_local(op, columns) for op in operands)
+    if isinstance(node, ast.BinOp):
+        operands = [node.left, node.right]
+        return any(not _is_constant(op) for op in operands) and \
+            all(_is_constant(op) or _row_local(op, columns) for op in operands)
+    if isinstance(node, ast.UnaryOp):
+        return _row_local(node.operand, columns)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        func = node.func
+        method = func.attr
+        if _is_name(func.value, "np"):
+            return method in NP_FUNCTIONS and _call_args_row_local(node, columns)
+        if _is_name(func.value, "pd"):
+            return method in PD_FUNCTIONS and _call_args_row_local(node, columns)
+        if isinstance(func.value, ast.Attribute) and func.value.attr in ("str", "dt"):
+            allowed = STR_METHODS if func.value.attr == "str" else DT_METHODS
+            return method in allowed and _row_local(func.value.value, columns) and \
+                all(_is_constant(arg) for arg in node.args) and \
+                all(_is_constant(kw.value) for kw in node.keywords)
+        if not _row_local(func.value, columns):
+            return False
+        if method == "assign":
+            return not node.args and _call_args_row_local(node, columns)
+        if method == "dropna":
+            return not node.args and all(kw.arg in ("subset", "how") and _is_constant(kw.value) for kw in node.keywords)
+        if method in ("rename", "drop"):
+            return not node.args and all(kw.arg == "columns" and _is_constant(kw.value) for kw in node.keywords)
+        if method == "query":
+            # plain column expressions only, no @variables or calls
+            return len(node.args) == 1 and not node.keywords and isinstance(node.args[0], ast.Constant) and \
+                isinstance(node.args[0].value, str) and not any(c in node.args[0].value for c in "@(")
+        return method in ELEMENTWISE_METHODS and all(_is_constant(arg) for arg in node.args) and \
+            all(_is_constant(kw.value) for kw in node.keywords)
+    return False
+
+
+_FILTER_OPS = {ast.Eq: "==", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+_FLIPPED_OPS = {"==": "==", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+
+def _column_ref(node, columns):
+    """df['col'] / df.col -> 'col', None for anything else"""
+    if isinstance(node, ast.Subscript) and _is_name(node.value, "df") and \
+            isinstance(node.slice, ast.Constant) and node.slice.value in columns:
+        return node.slice.value
+    if isinstance(node, ast.Attribute) and _is_name(node.value, "df") and node.attr in columns:
+        return node.attr
+    return None
+
+
+def _filter_value(node):
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return None
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    # no None/NaN/bools, their matching rules aren't plain ordering
+    if not values or not all(isinstance(v, (int, float, str)) and not isinstance(v, bool) and v == v for v in values):
+        return None
+    return value
+
+
+def _conjunct_filters(node, columns):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+        return _conjunct_filters(node.left, columns) + _conjunct_filters(node.right, columns)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _FILTER_OPS:
+        op = _FILTER_OPS[type(node.ops[0])]
+        column, other = _column_ref(node.left, columns), node.comparators[0]
+        if column is None:
+            column, other, op = _column_ref(other, columns), node.left, _FLIPPED_OPS[op]
+        value = _filter_value(other)
+        if column is not None and value is not None and not isinstance(value, (list, tuple, set)):
+            return [(column, op, value)]
+    if _method_call(node, "isin") and len(node.args) == 1 and not node.keywords:
+        column, values = _column_ref(node.func.value, columns), _filter_value(node.args[0])
+        if column is not None and isinstance(values, (list, tuple, set)):
+            return [(column, "in", list(values))]
+    if _method_call(node, "between") and len(node.args) == 2 and not node.keywords:
+        column = _column_ref(node.func.value, columns)
+        low, high = _filter_value(node.args[0]), _filter_value(node.args[1])
+        if column is not None and low is not None and high is not None:
+            return [(column, ">=", low), (column, "<=", high)]
+    # anything else just isn't used to skip data
+    return []
+
+
+def row_filters(pandas_code, columns):
+    """(column, op, value) conditions every row the code looks at meets, [] if there are none.
+
+    Only when all the code does with df goes through one boolean mask (df[mask] /
+    df.loc[mask, ...]) made of row-local expressions: rows failing the mask can't change
+    the result, so data that can't pass it doesn't need to be read at all.
+    """
+    try:
+        tree = ast.parse(pandas_code.strip(), mode="eval")
+    except SyntaxError:
+        return []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Subscript):
+            continue
+        frame, mask = node.value, node.slice
+        if isinstance(frame, ast.Attribute) and frame.attr == "loc":
+            frame = frame.value
+            if isinstance(mask, ast.Tuple) and len(mask.elts) == 2:
+                mask = mask.elts[0]
+        if not _is_name(frame, "df") or isinstance(mask, ast.Slice) or _is_constant(mask) or \
+                _constant_labels(mask) is not None or not _row_local(mask, columns):
+            continue
+        allowed = {id(frame)} | {id(sub) for sub in ast.walk(mask)}
+        if all(id(sub) in allowed for sub in ast.walk(tree) if _is_name(sub, "df")):
+            return _conjunct_filters(mask, columns)
+        return []
+    return []
+
+
+def _chain(root, columns):
+    """[df, df[...], df[...].groupby(...), ...] from the innermost node out, None if it isn't a df chain.
+
+    The chain can also start at a row-local expression, e.g. (df['a'] > 3).sum()
+    """
+    nodes = [root]
+    node = root
+    while not _is_name(node, "df"):
+        if isinstance(node, (ast.Compare, ast.BinOp, ast.UnaryOp)) and _row_local(node, columns):
+            break
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            node = node.func.value
+        elif isinstance(node, (ast.Subscript, ast.Attribute)):
+            node = node.value
+        else:
+            return None
+        nodes.append(node)
+    nodes.reverse()
+    return nodes
+
+
+def _method_call(node, *names):
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in names
+
+
+def _uses_df(nodes):
+    return any(_is_name(sub, "df") for node in nodes for sub in ast.walk(node))
+
+
+def _arguments(*calls):
+    return [arg for call in calls for arg in call.args + [kw.value for kw in call.keywords]]
+
+
+def _swap(node, inner, name):
+    """Copy of node with `inner` (a node inside it) replaced by a plain variable"""
+    return copy.deepcopy(node, {id(inner): ast.Name(id=name, ctx=ast.Load())})
+
+
+def _compile(node):
+    expression = ast.Expression(body=node)
+    return compile(ast.fix_missing_locations(expression), "<generated>", "eval")
+
+
+def _call_kwargs(call, allowed):
+    kwargs = {}
+    for kw in call.keywords:
+        if kw.arg not in allowed:
+            raise NotDecomposable(f"unsupported argument {kw.arg}")
+        kwargs[kw.arg] = _literal(kw.value)
+    return kwargs
+
+
+class _ConcatReducer:
+    """No reduction, the mapped chunks are the (already smaller) frame to finish on"""
+    done = False
+
+    def __init__(self):
+        self.parts = []
+
+    def feed(self, part):
+        self.parts.append(part)
+
+    def result(self):
+        return pd.concat(self.parts)
+
+
+class _HeadReducer:
+    def __init__(self, n):
+        self.n = n
+        self.parts = []
+        self.rows = 0
+
+    @property
+    def done(self):
+        return self.rows >= self.n
+
+    def feed(self, part):
+        part = part.head(self.n - self.rows)
+        self.parts.append(part)
+        self.rows += len(part)
+
+    def result(self):
+        return pd.concat(self.parts)
+
+
+class _SelfCombiningReducer:
+    """Reductions where f(concat(f(chunk) for each chunk)) == f(whole), like
+    sort_values(...).head(n) and nlargest(n, ...)"""
+    done = False
+
+    def __init__(self, code):
+        self.code = code
+        self.best = None
+
+    def _apply(self, value):
+        return eval(self.code, EVAL_GLOBALS, {'_x': value})
+
+    def feed(self, part):
+        top = self._apply(part)
+        self.best = top if self.best is None else self._apply(pd.concat([self.best, top]))
+
+    def result(self):
+        return self.best
+
+
+class _ValueCountsReducer:
+    done = False
+
+    def __init__(self, normalize=False, sort=True, ascending=False, dropna=True):
+        self.normalize = normalize
+        self.sort = sort
+        self.ascending = ascending
+        self.dropna = dropna
+        self.counts = None
+
+    def feed(self, part):
+        counts = part.value_counts(sort=False, dropna=self.dropna)
+        if self.counts is not None:
+            # first seen order is kept, same tie order as a value_counts on the whole column
+            counts = pd.concat([self.counts, counts])
+            counts = counts.groupby(level=list(range(counts.index.nlevels)), sort=False, dropna=False).sum()
+        self.counts = counts
+
+    def result(self):
+        counts = self.counts
+        if self.normalize:
+            counts = (counts / counts.sum()).rename("proportion")
+        if self.sort:
+            counts = counts.sort_values(ascending=self.ascending, kind="stable")
+        return counts
+
+
+class _GroupByReducer:
+    """groupby(keys)[selection].<sum|count|size|min|max|mean>() and .agg(...) of those.
+
+    Each chunk gives per group partials (sum, count, min, max, size), combined as they
+    come; mean is sum / count at the end.
+    """
+    done = False
+    COMBINE = {"sum": "sum", "count": "sum", "size": "sum", "min": "min", "max": "max"}
+
+    def __init__(self, keys, selection, spec, as_index=True, sort=True, dropna=True):
+        self.keys = keys if isinstance(keys, list) else [keys]
+        self.selection = selection
+        self.spec = spec
+        self.as_index = as_index
+        self.sort = sort
+        self.dropna = dropna
+        self.outputs = None
+        self.series_name = None
+        self.partials = None
+
+    def _resolve(self, part):
+        """(label, column, function) for every output column, worked out from the first chunk"""
+        kind, value = self.spec
+        selection = self.selection
+        if selection is None:
+            selected = [col for col in part.columns if col not in self.keys]
+        else:
+            selected = [selection] if isinstance(selection, str) else selection
+        single = isinstance(selection, str)
+        if kind == "func":
+            if value == "size":
+                self.series_name = selection if single else None
+                return [(None, None, "size")]
+            if single:
+                self.series_name = selection
+                return [(None, selection, value)]
+            return [(col, col, value) for col in selected]
+        if kind == "list":
+            if single:
+                return [(func, selection, func) for func in value]
+            return [((col, func), col, func) for col in selected for func in value]
+        if kind == "dict":
+            if any(isinstance(funcs, list) for funcs in value.values()):
+                return [((col, func), col, func) for col, funcs in value.items()
+                        for func in (funcs if isinstance(funcs, list) else [funcs])]
+            return [(col, col, func) for col, func in value.items()]
+        # named aggregation
+        return [(label, col, func) for label, (col, func) in value.items()]
+
+    def _stats(self):
+        needed = []
+        for _, col, func in self.outputs:
+            for stat in (("sum", "count") if func == "mean" else (func,)):
+                key = ("", "size") if stat == "size" else (col, stat)
+                if key not in needed:
+                    needed.append(key)
+        return needed
+
+    def feed(self, part):
+        if self.outputs is None:
+            self.outputs = self._resolve(part)
+        grouped = part.groupby(self.keys, sort=False, dropna=self.dropna)
+        partial = pd.concat(
+            {key: (grouped.size() if key[1] == "size" else getattr(grouped[key[0]], key[1])())
+             for key in self._stats()},
+            axis=1
+        )
+        if self.partials is not None:
+            partial = pd.concat([self.partials, partial])
+            partial = partial.groupby(level=list(range(len(self.keys))), sort=False, dropna=False).agg(
+                {key: self.COMBINE[key[1]] for key in partial.columns}
+            )
+        self.partials = partial
+
+    def result(self):
+        partials = self.partials
+        if self.sort:
+            partials = partials.sort_index()
+        values = {}
+        for label, col, func in self.outputs:
+            if func == "size":
+                value = partials[("", "size")]
+            elif func == "mean":
+                value = partials[(col, "sum")] / partials[(col, "count")]
+            else:
+                value = partials[(col, func)]
+            values[label] = value
+        if self.outputs[0][0] is None:
+            result = values[None].copy()
+            result.name = self.series_name
+            if not self.as_index:
+                result = result.reset_index(name=self.series_name or "size")
+            return result
+        result = pd.DataFrame(values)
+        return result if self.as_index else result.reset_index()
+
+
+class _ScalarReducer:
+    done = False
+
+    def __init__(self, func, dropna=True):
+        self.func = func
+        self.dropna = dropna
+        self.partials = []
+
+    def feed(self, part):
+        if not isinstance(part, pd.Series):
+            raise NotDecomposable(f"{self.func}() on a DataFrame")
+        if self.func == "mean":
+            self.partials.append((part.sum(), part.count()))
+        elif self.func in ("unique", "nunique"):
+            self.partials.append(pd.Series(part.unique()))
+        else:
+            self.partials.append(getattr(part, self.func)())
+
+    def result(self):
+        if self.func == "mean":
+            total = sum(p[0] for p in self.partials)
+            count = sum(p[1] for p in self.partials)
+            return total / count if count else np.nan
+        if self.func in ("unique", "nunique"):
+            values = pd.concat(self.partials)
+            if self.func == "nunique":
+                return values.nunique(dropna=self.dropna)
+            return values.unique()
+        partials = pd.Series(self.partials)
+        return partials.sum() if self.func in ("sum", "count") else getattr(partials, self.func)()
+
+
+def _group_spec(call):
+    """What a groupby aggregation call asks for: ("func", name), ("list", [...]),
+    ("dict", {col: func(s)}) or ("named", {label: (col, func)})"""
+    method = call.func.attr
+    if method in GROUP_FUNCTIONS:
+        if call.args or call.keywords:
+            raise NotDecomposable(f"{method} with arguments")
+        return ("func", method)
+    if method not in ("agg", "aggregate"):
+        raise NotDecomposable(f"groupby().{method}")
+    if call.keywords and not call.args:
+        named = {kw.arg: _literal(kw.value) for kw in call.keywords}
+        if not all(isinstance(v, tuple) and len(v) == 2 and v[1] in GROUP_FUNCTIONS for v in named.values()):
+            raise NotDecomposable("named aggregation")
+        return ("named", named)
+    if len(call.args) != 1 or call.keywords:
+        raise NotDecomposable("agg arguments")
+    spec = _literal(call.args[0])
+    if isinstance(spec, str):
+        funcs = [spec]
+    elif isinstance(spec, list):
+        funcs = spec
+    elif isinstance(spec, dict):
+        funcs = [f for v in spec.values() for f in (v if isinstance(v, list) else [v])]
+    else:
+        raise NotDecomposable("agg spec")
+    if not funcs or not all(isinstance(f, str) and f in GROUP_FUNCTIONS for f in funcs):
+        raise NotDecomposable(f"agg functions {funcs}")
+    if isinstance(spec, str):
+        return ("func", spec)
+    return ("list", spec) if isinstance(spec, list) else ("dict", spec)
+
+
+def _reducer_for(nodes, i):
+    """The reducer starting right after nodes[i] (the mapped value) and the node it ends at"""
+    if i + 1 >= len(nodes):
+        return _ConcatReducer(), i
+    node = nodes[i + 1]
+    inner = nodes[i]
+    if _method_call(node, "head"):
+        if node.keywords or len(node.args) > 1:
+            raise NotDecomposable("head arguments")
+        n = _literal(node.args[0]) if node.args else 5
+        if not isinstance(n, int) or n < 0:
+            raise NotDecomposable("head(n) with n < 0")
+        return _HeadReducer(n), i + 1
+    if _method_call(node, "value_counts"):
+        if node.args:
+            raise NotDecomposable("value_counts arguments")
+        return _ValueCountsReducer(**_call_kwargs(node, ("normalize", "sort", "ascending", "dropna"))), i + 1
+    if _method_call(node, "nlargest", "nsmallest"):
+        if _uses_df(_arguments(node)):
+            raise NotDecomposable("df inside the reduction")
+        return _SelfCombiningReducer(_compile(_swap(node, inner, "_x"))), i + 1
+    if _method_call(node, "sort_values") and i + 2 < len(nodes) and _method_call(nodes[i + 2], "head"):
+        if _uses_df(_arguments(node, nodes[i + 2])):
+            raise NotDecomposable("df inside the reduction")
+        return _SelfCombiningReducer(_compile(_swap(nodes[i + 2], inner, "_x"))), i + 2
+    if _method_call(node, "groupby"):
+        args = list(node.args)
+        kwargs = _call_kwargs(node, ("by", "as_index", "sort", "dropna"))
+        keys = _literal(args[0]) if len(args) == 1 else kwargs.pop("by", None)
+        if len(args) > 1 or not (isinstance(keys, str) or (
+                isinstance(keys, list) and keys and all(isinstance(key, str) for key in keys))):
+            raise NotDecomposable("groupby keys")
+        end = i + 2
+        selection = None
+        if end < len(nodes) and isinstance(nodes[end], ast.Subscript):
+            selection = _constant_labels(nodes[end].slice)
+            if selection is None:
+                raise NotDecomposable("groupby selection")
+            end += 1
+        if end >= len(nodes) or not isinstance(nodes[end], ast.Call) or not isinstance(nodes[end].func, ast.Attribute):
+            raise NotDecomposable("groupby without aggregation")
+        return _GroupByReducer(keys, selection, _group_spec(nodes[end]), **kwargs), end
+    if _method_call(node, *SCALAR_FUNCTIONS):
+        if node.args:
+            raise NotDecomposable(f"{node.func.attr} arguments")
+        kwargs = _call_kwargs(node, ("dropna",) if node.func.attr == "nunique" else ())
+        return _ScalarReducer(node.func.attr, **kwargs), i + 1
+    # nothing to reduce with, finish on the mapped rows
+    return _ConcatReducer(), i
+
+
+class ChunkedPlan:
+    def __init__(self, map_code, reducer, finish_code):
+        self.map_code = map_code
+        self.reducer = reducer
+        self.finish_code = finish_code
+
+    def run(self, file_path, chunk_rows=None, filters=None):
+        chunks = 0
+        for chunk in iter_csv_chunks(file_path, chunk_rows, filters):
+            chunks += 1
+            part = chunk if self.map_code is None else eval(self.map_code, EVAL_GLOBALS, {'df': chunk})
+            self.reducer.feed(part)
+            if self.reducer.done:
+                break
+        if not chunks:
+            raise NotDecomposable("no rows")
+        result = self.reducer.result()
+        if self.finish_code is None:
+            return result
+        return eval(self.finish_code, EVAL_GLOBALS, {'_result': result})
+
+
+def plan_chunked_query(pandas_code, columns):
+    """Splits generated code into map/reduce/finish, raises NotDecomposable if it can't"""
+    try:
+        root = ast.parse(pandas_code.strip(), mode="eval").body
+    except SyntaxError:
+        raise NotDecomposable("not a single expression")
+    nodes = _chain(root, columns)
+    if nodes is None:
+        raise NotDecomposable("not a chain on df")
+
+    # longest row-local prefix
+    mapped = max(i for i, node in enumerate(nodes) if _row_local(node, columns))
+    reducer, end = _reducer_for(nodes, mapped)
+    whole_frame = _is_name(nodes[mapped], "df")
+    if isinstance(reducer, _ConcatReducer) and whole_frame:
+        # would just be the whole file again
+        raise NotDecomposable("nothing to filter or reduce")
+
+    map_code = None if whole_frame else _compile(copy.deepcopy(nodes[mapped]))
+    finish_code = None
+    if end < len(nodes) - 1:
+        finish_tree = _swap(root, nodes[end], "_result")
+        if _uses_df([finish_tree]):
+            raise NotDecomposable("df used after the reduction")
+        finish_code = _compile(finish_tree)
+    return ChunkedPlan(map_code, reducer, finish_code)
+
+
+def run_chunked_query(file_path, pandas_code, columns=None, chunk_rows=None):
+    """Result of the code (same as evaluating it on the whole frame) without loading the file"""
+    columns = columns if columns is not None else csv_columns(file_path)
+    plan = plan_chunked_query(pandas_code, columns)
+    logger.info(f"Running pandas code chunk by chunk on {os.path.basename(file_path)}")
+    return plan.run(file_path, chunk_rows, row_filters(pandas_code, columns))
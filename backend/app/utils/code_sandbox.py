@@ -0,0 +1,305 @@
+# Worker processes for running LLM generated pandas code.
+# exec'ing generated code in the request thread meant one bad expression (cross join,
+# huge apply...) held the GIL and stalled every other request, with no limit on time
+# or memory. Jobs now run in a small pool of worker processes instead:
+#   - wall clock timeout per job (plus a matching CPU rlimit inside the worker)
+#   - anonymous RSS watchdog, so mapped dataset pages don't count against the job
+#   - cancellation by key (e.g. the client's request id)
+# A worker that hits a limit or is cancelled is killed and replaced. A job waits at most
+# SANDBOX_QUEUE_TIMEOUT for a free worker.
+# Datasets aren't pickled to the workers: they map the Arrow copy of the upload (see
+# materialize) so every worker shares the same pages, or read the CSV themselves.
+# Workers start by re-running the parent's main script as __mp_main__ (multiprocessing
+# does that for spawn and forkserver), so main.py keeps its startup work under the
+# __main__ guard; a new worker after a kill only re-imports it.
+
+import os
+import time
+import queue
+import signal
+import logging
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    # not on Windows, the parent side timeout still applies
+    resource = None
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+SANDBOX_ENABLED = os.getenv('SANDBOX_ENABLED', '1').lower() not in ('0', 'false', 'no')
+SANDBOX_WORKERS = int(os.getenv('SANDBOX_WORKERS', 2))
+SANDBOX_TIMEOUT = float(os.getenv('SANDBOX_TIMEOUT', 60))
+SANDBOX_MEMORY_MB = int(os.getenv('SANDBOX_MEMORY_MB', 2048))
+# how long a job waits for a free worker (seconds)
+SANDBOX_QUEUE_TIMEOUT = float(os.getenv('SANDBOX_QUEUE_TIMEOUT', 30))
+# how often a running job is checked for timeout / memory / cancellation (seconds)
+POLL_INTERVAL = 0.05
+# frames a worker keeps mapped between jobs
+WORKER_FRAMES = 2
+
+
+class SandboxError(Exception):
+    pass
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+class SandboxMemoryError(SandboxError):
+    pass
+
+
+class SandboxCancelled(SandboxError):
+    pass
+
+
+class SandboxBusy(SandboxError):
+    pass
+
+
+def _anon_rss_bytes(pid):
+    """Private (anonymous) resident memory of a process, None where /proc isn't there"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# --- worker side ---
+
+_worker_frames = {}
+
+
+def _worker_frame(abs_file_path, columns=None, dtype=None, filters=None):
+    """The dataset for a job: the memory mapped Arrow copy, or the upload itself if there is none"""
+    from app.utils.dataset_cache import file_fingerprint, load_dataframe
+    from app.utils.materialize import get_arrow_copy, read_arrow_copy
+    key = (file_fingerprint(abs_file_path), tuple(columns or ()), tuple(sorted((dtype or {}).items())))
+    if key not in _worker_frames:
+        arrow_path = get_arrow_copy(abs_file_path)
+        if arrow_path is None:
+            # filtered reads are one-offs, not worth keeping
+            return load_dataframe(abs_file_path, columns, dtype, filters)
+        frame = read_arrow_copy(arrow_path, columns)
+        categories = [col for col, kind in (dtype or {}).items() if kind == "category"]
+        if categories:
+            frame = frame.astype({col: "category" for col in categories})
+        while len(_worker_frames) >= WORKER_FRAMES:
+            _worker_frames.pop(next(iter(_worker_frames)))
+        _worker_frames[key] = frame
+    # shallow copy, generated code can't change the frame the next job gets
+    return _worker_frames[key].copy(deep=False)
+
+
+def _limit_cpu(seconds):
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(used + seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _run_job(job):
+    if job["kind"] == "dataset":
+        from app.utils.db_handler import run_pandas_job
+        return run_pandas_job(job["file_path"], job["code"], loader=_worker_frame)
+    # a frame sent along with the job (query_executor), plain eval like it always did
+    return eval(job["code"], {"df": job["frame"]})
+
+
+def _worker_main(conn):
+    # generated code is a background job as far as the OS is concerned
+    if hasattr(os, "nice"):
+        os.nice(5)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        _limit_cpu(job["timeout"])
+        try:
+            conn.send(("ok", _run_job(job)))
+        except Exception as e:
+            try:
+                conn.send(("error", str(e)))
+            except Exception:
+                return
+
+
+# --- parent side ---
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+
+class SandboxPool:
+    def __init__(self, workers=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT, memory_mb=SANDBOX_MEMORY_MB,
+                 queue_timeout=SANDBOX_QUEUE_TIMEOUT):
+        self.workers = max(int(workers), 1)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.memory_limit = memory_mb * 1024 * 1024 if memory_mb else None
+        # None = a slot with no process yet (started on first use, or after a kill)
+        self._idle = queue.Queue()
+        for _ in range(self.workers):
+            self._idle.put(None)
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._context = None
+
+    def _get_context(self):
+        if self._context is None:
+            methods = multiprocessing.get_all_start_methods()
+            # forkserver: forking the threaded Flask process itself isn't safe
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if "forkserver" in methods:
+                context.set_forkserver_preload(["app.utils.code_sandbox", "app.utils.db_handler"])
+            self._context = context
+        return self._context
+
+    def _acquire(self):
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise SandboxBusy(f"All query workers stayed busy for {self.queue_timeout:g}s, try again later")
+        if worker is None or not worker.process.is_alive():
+            try:
+                worker = _Worker(self._get_context())
+            except Exception:
+                # the slot stays free for the next job
+                self._idle.put(None)
+                raise
+        return worker
+
+    def _death_reason(self, worker):
+        worker.process.join(1)
+        if resource is not None and worker.process.exitcode == -signal.SIGXCPU:
+            return SandboxTimeout("Query used too much CPU time and was stopped")
+        return SandboxError(f"Query worker died (exit code {worker.process.exitcode})")
+
+    def _wait(self, worker, timeout, cancel_event):
+        deadline = time.monotonic() + timeout
+        while True:
+            if worker.conn.poll(POLL_INTERVAL):
+                try:
+                    return worker.conn.recv()
+                except (EOFError, OSError):
+                    raise self._death_reason(worker)
+            if cancel_event.is_set():
+                raise SandboxCancelled("Query was cancelled")
+            if time.monotonic() > deadline:
+                raise SandboxTimeout(f"Query took longer than {timeout:g}s and was stopped")
+            if self.memory_limit:
+                rss = _anon_rss_bytes(worker.process.pid)
+                if rss is not None and rss > self.memory_limit:
+                    raise SandboxMemoryError(
+                        f"Query used more than {self.memory_limit // (1024 * 1024)}MB of memory and was stopped"
+                    )
+            if not worker.process.is_alive() and not worker.conn.poll():
+                raise self._death_reason(worker)
+
+    def run(self, job, timeout=None, cancel_key=None):
+        timeout = timeout or self.timeout
+        job = dict(job, timeout=timeout)
+        cancel_event = threading.Event()
+        if cancel_key:
+            with self._lock:
+                self._cancel_events[cancel_key] = cancel_event
+        try:
+            worker = self._acquire()
+        except Exception:
+            if cancel_key:
+                with self._lock:
+                    self._cancel_events.pop(cancel_key, None)
+            raise
+        healthy = False
+        try:
+            if cancel_event.is_set():
+                raise SandboxCancelled("Query was cancelled")
+            worker.conn.send(job)
+            status, payload = self._wait(worker, timeout, cancel_event)
+            healthy = True
+        finally:
+            if cancel_key:
+                with self._lock:
+                    self._cancel_events.pop(cancel_key, None)
+            if not healthy:
+                worker.kill()
+                worker = None
+            self._idle.put(worker)
+        if status == "error":
+            # same message the in-process exec would have raised
+            raise SandboxError(payload)
+        return payload
+
+    def cancel(self, cancel_key):
+        """Stops the running job registered under cancel_key, False if there is none"""
+        with self._lock:
+            event = self._cancel_events.get(cancel_key)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def shutdown(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if worker is not None:
+                worker.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+        return _pool
+
+
+def run_pandas_in_sandbox(abs_file_path, pandas_code, timeout=None, cancel_key=None):
+    """Generated code against an uploaded CSV, in a worker; returns the result DataFrame"""
+    job = {"kind": "dataset", "file_path": abs_file_path, "code": pandas_code}
+    return get_sandbox().run(job, timeout, cancel_key)
+
+
+def eval_on_frame(frame, code, timeout=None, cancel_key=None):
+    """eval(code) with df=frame in a worker; the frame is pickled, use for small frames"""
+    job = {"kind": "frame", "frame": frame, "code": code}
+    return get_sandbox().run(job, timeout, cancel_key)
+
+
+def cancel_job(cancel_key):
+    return get_sandbox().cancel(cancel_key)
@@ -0,0 +1,192 @@
+# Column projection and dtype pushdown for pandas execution.
+# Generated code usually touches two or three columns of a wide file. The code is
+# read statically to find which columns it uses, so only those get parsed
+# (read_csv usecols), with the dtypes the profile already found and categoricals for
+# low cardinality text columns where that can't change the result.
+# Whenever the code could depend on columns it doesn't name (df.describe(), a
+# filtered frame returned whole, df.columns...) nothing is pruned.
+
+import os
+import ast
+import logging
+from app.utils.chunked_query import row_filters
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# text columns with at most this many distinct values are loaded as category
+CATEGORY_MAX_DISTINCT = int(os.getenv('CATEGORY_MAX_DISTINCT', 1000))
+# profile dtypes that can be handed to read_csv as they are
+PUSHDOWN_DTYPES = {"int64", "float64", "bool", "str"}
+
+# frame -> frame methods that keep every column (so the walk carries on past them)
+ROW_METHODS = {
+    "head", "tail", "sort_values", "sort_index", "nlargest", "nsmallest", "query", "reset_index",
+    "set_index", "assign", "rename", "sample", "fillna", "copy", "astype"
+}
+# only look at the columns they're given
+SUBSET_METHODS = {"dropna", "drop_duplicates"}
+# groupby(...).<method>() that only needs the key columns
+GROUPBY_KEY_ONLY = {"size", "ngroups", "ngroup"}
+# everything the code calls has to be in here for categoricals to be used, other
+# methods (value_counts, groupby, sorting, string ops, arithmetic...) can behave
+# differently on a categorical column
+CATEGORY_SAFE_METHODS = {
+    "head", "tail", "isin", "isna", "notna", "isnull", "notnull", "count", "nunique",
+    "reset_index", "dropna", "drop_duplicates", "copy"
+}
+
+
+def _parents(tree):
+    parents = {}
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            parents[child] = node
+    return parents
+
+
+def _column_labels(node, columns):
+    """True for 'col' / ['a', 'b'] subscripts"""
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, str)
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return bool(node.elts) and all(isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts)
+    return False
+
+
+def _has_subset(call):
+    return bool(call.args) or any(kw.arg == "subset" for kw in call.keywords)
+
+
+def _needs_all_columns(node, parents, columns):
+    """Follows a use of df outwards until it's narrowed to named columns (False) or
+    it reaches something that could look at every column (True)"""
+    while True:
+        parent = parents.get(node)
+        if parent is None:
+            # a whole frame is the result
+            return True
+        if isinstance(parent, ast.Subscript) and parent.value is node:
+            if _column_labels(parent.slice, columns):
+                return False
+            # boolean mask or row slice, still every column
+            node = parent
+            continue
+        if not (isinstance(parent, ast.Attribute) and parent.value is node):
+            # df passed to a function, compared, used in arithmetic...
+            return True
+        attr = parent.attr
+        if attr in columns:
+            return False
+        grandparent = parents.get(parent)
+        if attr == "loc" and isinstance(grandparent, ast.Subscript):
+            key = grandparent.slice
+            if isinstance(key, ast.Tuple) and len(key.elts) == 2:
+                return not _column_labels(key.elts[1], columns)
+            node = grandparent
+            continue
+        if not (isinstance(grandparent, ast.Call) and grandparent.func is parent):
+            # df.shape, df.columns, df.iloc...
+            return True
+        if attr in ROW_METHODS or (attr in SUBSET_METHODS and _has_subset(grandparent)):
+            node = grandparent
+            continue
+        if attr == "groupby":
+            return _groupby_needs_all(grandparent, parents)
+        return True
+
+
+def _groupby_needs_all(groupby_call, parents):
+    parent = parents.get(groupby_call)
+    if isinstance(parent, ast.Subscript) and parent.value is groupby_call:
+        # groupby(...)['col'] / [['a', 'b']]
+        return not _column_labels(parent.slice, ())
+    if isinstance(parent, ast.Attribute) and parent.value is groupby_call:
+        if parent.attr in GROUPBY_KEY_ONLY:
+            return False
+        call = parents.get(parent)
+        if parent.attr in ("agg", "aggregate") and isinstance(call, ast.Call):
+            # agg({'col': ...}) / agg(name=('col', ...)) name their columns
+            return not (call.keywords or (call.args and isinstance(call.args[0], ast.Dict)))
+    return True
+
+
+def _query_names(expression, columns):
+    """Column names used inside a df.query("...") string, None if it can't be read"""
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        # `backticked names` etc.
+        return None
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id in columns}
+
+
+def referenced_columns(pandas_code, columns):
+    """Columns the code uses, in file order, or None if it may need all of them"""
+    try:
+        tree = ast.parse(pandas_code.strip(), mode="eval")
+    except SyntaxError:
+        return None
+    parents = _parents(tree)
+    known = set(columns)
+    used = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "df":
+            if _needs_all_columns(node, parents, known):
+                return None
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and node.value in known:
+            used.add(node.value)
+        elif isinstance(node, ast.Attribute) and node.attr in known:
+            used.add(node.attr)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "query":
+            for arg in node.args:
+                if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                    names = _query_names(arg.value, known)
+                    if names is None:
+                        return None
+                    used |= names
+    if not used:
+        return None
+    return [col for col in columns if col in used]
+
+
+def _categorical_safe(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.BinOp, ast.Lambda)):
+            return False
+        if isinstance(node, ast.Compare) and not all(
+                isinstance(op, (ast.Eq, ast.NotEq, ast.In, ast.NotIn)) for op in node.ops):
+            return False
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Attribute) or node.func.attr not in CATEGORY_SAFE_METHODS:
+                return False
+    return True
+
+
+def pandas_load_options(pandas_code, profile):
+    """{"columns": [...], "dtype": {...}, "filters": [...]} to load just what the code
+    needs, None to load everything"""
+    if not profile or profile.get("type") != "csv":
+        return None
+    table = profile["tables"][0]
+    columns = [col["name"] for col in table["columns"]]
+    filters = row_filters(pandas_code, columns)
+    used = referenced_columns(pandas_code, columns)
+    if used is None:
+        return {"filters": filters} if filters else None
+    categorical = _categorical_safe(ast.parse(pandas_code.strip(), mode="eval"))
+    row_count = table.get("row_count", 0)
+    dtype = {}
+    for col in table["columns"]:
+        if col["name"] not in used:
+            continue
+        if categorical and not col.get("numeric") and col["dtype"] in PUSHDOWN_DTYPES \
+                and col.get("distinct", 0) <= CATEGORY_MAX_DISTINCT and col.get("distinct", 0) <= max(row_count, 1) / 2:
+            dtype[col["name"]] = "category"
+        elif col["dtype"] in PUSHDOWN_DTYPES:
+            dtype[col["name"]] = col["dtype"]
+    logger.info(f"Loading {len(used)} of {len(columns)} columns")
+    return {"columns": used, "dtype": dtype, "filters": filters}
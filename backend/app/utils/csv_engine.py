@@ -0,0 +1,165 @@
+# CSV parsing engine selection.
+# pandas' default C parser is single threaded. When pyarrow is installed, whole-file
+# reads go through pyarrow's multi-threaded CSV reader over a memory map of the file
+# instead, converted so the frame comes out the way the C engine would have built it:
+#   - same NA strings and true/false spellings
+#   - date / time columns stay text (pyarrow would parse them, pandas doesn't)
+# Anything pyarrow can't do the same way (chunksize, nrows, unusual dtypes, duplicate
+# or blank header names) or files it chokes on (ragged rows, odd quoting) are read by
+# the C engine, memory mapped as well.
+# CSV_ENGINE=auto|pyarrow|c|python picks the engine, auto is pyarrow when it's there.
+
+import os
+import logging
+import importlib.util
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+CSV_ENGINE = os.getenv('CSV_ENGINE', 'auto').lower()
+CSV_MEMORY_MAP = os.getenv('CSV_MEMORY_MAP', '1').lower() not in ('0', 'false', 'no')
+ENGINES = ("auto", "pyarrow", "c", "python")
+
+# pandas' default na_values
+PANDAS_NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+TRUE_VALUES = ["True", "TRUE", "true"]
+FALSE_VALUES = ["False", "FALSE", "false"]
+# read_csv kwargs the pyarrow path handles, anything else goes to pandas
+PYARROW_KWARGS = {"sep", "encoding", "usecols", "dtype"}
+# dtypes the pyarrow path can read a column as
+PYARROW_DTYPES = {"int64", "float64", "bool", "str", "category"}
+
+
+def _pyarrow_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def choose_engine(kwargs, engine=None):
+    """The engine a read with these kwargs will use"""
+    engine = (engine or CSV_ENGINE).lower()
+    if engine not in ENGINES:
+        logger.warning(f"Unknown CSV_ENGINE {engine!r}, using auto")
+        engine = "auto"
+    if engine in ("c", "python"):
+        return engine
+    if not set(kwargs) <= PYARROW_KWARGS or not _pyarrow_available():
+        return "c"
+    usecols = kwargs.get("usecols")
+    if usecols is not None and not all(isinstance(col, str) for col in usecols):
+        return "c"
+    dtype = kwargs.get("dtype")
+    if dtype is not None and not (isinstance(dtype, dict) and set(dtype.values()) <= PYARROW_DTYPES):
+        return "c"
+    return "pyarrow"
+
+
+def _arrow_type(dtype):
+    import pyarrow as pa
+    return {
+        "int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(),
+        # categoricals are built by pandas afterwards, like the C engine does
+        "str": pa.string(), "category": pa.string()
+    }[dtype]
+
+
+def _is_temporal(arrow_type):
+    import pyarrow as pa
+    return pa.types.is_temporal(arrow_type)
+
+
+def _open_source(file_path):
+    import pyarrow as pa
+    return pa.memory_map(file_path) if CSV_MEMORY_MAP else pa.OSFile(file_path)
+
+
+def _read_pyarrow(file_path, sep=",", encoding=None, usecols=None, dtype=None):
+    import pyarrow.csv as pacsv
+    encoding = encoding or "utf-8"
+    read_options = pacsv.ReadOptions(
+        use_threads=True,
+        # pyarrow skips a utf-8 BOM itself
+        encoding="utf8" if encoding.replace("-", "").lower() in ("utf8", "utf8sig") else encoding
+    )
+    parse_options = pacsv.ParseOptions(delimiter=sep)
+    column_types = {col: _arrow_type(kind) for col, kind in (dtype or {}).items()}
+
+    def convert_options(include_columns=None):
+        return pacsv.ConvertOptions(
+            null_values=PANDAS_NA_VALUES, strings_can_be_null=True,
+            true_values=TRUE_VALUES, false_values=FALSE_VALUES,
+            column_types=column_types, include_columns=include_columns
+        )
+    include_columns = list(usecols) if usecols is not None else None
+
+    # the first block says which columns pyarrow would read as dates/times, those are
+    # read as text from the start
+    with _open_source(file_path) as source:
+        reader = pacsv.open_csv(source, read_options=read_options, parse_options=parse_options,
+                                convert_options=convert_options())
+        schema = reader.schema
+    header = schema.names
+    if len(set(header)) != len(header) or not all(header):
+        # pandas renames these (a.1, Unnamed: 0)
+        raise ValueError("header needs pandas' column renaming")
+    for field in schema:
+        if field.name not in column_types and _is_temporal(field.type):
+            column_types[field.name] = _arrow_type("str")
+
+    with _open_source(file_path) as source:
+        table = pacsv.read_csv(source, read_options=read_options, parse_options=parse_options,
+                               convert_options=convert_options(include_columns))
+    # a column that only looks like dates after the first block
+    late = [field.name for field in table.schema if _is_temporal(field.type)]
+    if late:
+        column_types.update({col: _arrow_type("str") for col in late})
+        with _open_source(file_path) as source:
+            table = pacsv.read_csv(source, read_options=read_options, parse_options=parse_options,
+                                   convert_options=convert_options(include_columns))
+
+    frame = arrow_table_to_frame(table)
+    if usecols is not None:
+        # pandas keeps file order whatever order usecols is in
+        frame = frame[[col for col in header if col in frame.columns]]
+    categories = [col for col, kind in (dtype or {}).items() if kind == "category" and col in frame.columns]
+    if categories:
+        frame = frame.astype({col: "category" for col in categories})
+    return frame
+
+
+def arrow_table_to_frame(table):
+    """pyarrow Table -> DataFrame with the dtypes read_csv would have given"""
+    import pyarrow as pa
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            # all empty, the C engine gives float NaN
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    frame = table.to_pandas()
+    for field in table.schema:
+        if pa.types.is_boolean(field.type) and table.column(field.name).null_count:
+            # object column of True/False/None, the C engine has NaN for the gaps
+            frame[field.name] = frame[field.name].where(frame[field.name].notna(), np.nan)
+    return frame
+
+
+def read_csv(file_path, engine=None, **kwargs):
+    """pd.read_csv through the configured engine, falling back to the C engine"""
+    chosen = choose_engine(kwargs, engine)
+    if chosen == "pyarrow":
+        try:
+            return _read_pyarrow(file_path, **kwargs)
+        except (ValueError, TypeError, LookupError, NotImplementedError) as e:
+            # ArrowInvalid is a ValueError: ragged rows, quoting, a value not matching
+            # a requested dtype... pandas may still make sense of the file
+            logger.info(f"pyarrow couldn't read {os.path.basename(file_path)} ({e}), using the C engine")
+            chosen = "c"
+    if CSV_MEMORY_MAP and "memory_map" not in kwargs:
+        kwargs["memory_map"] = True
+    return pd.read_csv(file_path, engine=chosen, **kwargs)
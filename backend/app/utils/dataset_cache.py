@@ -0,0 +1,196 @@
+# Process wide cache of parsed datasets.
+# A single /query used to read the same CSV 4-5 times (schema, prompt, execution...)
+# so everything in db_handler reads through here instead of calling pd.read_csv directly.
+
+import os
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+import pandas as pd
+from app.utils.upload_ingest import read_uploaded_csv, resolve_upload_path
+from app.utils.parquet_copy import get_parquet_copy, read_parquet_copy
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+DATASET_CACHE_BYTES = int(os.getenv('DATASET_CACHE_BYTES', 512 * 1024 * 1024))
+
+
+def file_fingerprint(file_path):
+    # (resolved path, mtime, size) - changes whenever the file on disk changes,
+    # aliases of the same stored upload get the same fingerprint
+    abs_file_path = resolve_upload_path(file_path)
+    stat = os.stat(abs_file_path)
+    return (abs_file_path, stat.st_mtime_ns, stat.st_size)
+
+
+def dataset_fingerprint(file_path):
+    """Short stable id for the current version of a dataset, for use in other cache keys"""
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    return hashlib.sha1(f"{abs_file_path}|{mtime_ns}|{size}".encode()).hexdigest()
+
+
+def frame_nbytes(df):
+    try:
+        return int(df.memory_usage(deep=True).sum())
+    except Exception:
+        return 0
+
+
+class LRUByteCache:
+    """Thread safe LRU that evicts by total size in bytes rather than entry count"""
+
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            # Anything bigger than the whole budget is just not cached
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def discard(self, predicate):
+        # drop every entry whose key matches, used when a file changes on disk
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._total_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class DatasetCache:
+    """Parsed DataFrames keyed by (resolved path, mtime, size[, variant])"""
+
+    def __init__(self, max_bytes=DATASET_CACHE_BYTES):
+        self._cache = LRUByteCache(max_bytes)
+        # one lock per file so two requests don't both parse the same 200MB file
+        self._load_locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, abs_file_path):
+        with self._locks_guard:
+            return self._load_locks.setdefault(abs_file_path, threading.Lock())
+
+    def get_dataframe(self, file_path, loader=pd.read_csv, variant=None):
+        """`variant` tells apart different loads of the same file (e.g. a column projection)"""
+        key = file_fingerprint(file_path)
+        if variant is not None:
+            key += (variant,)
+        df = self._cache.get(key)
+        if df is None:
+            with self._lock_for(key[0]):
+                df = self._cache.get(key) if key in self._cache else None
+                if df is None:
+                    logger.info(f"Dataset cache miss, parsing {key[0]}")
+                    df = loader(key[0])
+                    # older versions of the same file can't be hit again
+                    self._cache.discard(lambda k: k[0] == key[0] and k[:3] != key[:3])
+                    self._cache.put(key, df)
+        # shallow copy so callers can add/rename columns without touching the cached frame;
+        # in place edits of values are copied on write (pandas 3, see requirements.txt)
+        return df.copy(deep=False)
+
+    def peek(self, file_path):
+        """The whole parsed file if it's cached, without loading it"""
+        key = file_fingerprint(file_path)
+        df = self._cache.get(key) if key in self._cache else None
+        return None if df is None else df.copy(deep=False)
+
+    def invalidate(self, file_path=None):
+        if file_path is None:
+            self._cache.clear()
+            return
+        abs_file_path = resolve_upload_path(file_path)
+        self._cache.discard(lambda k: k[0] == abs_file_path)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+dataset_cache = DatasetCache()
+
+
+def _read_upload(file_path, columns=None, dtype=None):
+    parquet_path = get_parquet_copy(file_path)
+    if parquet_path:
+        return read_parquet_copy(parquet_path, columns, dtype)
+    if columns is None:
+        return read_uploaded_csv(file_path)
+    return read_uploaded_csv(file_path, usecols=columns, dtype=dtype)
+
+
+def load_dataframe(file_path, columns=None, dtype=None, filters=None):
+    """Parsed with the encoding/delimiter sniffed at upload, from the Parquet copy if
+    there is one.
+
+    With `columns` only those are parsed (with `dtype`), unless the whole file is
+    cached already, then it's just sliced from that. `filters` (see
+    chunked_query.row_filters) let the Parquet copy skip row groups; those reads
+    aren't cached.
+    """
+    if columns is None and not filters:
+        return dataset_cache.get_dataframe(file_path, loader=_read_upload)
+    full = dataset_cache.peek(file_path)
+    if full is not None:
+        return full if columns is None else full[columns]
+    if filters:
+        parquet_path = get_parquet_copy(file_path)
+        if parquet_path:
+            return read_parquet_copy(parquet_path, columns, dtype, filters)
+        if columns is None:
+            return dataset_cache.get_dataframe(file_path, loader=_read_upload)
+    variant = (tuple(columns), tuple(sorted((dtype or {}).items())))
+    return dataset_cache.get_dataframe(
+        file_path,
+        loader=lambda path: _read_upload(path, columns, dtype),
+        variant=variant
+    )
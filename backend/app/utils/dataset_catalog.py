@@ -0,0 +1,431 @@
+# Catalog of uploaded datasets for the RAG prompts.
+# The RAG metadata in rag_examples only describes the Olist training files, and prompts
+# looked it up by the upload's uuid name, so an upload never matched anything. Each
+# upload now gets a catalog entry, written next to the stored file as
+# <upload>.catalog.json and keyed by its content hash:
+#   - name (from the original filename), description and columns
+#   - the RAG file type: a known training file when the columns match one, so its
+#     curated examples apply, otherwise the upload's own name
+#   - join keys with the other catalog entries, found by column name and by value
+#     overlap (bottom-k hash sketches of the key-like columns, see column_sketch)
+#   - seed example questions/code generated from the profile
+# Entries are loaded into memory at startup and registered with the RAG index, the
+# prompt builders read them through entry_for(). Building an entry reads the whole file,
+# that happens under a lock of its own so lookups of other datasets don't wait for it.
+# Entries are changed in memory under the catalog lock; writing them out and registering
+# them happen after it is released, from a snapshot taken under it.
+
+import os
+import re
+import json
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from app.utils.dataset_cache import load_dataframe, file_fingerprint
+from app.utils.dataset_profile import get_profile
+from app.utils.chunked_query import is_large_csv, iter_csv_chunks
+from app.utils.upload_ingest import resolve_upload_path, read_ingest_info, hash_file
+from app.utils.rag_examples import csv_files, register_datasets, register_examples
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION = 1
+CATALOG_SUFFIX = ".catalog.json"
+# hashes kept per key column, the overlap estimate is good to a few percent at 256
+KEY_SKETCH_SIZE = int(os.getenv('KEY_SKETCH_SIZE', 256))
+# share of one column's values found in the other for differently named columns to count as a join
+JOIN_KEY_CONTAINMENT = float(os.getenv('JOIN_KEY_CONTAINMENT', 0.8))
+# same named key columns only need this much overlap
+SAME_NAME_CONTAINMENT = 0.5
+# share of a training file's columns an upload needs to be taken for that file
+KNOWN_COLUMN_OVERLAP = 0.6
+DESCRIPTION_COLUMNS = 8
+
+_KEY_NAME = re.compile(r"(^|_)(id|key|code|uuid|prefix|zip)$", re.IGNORECASE)
+
+
+def catalog_path_for(file_path):
+    return resolve_upload_path(file_path) + CATALOG_SUFFIX
+
+
+def is_key_like(column_name):
+    return bool(_KEY_NAME.search(column_name))
+
+
+def column_sketch(values, k=KEY_SKETCH_SIZE):
+    """The k smallest hashes of the distinct values. Two columns' sketches estimate how
+    much their values overlap without keeping the values."""
+    strings = values.dropna().astype(str).to_numpy(dtype=object)
+    return np.unique(pd.util.hash_array(strings))[:k]
+
+
+def merge_sketches(a, b, k=KEY_SKETCH_SIZE):
+    return np.unique(np.concatenate([a, b]))[:k]
+
+
+def estimate_containment(sketch_a, distinct_a, sketch_b, distinct_b, k=KEY_SKETCH_SIZE):
+    """Estimated share of the smaller column's distinct values that are in the other one"""
+    if not len(sketch_a) or not len(sketch_b):
+        return 0.0
+    # the k smallest hashes of the union are a random sample of it
+    union = np.union1d(sketch_a, sketch_b)[:k]
+    jaccard = np.isin(union, np.intersect1d(sketch_a, sketch_b)).mean()
+    # |A & B| = J * |A | B| = J * (|A| + |B|) / (1 + J)
+    shared = jaccard * (distinct_a + distinct_b) / (1 + jaccard)
+    return float(min(shared / max(min(distinct_a, distinct_b), 1), 1.0))
+
+
+def _sketch_columns(profile):
+    """Columns worth sketching: not floats, more than one value"""
+    return [col["name"] for col in profile["tables"][0]["columns"]
+            if not col["dtype"].startswith("float") and col["dtype"] != "bool" and col.get("distinct", 0) > 1]
+
+
+def _key_sketches(abs_file_path, profile):
+    columns = _sketch_columns(profile)
+    if not columns:
+        return {}
+    if not is_large_csv(abs_file_path):
+        df = load_dataframe(abs_file_path, columns=columns)
+        return {col: column_sketch(df[col]) for col in columns}
+    sketches = {}
+    for chunk in iter_csv_chunks(abs_file_path, usecols=columns):
+        for col in columns:
+            sketch = column_sketch(chunk[col])
+            sketches[col] = merge_sketches(sketches[col], sketch) if col in sketches else sketch
+    return sketches
+
+
+def _known_dataset(columns):
+    """The training file (rag_examples.csv_files) an upload with these columns is, if any"""
+    names = {col.lower() for col in columns}
+    best, best_overlap = None, 0.0
+    for file_name, metadata in csv_files.items():
+        known = {col.lower() for col in metadata["columns"]}
+        overlap = len(names & known) / len(names | known)
+        if overlap > best_overlap:
+            best, best_overlap = file_name, overlap
+    return best if best_overlap >= KNOWN_COLUMN_OVERLAP else None
+
+
+def _seed_examples(name, profile):
+    """A few question/code pairs from the profile, for uploads nothing is known about"""
+    columns = profile["tables"][0]["columns"]
+    numeric = [col["name"] for col in columns if col["numeric"] and not is_key_like(col["name"])]
+    categories = [col["name"] for col in columns if not col["numeric"] and "values" in col]
+    examples = []
+    if numeric:
+        examples.append((f"What is the average {numeric[0]}?", f"df['{numeric[0]}'].mean()"))
+    if categories:
+        examples.append((f"How many rows are there for each {categories[0]}?", f"df['{categories[0]}'].value_counts()"))
+    if numeric and categories:
+        examples.append((f"What is the total {numeric[0]} by {categories[0]}?",
+                         f"df.groupby('{categories[0]}')['{numeric[0]}'].sum()"))
+    return [{"query": q, "code": code, "file_type": name, "notes": "Generated from the dataset profile"}
+            for q, code in examples]
+
+
+def _describe(name, profile):
+    table = profile["tables"][0]
+    columns = [col["name"] for col in table["columns"]]
+    listed = ", ".join(columns[:DESCRIPTION_COLUMNS]) + (", ..." if len(columns) > DESCRIPTION_COLUMNS else "")
+    return f"{name}: {table.get('row_count', 'unknown')} rows, {len(columns)} columns ({listed})"
+
+
+def _column_info(entry, column):
+    return next((col for col in entry["columns_info"] if col["name"] == column), {})
+
+
+def _relationship(entry, column, other, other_column):
+    unique = _column_info(entry, column).get("unique", False)
+    other_unique = _column_info(other, other_column).get("unique", False)
+    if unique and other_unique:
+        return "one-to-one"
+    if unique:
+        return "one-to-many"
+    if other_unique:
+        return "many-to-one"
+    return "many-to-many"
+
+
+def find_join_keys(entry, other):
+    """[(column, other column)] the two datasets can be joined on"""
+    keys = []
+    sketches, other_sketches = entry.get("sketches", {}), other.get("sketches", {})
+    for col in entry["columns"]:
+        for other_col in other["columns"]:
+            same_name = col.lower() == other_col.lower()
+            # differently named columns have to look like a foreign key -> primary key pair
+            if not same_name and not (is_key_like(col) and is_key_like(other_col) and (
+                    _column_info(entry, col).get("unique") or _column_info(other, other_col).get("unique"))):
+                continue
+            if col not in sketches or other_col not in other_sketches:
+                # nothing to compare (.db uploads), the name has to do
+                if same_name and is_key_like(col):
+                    keys.append((col, other_col))
+                continue
+            containment = estimate_containment(
+                np.asarray(sketches[col], dtype=np.uint64), _column_info(entry, col).get("distinct", 0),
+                np.asarray(other_sketches[other_col], dtype=np.uint64), _column_info(other, other_col).get("distinct", 0)
+            )
+            if containment >= (SAME_NAME_CONTAINMENT if same_name else JOIN_KEY_CONTAINMENT):
+                keys.append((col, other_col))
+    return keys
+
+
+def _link(entry, column, other, other_column):
+    via = column if column == other_column else f"{column} = {other['name']}.{other_column}"
+    return {"connects_to": other["name"], "via": via, "type": _relationship(entry, column, other, other_column)}
+
+
+def build_entry(file_path, name=None):
+    """Catalog entry for an upload, without links (those need the other entries)"""
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    info = read_ingest_info(abs_file_path)
+    profile = get_profile(abs_file_path)
+    sha256 = info.get("sha256") or hash_file(abs_file_path)
+    original_filename = info.get("original_filename") or os.path.basename(abs_file_path)
+    name = name or os.path.splitext(original_filename)[0]
+    entry = {
+        "version": CATALOG_VERSION,
+        "source": {"mtime_ns": mtime_ns, "size": size},
+        "sha256": sha256,
+        "name": name,
+        "original_filename": original_filename,
+        "type": profile["type"],
+        "links": [],
+        "sketches": {}
+    }
+    if profile["type"] == "db":
+        columns = [col["name"] for table in profile["tables"] for col in table["columns"]]
+        entry.update(
+            columns=columns,
+            columns_info=[{"name": col} for col in columns],
+            description=f"{name}: SQLite database with tables {', '.join(t['name'] for t in profile['tables'])}",
+            file_type=name,
+            example_qs=[],
+            examples=[]
+        )
+        return entry
+
+    table = profile["tables"][0]
+    entry["columns"] = [col["name"] for col in table["columns"]]
+    entry["columns_info"] = [{
+        "name": col["name"],
+        "distinct": col["distinct"],
+        "unique": col["distinct"] == table["row_count"] and col["null_count"] == 0
+    } for col in table["columns"]]
+    entry["sketches"] = {col: sketch.tolist() for col, sketch in _key_sketches(abs_file_path, profile).items()}
+    known = _known_dataset(entry["columns"])
+    if known:
+        # the curated examples for this training file are tagged with its lowercased name
+        entry.update(
+            file_type=known.lower(),
+            description=csv_files[known]["description"],
+            example_qs=list(csv_files[known]["example_qs"]),
+            examples=[]
+        )
+    else:
+        examples = _seed_examples(name, profile)
+        entry.update(
+            file_type=name,
+            description=_describe(name, profile),
+            example_qs=[ex["query"] for ex in examples],
+            examples=examples
+        )
+    return entry
+
+
+def _rename(entry, name):
+    if entry["file_type"] == entry["name"]:
+        entry["file_type"] = name
+        for example in entry["examples"]:
+            example["file_type"] = name
+    entry["name"] = name
+
+
+def _write_entry(path, text):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _is_fresh(entry, file_path):
+    _, mtime_ns, size = file_fingerprint(file_path)
+    return entry.get("version") == CATALOG_VERSION and entry.get("source") == {"mtime_ns": mtime_ns, "size": size}
+
+
+class DatasetCatalog:
+    def __init__(self):
+        # sha256 -> entry, and where its sidecar is; sidecar -> sha256
+        self._entries = {}
+        self._paths = {}
+        self._by_path = {}
+        # entries registered with the RAG index, and whether their examples were
+        self._registered = set()
+        self._lock = threading.RLock()
+        # sidecar -> number of the latest snapshot of its entry, and of the latest one to
+        # write; older snapshots aren't registered / written
+        self._versions = {}
+        self._write_versions = {}
+        # held while snapshots are written and registered, so they land in order
+        self._write_lock = threading.Lock()
+        # sidecar -> lock held while its entry is built
+        self._build_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def _snapshot(self, entries, write=False):
+        """The entries as they are now, to write out (write=True) and register once the
+        catalog lock is released. Taken under the catalog lock."""
+        snapshots = []
+        examples = []
+        for entry in entries:
+            path = self._paths[entry["sha256"]]
+            self._versions[path] = self._versions.get(path, 0) + 1
+            if write:
+                self._write_versions[path] = self._versions[path]
+            snapshots.append((path, self._versions[path], json.dumps(entry) if write else None, entry["name"], {
+                "description": entry["description"],
+                "columns": list(entry["columns"]),
+                "links": list(entry["links"]),
+                "example_qs": list(entry["example_qs"])
+            }))
+            if entry["sha256"] not in self._registered:
+                self._registered.add(entry["sha256"])
+                examples += entry["examples"]
+        return snapshots, examples
+
+    def _flush(self, snapshots, examples):
+        """Writes out and registers a snapshot, all new questions and examples in one go.
+        Entries snapshotted again since are left to whoever took the newer snapshot."""
+        with self._write_lock:
+            datasets = {}
+            for path, version, text, name, metadata in snapshots:
+                if text is not None and self._write_versions[path] == version:
+                    try:
+                        _write_entry(path, text)
+                    except OSError as e:
+                        # kept in memory, catalogued again from the file next start
+                        logger.info(f"Could not save catalog entry {path}: {str(e)}")
+                if self._versions[path] == version:
+                    datasets[name] = metadata
+            register_datasets(datasets)
+            if examples:
+                register_examples(examples)
+
+    def _keep(self, entry, path):
+        self._entries[entry["sha256"]] = entry
+        self._paths[entry["sha256"]] = path
+        self._by_path[path] = entry["sha256"]
+
+    def load(self, directory):
+        """Loads the entries saved in directory (the uploads objects folder) at startup"""
+        if not os.path.isdir(directory):
+            return 0
+        loaded = []
+        with self._lock:
+            for file_name in sorted(os.listdir(directory)):
+                if not file_name.endswith(CATALOG_SUFFIX):
+                    continue
+                path = os.path.join(directory, file_name)
+                data_path = path[:-len(CATALOG_SUFFIX)]
+                try:
+                    with open(path) as f:
+                        entry = json.load(f)
+                    if not os.path.exists(data_path) or not _is_fresh(entry, data_path):
+                        continue
+                except (OSError, ValueError) as e:
+                    logger.info(f"Ignoring unreadable catalog entry {path}: {str(e)}")
+                    continue
+                self._keep(entry, path)
+                loaded.append(entry)
+            snapshot = self._snapshot(loaded)
+        self._flush(*snapshot)
+        logger.info(f"Loaded {len(loaded)} dataset catalog entries")
+        return len(loaded)
+
+    def _unique_name(self, name, sha256):
+        taken = {entry["name"] for key, entry in self._entries.items() if key != sha256}
+        return name if name not in taken else f"{name}-{sha256[:8]}"
+
+    def _build_lock(self, path):
+        with self._lock:
+            return self._build_locks.setdefault(path, threading.Lock())
+
+    def add(self, file_path):
+        """Catalogs an upload: builds its entry, links it with the other entries both ways
+        and saves everything that changed"""
+        path = catalog_path_for(file_path)
+        with self._build_lock(path):
+            return self._add(file_path, path)
+
+    def _add(self, file_path, path):
+        # the slow part (reading the file, sketching its key columns) without the catalog lock
+        entry = build_entry(file_path)
+        with self._lock:
+            _rename(entry, self._unique_name(entry["name"], entry["sha256"]))
+            linked = []
+            for key, other in self._entries.items():
+                if key == entry["sha256"]:
+                    continue
+                join_keys = find_join_keys(entry, other)
+                if not join_keys:
+                    continue
+                other["links"] = [link for link in other["links"] if link["connects_to"] != entry["name"]]
+                for col, other_col in join_keys:
+                    entry["links"].append(_link(entry, col, other, other_col))
+                    other["links"].append(_link(other, other_col, entry, col))
+                linked.append(other)
+            self._keep(entry, path)
+            snapshot = self._snapshot(linked + [entry], write=True)
+        self._flush(*snapshot)
+        return entry
+
+    def _known_entry(self, file_path, path):
+        """The up to date entry in memory or saved next to the file, None if there is none"""
+        with self._lock:
+            entry = self._entries.get(self._by_path.get(path))
+            if entry is not None and _is_fresh(entry, file_path):
+                return entry
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+                if not _is_fresh(entry, file_path):
+                    return None
+            except (OSError, ValueError) as e:
+                logger.info(f"Could not read catalog entry {path}: {str(e)}")
+                return None
+            self._keep(entry, path)
+            snapshot = self._snapshot([entry])
+        self._flush(*snapshot)
+        return entry
+
+    def entry_for(self, file_path):
+        """The catalog entry of an upload, catalogued now if it wasn't yet"""
+        path = catalog_path_for(file_path)
+        entry = self._known_entry(file_path, path)
+        if entry is not None:
+            return entry
+        with self._build_lock(path):
+            # someone else may have built it while we waited
+            entry = self._known_entry(file_path, path)
+            if entry is not None:
+                return entry
+            return self._add(file_path, path)
+
+
+dataset_catalog = DatasetCatalog()
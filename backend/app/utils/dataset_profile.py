@@ -0,0 +1,293 @@
+# Schema/profile artifact for uploaded files.
+# Uploads never change, so the schema, column stats and sample rows that go into the
+# RAG prompt are worked out once at upload time and stored next to the file as
+# <upload>.profile.json. Schema lookups after that just read (and memoise) this file.
+
+import os
+import json
+import logging
+import threading
+import pandas as pd
+from app.utils.dataset_cache import load_dataframe, file_fingerprint
+from app.utils.upload_ingest import resolve_upload_path
+from app.utils.chunked_query import is_large_csv, iter_csv_chunks
+from app.utils.sqlite_pool import sqlite_pool
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+PROFILE_SUFFIX = ".profile.json"
+SAMPLE_ROWS = 5
+TOP_VALUES = 5
+# when profiling big files in chunks, columns with more distinct values than this stop
+# being counted exactly ("distinct" is then a lower bound, top values approximate)
+PROFILE_DISTINCT_CAP = int(os.getenv('PROFILE_DISTINCT_CAP', 100000))
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def profile_path_for(file_path):
+    return resolve_upload_path(file_path) + PROFILE_SUFFIX
+
+
+def _to_json_value(value):
+    # numpy scalars -> plain python, NaN -> None so the sidecar stays valid JSON
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _profile_column(series):
+    column = {
+        "name": str(series.name),
+        "dtype": str(series.dtype),
+        "numeric": bool(pd.api.types.is_numeric_dtype(series)),
+        "distinct": int(series.nunique()),
+        "null_count": int(series.isna().sum())
+    }
+    if column["numeric"]:
+        column["min"] = _to_json_value(series.min())
+        column["max"] = _to_json_value(series.max())
+        column["mean"] = _to_json_value(series.mean())
+    elif column["distinct"] <= 10:
+        column["values"] = [str(x) for x in series.unique()[:10]]
+    top = series.value_counts().head(TOP_VALUES)
+    column["top_values"] = [[str(value), int(count)] for value, count in top.items()]
+    return column
+
+
+def _profile_csv(abs_file_path, sample_rows):
+    df = load_dataframe(abs_file_path)
+    sample_df = df.head(sample_rows)
+    return {
+        "type": "csv",
+        "tables": [{
+            "name": "data",
+            "row_count": int(len(df)),
+            "columns": [_profile_column(df[col]) for col in df.columns],
+            "sample_rows": [[str(val) for val in row] for row in sample_df.itertuples(index=False)]
+        }]
+    }
+
+
+class _ColumnProfiler:
+    """Same stats as _profile_column, gathered chunk by chunk"""
+
+    def __init__(self, name):
+        self.name = name
+        self.dtypes = {}
+        self.null_count = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        # value counts (NaN included, in first seen order), frozen once past the cap
+        self.counts = None
+        self.capped = False
+
+    def add(self, series):
+        self.dtypes.setdefault(str(series.dtype), series.iloc[:0])
+        self.null_count += int(series.isna().sum())
+        if pd.api.types.is_numeric_dtype(series) and series.notna().any():
+            self.count += int(series.count())
+            self.total += series.sum()
+            self.min = series.min() if self.min is None else min(self.min, series.min())
+            self.max = series.max() if self.max is None else max(self.max, series.max())
+        if self.capped:
+            return
+        counts = series.value_counts(sort=False, dropna=False)
+        if self.counts is not None:
+            counts = pd.concat([self.counts, counts]).groupby(level=0, sort=False, dropna=False).sum()
+        self.counts = counts
+        if counts.index.notna().sum() > PROFILE_DISTINCT_CAP:
+            logger.info(f"Column {self.name} has over {PROFILE_DISTINCT_CAP} distinct values, no longer counting them")
+            self.capped = True
+
+    def result(self):
+        dtype = pd.concat(list(self.dtypes.values())).dtype
+        counts = self.counts
+        non_null = counts[counts.index.notna()]
+        column = {
+            "name": str(self.name),
+            "dtype": str(dtype),
+            "numeric": bool(pd.api.types.is_numeric_dtype(dtype)),
+            "distinct": int(len(non_null)),
+            "null_count": self.null_count
+        }
+        if column["numeric"]:
+            column["min"] = _to_json_value(self.min)
+            column["max"] = _to_json_value(self.max)
+            column["mean"] = _to_json_value(self.total / self.count) if self.count else None
+        elif column["distinct"] <= 10:
+            column["values"] = [str(x) for x in counts.index[:10]]
+        top = non_null.sort_values(ascending=False, kind="stable").head(TOP_VALUES)
+        column["top_values"] = [[str(value), int(count)] for value, count in top.items()]
+        return column
+
+
+def _profile_csv_chunked(abs_file_path, sample_rows):
+    """_profile_csv for files too big to load, one pass over the file in chunks"""
+    row_count = 0
+    sample_df = None
+    profilers = None
+    for chunk in iter_csv_chunks(abs_file_path):
+        if profilers is None:
+            profilers = [_ColumnProfiler(col) for col in chunk.columns]
+            sample_df = chunk.head(sample_rows)
+        row_count += len(chunk)
+        for profiler, col in zip(profilers, chunk.columns):
+            profiler.add(chunk[col])
+    if profilers is None:
+        # header only, small enough to do the normal way
+        return _profile_csv(abs_file_path, sample_rows)
+    return {
+        "type": "csv",
+        "tables": [{
+            "name": "data",
+            "row_count": row_count,
+            "columns": [profiler.result() for profiler in profilers],
+            "sample_rows": [[str(val) for val in row] for row in sample_df.itertuples(index=False)]
+        }]
+    }
+
+
+def _profile_db(abs_file_path, sample_rows):
+    with sqlite_pool.connection(abs_file_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = []
+        for table in [row[0] for row in cursor.fetchall()]:
+            cursor.execute(f"PRAGMA table_info({table});")
+            columns = [{"name": row[1], "dtype": row[2] or "", "numeric": False} for row in cursor.fetchall()]
+            cursor.execute(f"SELECT * FROM {table} LIMIT {sample_rows};")
+            rows = [[str(val) for val in row] for row in cursor.fetchall()]
+            tables.append({"name": table, "columns": columns, "sample_rows": rows})
+    return {"type": "db", "tables": tables}
+
+
+def render_schema_text(profile):
+    """Same text get_database_schema always produced"""
+    schema_text = "Database Schema:\n"
+    for table in profile["tables"]:
+        cols = [col["name"] for col in table["columns"]]
+        schema_text += f"Table: {table['name']}\n"
+        if profile["type"] == "csv":
+            schema_text += f"Columns: {', '.join(cols)}\n"
+            schema_text += f"Row count: {table['row_count']}\n\n"
+        else:
+            schema_text += f"Columns: {', '.join(cols)}\n\n"
+    return schema_text
+
+
+def _format_stat(value):
+    return "nan" if value is None else value
+
+
+def render_column_stats(col):
+    """The "Column Statistics" lines of one CSV column (prompt_budget looks for them verbatim)"""
+    if "mean" in col:
+        avg = col["mean"]
+        avg_text = "nan" if avg is None else f"{avg:.2f}"
+        return f"{col['name']}: min={_format_stat(col['min'])}, max={_format_stat(col['max'])}, avg={avg_text}\n"
+    text = f"{col['name']}: {col['distinct']} unique values\n"
+    if "values" in col:
+        text += f"  Values: {', '.join(col['values'])}\n"
+    return text
+
+
+def render_enhanced_schema(profile):
+    """Schema + stats + sample rows, the RAG context used in the prompts"""
+    schema_text = profile["schema_text"]
+    if profile["type"] == "db":
+        sample_text = "Sample Data:\n"
+        for table in profile["tables"]:
+            columns = [col["name"] for col in table["columns"]]
+            sample_text += f"Table: {table['name']}\n"
+            sample_text += " | ".join(columns) + "\n"
+            sample_text += "-" * (sum(len(col) for col in columns) + 3 * (len(columns) - 1)) + "\n"
+            for row in table["sample_rows"]:
+                sample_text += " | ".join(row) + "\n"
+            sample_text += "\n"
+        return schema_text + "\n" + sample_text
+
+    table = profile["tables"][0]
+    stats_text = "Column Statistics:\n"
+    stats_text += "".join(render_column_stats(col) for col in table["columns"])
+
+    sample_text = "\nSample Data (first 5 rows):\n"
+    headers = [col["name"] for col in table["columns"]]
+    header_row = " | ".join(headers)
+    sample_text += header_row + "\n"
+    sample_text += "-" * len(header_row) + "\n"
+    for row in table["sample_rows"]:
+        sample_text += " | ".join(val[:20] for val in row) + "\n"
+    return schema_text + "\n" + stats_text + "\n" + sample_text
+
+
+def compute_profile(file_path, sample_rows=SAMPLE_ROWS):
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    file_extension = os.path.splitext(abs_file_path)[1].lower()
+    logger.info(f"Profiling {abs_file_path}")
+    if file_extension == '.db':
+        profile = _profile_db(abs_file_path, sample_rows)
+    elif is_large_csv(abs_file_path):
+        profile = _profile_csv_chunked(abs_file_path, sample_rows)
+    else:
+        profile = _profile_csv(abs_file_path, sample_rows)
+    profile["version"] = PROFILE_VERSION
+    profile["source"] = {"mtime_ns": mtime_ns, "size": size}
+    profile["schema_text"] = render_schema_text(profile)
+    profile["enhanced_schema_text"] = render_enhanced_schema(profile)
+    return profile
+
+
+def build_profile(file_path):
+    """One off profiling pass, writes the sidecar and returns the profile dict"""
+    abs_file_path = resolve_upload_path(file_path)
+    profile = compute_profile(abs_file_path)
+
+    # write to a temp file first so a reader never sees half a profile
+    sidecar = profile_path_for(abs_file_path)
+    tmp_path = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, sidecar)
+
+    with _memo_lock:
+        _memo[abs_file_path] = profile
+    return profile
+
+
+def _is_fresh(profile, mtime_ns, size):
+    return (profile.get("version") == PROFILE_VERSION
+            and profile.get("source") == {"mtime_ns": mtime_ns, "size": size})
+
+
+def get_profile(file_path):
+    """Profile for a file, from memory, then the sidecar, rebuilding it if missing or stale"""
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    with _memo_lock:
+        profile = _memo.get(abs_file_path)
+    if profile is not None and _is_fresh(profile, mtime_ns, size):
+        return profile
+
+    sidecar = profile_path_for(abs_file_path)
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar) as f:
+                profile = json.load(f)
+            if _is_fresh(profile, mtime_ns, size):
+                with _memo_lock:
+                    _memo[abs_file_path] = profile
+                return profile
+            logger.info(f"Profile for {abs_file_path} is stale, rebuilding")
+        except (OSError, ValueError) as e:
+            logger.info(f"Could not read profile {sidecar}: {str(e)}")
+    return build_profile(abs_file_path)
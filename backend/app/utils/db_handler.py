@@ -1,4 +1,3 @@
-import sqlite3
 import os
 import pandas as pd
 import json
@@ -6,6 +5,18 @@ import re
 import numpy as np
 import logging
 import functools
+import threading
+from collections import OrderedDict
+from app.utils.dataset_cache import load_dataframe, dataset_fingerprint
+from app.utils.dataset_profile import get_profile, compute_profile, SAMPLE_ROWS
+from app.utils.sql_backends import run_sql
+from app.utils.result_cache import result_cache
+from app.utils.result_encoding import encode_records
+from app.utils.chunked_query import is_large_csv, csv_columns, run_chunked_query, NotDecomposable
+from app.utils import code_sandbox
+from app.utils.code_sandbox import run_pandas_in_sandbox
+from app.utils.column_pushdown import pandas_load_options
+from app.utils.prompt_budget import compact_enhanced_schema, relevant_column_stats
 
 logging.basicConfig(
     level=logging.DEBUG, 
@@ -13,6 +24,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# SQL results that stopped at the requested page: handle -> (file, extension, sql), so a
+# later page past the rows read runs the query again and reads further
+PARTIAL_SQL_HANDLES = int(os.getenv('PARTIAL_SQL_HANDLES', 256))
+_partial_sql = OrderedDict()
+_partial_sql_lock = threading.Lock()
+
 def handle_exceptions(return_error_dict=True):
     def decorator(func):
         @functools.wraps(func)
@@ -33,135 +50,33 @@ def handle_exceptions(return_error_dict=True):
 def get_database_schema(file_path):
     abs_file_path = os.path.abspath(file_path)  
     logger.info(f"Checking file at {abs_file_path}")
-    file_extension = os.path.splitext(abs_file_path)[1].lower()
-    schema = {}
-    
-    if file_extension == '.db':
-        import sqlite3
-        conn = sqlite3.connect(abs_file_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cursor.fetchall()]
-        logger.info(f"Following Tables found: {tables}")
-        for table in tables:
-            cursor.execute(f"PRAGMA table_info({table});")
-            columns = [row[1] for row in cursor.fetchall()]
-            schema[table] = columns
-            logger.info(f"Columns in {table}: {columns}")
-        conn.close()
-        
-        # Format schema information
-        schema_text = "Database Schema:\n"
-        for table, cols in schema.items():
-            schema_text += f"Table: {table}\n"
-            schema_text += f"Columns: {', '.join(cols)}\n\n"
-        
-        return schema_text
-    else:  # CSV file
-        try:
-            df = pd.read_csv(abs_file_path)
-            columns = df.columns.tolist()
-            logger.info(f"CSV columns: {columns}")
-            
-            # Basic schema info
-            schema_text = "Database Schema:\n"
-            schema_text += f"Table: data\n"
-            schema_text += f"Columns: {', '.join(columns)}\n"
-            schema_text += f"Row count: {len(df)}\n\n"
-            
-            return schema_text
-        except Exception as e:
-            logger.exception(f"Error reading CSV file: {str(e)}")
-            return f"Error: Could not read CSV file - {str(e)}"
+    # Served from the profile built at upload time, no need to re-read the file
+    return get_profile(abs_file_path)["schema_text"]
 
 @handle_exceptions(return_error_dict=False)
-def get_enhanced_schema_with_samples(file_path, sample_rows=5):
+def get_enhanced_schema_with_samples(file_path, sample_rows=SAMPLE_ROWS):
     """Get schema and sample data for RAG"""
     abs_file_path = os.path.abspath(file_path)
-    file_extension = os.path.splitext(abs_file_path)[1].lower()
-    
-    # Get basic schema
-    schema_text = get_database_schema(file_path)
-    
-    # Add sample data
-    if file_extension == '.db':
-        import sqlite3
-        conn = sqlite3.connect(abs_file_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        sample_text = "Sample Data:\n"
-        for table in tables:
-            cursor.execute(f"SELECT * FROM {table} LIMIT {sample_rows};")
-            rows = cursor.fetchall()
-            
-            # Get column names
-            cursor.execute(f"PRAGMA table_info({table});")
-            columns = [row[1] for row in cursor.fetchall()]
-            
-            sample_text += f"Table: {table}\n"
-            # Create a simple tabular representation
-            sample_text += " | ".join(columns) + "\n"
-            sample_text += "-" * (sum(len(col) for col in columns) + 3 * (len(columns) - 1)) + "\n"
-            
-            for row in rows:
-                sample_text += " | ".join(str(val) for val in row) + "\n"
-            
-            sample_text += "\n"
-        
-        conn.close()
-        return schema_text + "\n" + sample_text
-    else:  # CSV file
-        try:
-            df = pd.read_csv(abs_file_path)
-            
-            # Add column statistics to help LLM understand data distribution
-            stats_text = "Column Statistics:\n"
-            for col in df.columns:
-                if pd.api.types.is_numeric_dtype(df[col]):
-                    stats_text += f"{col}: min={df[col].min()}, max={df[col].max()}, avg={df[col].mean():.2f}\n"
-                else:
-                    # For string columns, show unique value count
-                    unique_vals = df[col].nunique()
-                    stats_text += f"{col}: {unique_vals} unique values\n"
-                    # If few unique values, show them
-                    if unique_vals <= 10:
-                        stats_text += f"  Values: {', '.join([str(x) for x in df[col].unique()[:10]])}\n"
-            
-            # Sample data
-            sample_text = "\nSample Data (first 5 rows):\n"
-            sample_df = df.head(sample_rows)
-            
-            # Convert to a simple string table
-            headers = sample_df.columns.tolist()
-            header_row = " | ".join(headers)
-            separator = "-" * len(header_row)
-            
-            sample_text += header_row + "\n"
-            sample_text += separator + "\n"
-            
-            for _, row in sample_df.iterrows():
-                sample_text += " | ".join([str(row[col])[:20] for col in headers]) + "\n"
-            
-            return schema_text + "\n" + stats_text + "\n" + sample_text
-        except Exception as e:
-            logger.exception(f"Error getting enhanced schema: {str(e)}")
-            return schema_text + f"\nError getting sample data: {str(e)}"
+    if sample_rows != SAMPLE_ROWS:
+        return compute_profile(abs_file_path, sample_rows)["enhanced_schema_text"]
+    return get_profile(abs_file_path)["enhanced_schema_text"]
 
-@handle_exceptions()
-def execute_pandas_query(file_path, pandas_code):
-    abs_file_path = os.path.abspath(file_path)
-    if not os.path.exists(abs_file_path):
-        return {"success": False, "error": f"File not found: {file_path}"}
-    
-    file_extension = os.path.splitext(abs_file_path)[1].lower()
-    if file_extension != '.csv':
-        return {"success": False, "error": "This operation is only supported for CSV files"}
-    
-    df = pd.read_csv(abs_file_path)
-    logger.info(f"DataFrame shape: {df.shape}")
-    
+@handle_exceptions(return_error_dict=False)
+def get_prompt_schema(file_path, token_budget, question=""):
+    """Enhanced schema cut down to ~token_budget tokens, the columns the question needs kept in full.
+    Without a question it's the same text for every question."""
+    return compact_enhanced_schema(get_profile(os.path.abspath(file_path)), question, token_budget)
+
+def get_question_columns(file_path, question, schema_text):
+    """Stats of the columns the question is about that schema_text leaves out, "" if none"""
+    try:
+        return relevant_column_stats(get_profile(os.path.abspath(file_path)), question, schema_text)
+    except Exception as e:
+        logger.info(f"Error in get_question_columns: {str(e)}")
+        return ""
+
+def _column_selection(pandas_code, columns):
+    """Columns for the simple df[[...]] column selection case, None if the code isn't one"""
     # Handle special case for simple column selection
     column_selection_pattern = r"df\[\[(.+)\]\]"
     match = re.search(column_selection_pattern, pandas_code)
@@ -174,117 +89,207 @@ def execute_pandas_query(file_path, pandas_code):
                 clean_col = col_str.strip().strip("'").strip('"')
                 requested_columns.append(clean_col)
 
-            valid_columns = [col for col in requested_columns if col in df.columns]
+            valid_columns = [col for col in requested_columns if col in columns]
             logger.info(f"Valid columns found in DataFrame: {valid_columns}")
             
             if valid_columns:
-                result_df = df[valid_columns]
                 logger.info(f"Successfully selected columns: {valid_columns}")
-                return {
-                    "success": True,
-                    "results": result_df.to_dict(orient='records'),
-                    "columns": valid_columns
-                }
-            else:
-                logger.info("No valid columns found in DataFrame")
-                return {
-                    "success": False,
-                    "error": f"None of the requested columns {requested_columns} were found in the DataFrame. Available columns are: {df.columns.tolist()}"
-                }
+                return valid_columns
         except Exception as column_error:
             logger.info(f"Error processing column selection: {str(column_error)}")
-    
-    print(f"Running pandas code: {pandas_code[:100]}...")
+        else:
+            logger.info("No valid columns found in DataFrame")
+            raise ValueError(f"None of the requested columns {requested_columns} were found in the DataFrame. Available columns are: {list(columns)}")
+    return None
 
-    # Create locals dictionary with the DataFrame
-    locals_dict = {'df': df, 'result': None}
-    exec(f"result = {pandas_code}", {'pd': pd, 'np': np, '__builtins__': {}}, locals_dict)
-    
-    if isinstance(locals_dict['result'], pd.DataFrame) and len(locals_dict['result'].columns) == 2 and locals_dict['result'].columns.duplicated().any():
-        locals_dict['result'].columns = ["value", "count"]
-    if isinstance(locals_dict['result'], pd.DataFrame):
-        if any(locals_dict['result'].columns.duplicated()):
+def _result_to_frame(result):
+    """Whatever the generated code evaluated to, as a DataFrame"""
+    if isinstance(result, pd.DataFrame) and len(result.columns) == 2 and result.columns.duplicated().any():
+        result.columns = ["value", "count"]
+    if isinstance(result, pd.DataFrame):
+        if any(result.columns.duplicated()):
             # Rename duplicate columns by adding a number suffix
-            cols = list(locals_dict['result'].columns)
+            cols = list(result.columns)
             for i, col in enumerate(cols):
                 count = cols[:i].count(col)
                 if count > 0:
                     cols[i] = f"{col}_{count}"
-            locals_dict['result'].columns = cols
-        
-        results_dict = locals_dict['result'].to_dict(orient='records')
-        return {
-            "success": True,
-            "results": results_dict,
-            "columns": locals_dict['result'].columns.tolist()
-        }
-    elif isinstance(locals_dict['result'], pd.Series):
+            result.columns = cols
+        return result
+    elif isinstance(result, pd.Series):
         # Convert Series to DataFrame
-        result_df = locals_dict['result'].reset_index()
+        result_df = result.reset_index()
         
         # If index has no name, give it a default
         if result_df.columns[0] == 'index':
             result_df.columns = ['key', 'value']
-        
-        results_dict = result_df.to_dict(orient='records')
-        
-        return {
-            "success": True,
-            "results": results_dict,
-            "columns": result_df.columns.tolist()
-        }
+        return result_df
     else:
         # Handle scalar or other types
-        return {
-            "success": True,
-            "results": [{"result": locals_dict['result']}],
-            "columns": ["result"]
-        }
+        return pd.DataFrame({"result": [result]})
+
+def _run_pandas_code(df, pandas_code):
+    """Runs the generated code against df and always hands back a DataFrame"""
+    valid_columns = _column_selection(pandas_code, df.columns)
+    if valid_columns:
+        return df[valid_columns]
+    
+    print(f"Running pandas code: {pandas_code[:100]}...")
+
+    # Create locals dictionary with the DataFrame
+    locals_dict = {'df': df, 'result': None}
+    exec(f"result = {pandas_code}", {'pd': pd, 'np': np, '__builtins__': {}}, locals_dict)
+    return _result_to_frame(locals_dict['result'])
+
+def _run_pandas_chunked(abs_file_path, pandas_code):
+    """For CSVs too big to load: runs the code chunk by chunk, None if it can't be split up"""
+    columns = csv_columns(abs_file_path)
+    valid_columns = _column_selection(pandas_code, columns)
+    if valid_columns:
+        pandas_code = f"df[{valid_columns!r}]"
+    try:
+        return _result_to_frame(run_chunked_query(abs_file_path, pandas_code, columns))
+    except NotDecomposable as e:
+        logger.info(f"Can't run chunked ({str(e)}), loading the whole file")
+        return None
+
+def _frame_to_results(frame, handle=None, offset=0, limit=None, records=True, complete=True):
+    """Only the requested page is encoded, the rest stays in the cached frame.
+
+    "page" is the page as a DataFrame for the columnar/arrow encoders, "results" the
+    JSON safe records (skipped when records=False). For a frame that isn't the whole
+    result (complete=False) total_rows is None, the real count isn't known.
+    """
+    offset = max(int(offset or 0), 0)
+    page = frame.iloc[offset:] if limit is None else frame.iloc[offset:offset + int(limit)]
+    return _page_to_results(page, len(frame), handle, offset, limit, records, complete)
+
+def _page_to_results(page, row_count, handle=None, offset=0, limit=None, records=True, complete=True):
+    """Same as _frame_to_results for a page already cut out of a frame of row_count rows"""
+    return {
+        "success": True,
+        "results": encode_records(page) if records else None,
+        "page": page,
+        "columns": page.columns.tolist(),
+        "handle": handle,
+        "offset": offset,
+        "limit": limit,
+        "total_rows": row_count if complete else None,
+        "truncated": offset + len(page) < row_count
+    }
+
+def _cached_page(handle, offset, limit):
+    """(page, row count) of a cached result, only the page's rows are decoded"""
+    return result_cache.get_page(handle, offset, None if limit is None else int(limit))
+
+def _partial_source(handle):
+    with _partial_sql_lock:
+        return _partial_sql.get(handle)
+
+def _covers(row_count, offset, limit):
+    """Whether a partial result of row_count rows has the rows of this page and at least one after it"""
+    return row_count is not None and limit is not None and offset + int(limit) < row_count
+
+def _fetch_sql_results(cache_key, abs_file_path, file_extension, sql_query, offset, limit, rows_read=0):
+    """Runs the SQL reading only the rows up to the end of the page, plus one to tell if
+    there are more. Returns (frame, handle, complete)."""
+    max_rows = None
+    if limit is not None:
+        # paging further through the same result doubles what is read each time
+        max_rows = max(offset + int(limit) + 1, 2 * rows_read)
+    results = run_sql(abs_file_path, file_extension, sql_query, max_rows)
+    complete = max_rows is None or len(results) < max_rows
+    cached = result_cache.put(cache_key, results)
+    with _partial_sql_lock:
+        _partial_sql.pop(cache_key, None)
+        if cached and not complete:
+            _partial_sql[cache_key] = (abs_file_path, file_extension, sql_query)
+            while len(_partial_sql) > PARTIAL_SQL_HANDLES:
+                _partial_sql.popitem(last=False)
+    if not complete:
+        logger.info(f"Stopped reading SQL results after {len(results)} rows")
+    return results, cache_key if cached else None, complete
+
+def get_result_page(handle, offset=0, limit=None, records=True):
+    """Another page of an earlier result, straight from the result cache"""
+    offset = max(int(offset or 0), 0)
+    cached = _cached_page(handle, offset, limit)
+    row_count = None if cached is None else cached[1]
+    source = _partial_source(handle)
+    if source is not None and not _covers(row_count, offset, limit):
+        # the query stopped before this page, read further
+        frame, handle, complete = _fetch_sql_results(handle, *source, offset, limit, row_count or 0)
+        return _frame_to_results(frame, handle, offset, limit, records, complete)
+    if cached is None:
+        return {"success": False, "error": "Result not found or expired, run the query again"}
+    return _page_to_results(cached[0], row_count, handle, offset, limit, records, complete=source is None)
+
+def run_pandas_job(abs_file_path, pandas_code, loader=None):
+    """The actual execution of generated code, runs in a sandbox worker unless that's off"""
+    result_df = None
+    if is_large_csv(abs_file_path):
+        result_df = _run_pandas_chunked(abs_file_path, pandas_code)
+    if result_df is None:
+        # only parse the columns the code uses, with the dtypes from the profile
+        options = pandas_load_options(pandas_code, get_profile(abs_file_path)) or {}
+        df = (loader or load_dataframe)(abs_file_path, **options)
+        logger.info(f"DataFrame shape: {df.shape}")
+        result_df = _run_pandas_code(df, pandas_code)
+    return result_df
 
 @handle_exceptions()
-def execute_query(file_path, sql_query):
+def execute_pandas_query(file_path, pandas_code, offset=0, limit=None, records=True, cancel_key=None):
     abs_file_path = os.path.abspath(file_path)
+    if not os.path.exists(abs_file_path):
+        return {"success": False, "error": f"File not found: {file_path}"}
+    
     file_extension = os.path.splitext(abs_file_path)[1].lower()
+    if file_extension != '.csv':
+        return {"success": False, "error": "This operation is only supported for CSV files"}
     
-    if file_extension == '.db':
-        conn = sqlite3.connect(abs_file_path)
-        results = pd.read_sql_query(sql_query, conn)
-        conn.close()
-        
-        return {
-            "success": True,
-            "results": results.to_dict(orient="records"),
-            "columns": results.columns.tolist()
-        }
-        
-    elif file_extension == '.csv':
-        df = pd.read_csv(abs_file_path)
-        logger.info(f"CSV DataFrame columns: {df.columns.tolist()}")
-        logger.info(f"CSV DataFrame sample data:\n{df.head(3)}")
-        
-        # Create temporary in-memory SQLite database
-        conn = sqlite3.connect(":memory:")
-        table_name = 'data'
-        df.to_sql(table_name, conn, index=False, if_exists="replace")
-        
-        # Execute the query
-        try:
-            logger.info(f"Executing SQL Query: {sql_query}")
-            results = pd.read_sql_query(sql_query, conn)
-            logger.info(f"Query results shape: {results.shape}")
-        finally:
-            conn.close()
-        
-        return {
-            "success": True,
-            "results": results.to_dict(orient="records"),
-            "columns": results.columns.tolist()
-        }
+    # Same code on the same version of the file -> same answer, skip the work
+    cache_key = result_cache.make_key(dataset_fingerprint(abs_file_path), "pandas", pandas_code)
+    offset = max(int(offset or 0), 0)
+    cached = _cached_page(cache_key, offset, limit)
+    if cached is not None:
+        logger.info("Result cache hit for pandas query")
+        return _page_to_results(cached[0], cached[1], cache_key, offset, limit, records)
+    if code_sandbox.SANDBOX_ENABLED:
+        # own process, with time/memory limits, so it can't stall other requests
+        result_df = run_pandas_in_sandbox(abs_file_path, pandas_code, cancel_key=cancel_key)
     else:
+        result_df = run_pandas_job(abs_file_path, pandas_code)
+    if not result_cache.put(cache_key, result_df):
+        cache_key = None
+    
+    # the cache key doubles as the handle for fetching more pages
+    return _frame_to_results(result_df, cache_key, offset, limit, records)
+
+@handle_exceptions()
+def execute_query(file_path, sql_query, offset=0, limit=None, records=True):
+    abs_file_path = os.path.abspath(file_path)
+    file_extension = os.path.splitext(abs_file_path)[1].lower()
+    
+    if file_extension not in ('.db', '.csv'):
         return {
             "success": False,
             "error": f"Unsupported file format: {file_extension}"
         }
+    
+    cache_key = result_cache.make_key(dataset_fingerprint(abs_file_path), "sql", sql_query)
+    offset = max(int(offset or 0), 0)
+    cached = _cached_page(cache_key, offset, limit)
+    row_count = None if cached is None else cached[1]
+    partial = _partial_source(cache_key) is not None
+    if cached is not None and (not partial or _covers(row_count, offset, limit)):
+        logger.info("Result cache hit for SQL query")
+        return _page_to_results(cached[0], row_count, cache_key, offset, limit, records, complete=not partial)
+    # with a page limit only the rows up to the end of the page are read
+    results, cache_key, complete = _fetch_sql_results(
+        cache_key, abs_file_path, file_extension, sql_query, offset, limit, row_count or 0
+    )
+    
+    return _frame_to_results(results, cache_key, offset, limit, records, complete)
 
 def format_results(results):
     if not results.get("success", False):
@@ -0,0 +1,197 @@
+# Vector index over the RAG example questions.
+# find_examples / guess_relevant_files used to split every example question into a word
+# set on every call and count shared words: linear in the number of examples and noisy
+# ("what", "the" count as matches). Questions are now embedded once into a matrix of
+# unit vectors; a search is one matmul (cosine similarity) and an argpartition for the
+# top k.
+#
+# Embeddings come from a local sentence-transformers model when EMBEDDING_MODEL names
+# one that is available offline, otherwise from a hashing vectorizer: word unigrams,
+# bigrams and character trigrams hashed into EXAMPLE_INDEX_DIM signed buckets. No
+# vocabulary to fit, and a stable hash, so vectors are the same in every process.
+# Built matrices are saved as <index dir>/<name>.npz and reused while the texts and the
+# embedder are unchanged. Texts added at runtime (add) are only kept in memory: they are
+# registered again at every start, and saving them would rewrite the whole file per add
+# and change the texts the saved file is checked against.
+
+import os
+import re
+import zlib
+import hashlib
+import logging
+import numpy as np
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# 4 KiB a question as float32, 10k questions are 40 MB
+EXAMPLE_INDEX_DIM = int(os.getenv('EXAMPLE_INDEX_DIM', 1024))
+# unset = indexes only in memory, main.py keeps them in uploads/indexes
+EXAMPLE_INDEX_DIR = os.getenv('EXAMPLE_INDEX_DIR')
+# cosine similarity below this isn't a match
+EXAMPLE_MIN_SCORE = float(os.getenv('EXAMPLE_MIN_SCORE', 0.1))
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', '')
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# words that say nothing about what a question is after
+STOPWORDS = frozenset(
+    "a an the of in on at for to is are was were be been what whats which who s me my i it its "
+    "this that there and or do does did with".split()
+)
+# character trigrams match "payment"/"payments", but count for less than whole words
+CHAR_NGRAM_WEIGHT = 0.3
+
+
+def tokenize(text):
+    return [word for word in _TOKEN.findall(text.lower()) if word not in STOPWORDS]
+
+
+def _features(text):
+    words = tokenize(text)
+    yield from (("w:" + word, 1.0) for word in words)
+    yield from ((f"b:{a} {b}", 1.0) for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"<{word}>"
+        yield from (("c:" + padded[i:i + 3], CHAR_NGRAM_WEIGHT) for i in range(len(padded) - 2))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class HashingEmbedder:
+    def __init__(self, dim=EXAMPLE_INDEX_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in _features(text):
+                h = zlib.crc32(feature.encode())
+                # the top bit picks the sign so collisions cancel out rather than pile up
+                matrix[row, h % self.dim] += weight if h >> 31 else -weight
+        return _normalize(matrix)
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        # never downloads, the model has to be on disk already
+        self.model = SentenceTransformer(model_name, local_files_only=True)
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_MODEL:
+            try:
+                _embedder = SentenceTransformerEmbedder(EMBEDDING_MODEL)
+            except Exception as e:
+                logger.warning(f"Can't load embedding model {EMBEDDING_MODEL!r} ({str(e)}), using hashed words")
+        if _embedder is None:
+            _embedder = HashingEmbedder()
+    return _embedder
+
+
+class ExampleIndex:
+    """Cosine top-k search over a list of texts"""
+
+    def __init__(self, name, texts, embedder=None, index_dir=EXAMPLE_INDEX_DIR):
+        self.name = name
+        self.texts = list(texts)
+        self.embedder = embedder or get_embedder()
+        self.digest = self._digest()
+        self.path = os.path.join(index_dir, f"{name}.npz") if index_dir else None
+        self.matrix = self._load()
+        if self.matrix is None:
+            self.matrix = self.embedder.embed(self.texts) if self.texts else np.zeros((0, 0), dtype=np.float32)
+            self._save()
+
+    def _digest(self):
+        return hashlib.sha256("\0".join([self.embedder.name] + self.texts).encode()).hexdigest()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as saved:
+                if str(saved["digest"]) == self.digest:
+                    return saved["matrix"]
+        except (OSError, KeyError, ValueError) as e:
+            logger.info(f"Ignoring unreadable example index {self.path}: {str(e)}")
+        return None
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, matrix=self.matrix, digest=np.array(self.digest))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.info(f"Couldn't save example index {self.path}: {str(e)}")
+
+    def add(self, texts):
+        """Appends texts, only they are embedded. Not saved, see the top of the file."""
+        texts = list(texts)
+        if not texts:
+            return
+        vectors = self.embedder.embed(texts)
+        matrix = vectors if not self.texts else np.vstack([self.matrix, vectors])
+        # matrix first, so readers never see more texts than rows
+        self.matrix = matrix
+        self.texts = self.texts + texts
+
+    def clear(self, rows):
+        """Zeroes the vectors of rows so they never match again. Rows aren't removed, the
+        row numbers readers hold stay valid."""
+        rows = list(rows)
+        if not rows:
+            return
+        matrix = self.matrix.copy()
+        matrix[rows] = 0
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.texts)
+
+    def scores(self, query):
+        """Cosine similarity of the query to every text"""
+        matrix = self.matrix
+        if not len(matrix):
+            return np.zeros(0, dtype=np.float32)
+        return matrix @ self.embedder.embed([query])[0]
+
+    def search(self, query, k=3, rows=None, min_score=EXAMPLE_MIN_SCORE):
+        """[(row, score)] of the k best texts scoring at least min_score, best first.
+        rows limits the search to those row numbers."""
+        return top_k(self.scores(query), k, rows, min_score)
+
+
+def top_k(scores, k, rows=None, min_score=EXAMPLE_MIN_SCORE):
+    """[(row, score)] of the k highest scores that are at least min_score, best first"""
+    candidates = np.arange(len(scores)) if rows is None else np.asarray(rows, dtype=np.int64)
+    if k <= 0 or not len(candidates):
+        return []
+    candidate_scores = scores[candidates]
+    if k < len(candidates):
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+    else:
+        top = np.arange(len(candidates))
+    top = top[np.argsort(-candidate_scores[top], kind="stable")]
+    return [(int(candidates[i]), float(candidate_scores[i])) for i in top if candidate_scores[i] >= min_score]
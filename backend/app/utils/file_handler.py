@@ -1,48 +1,321 @@
 # It currently supports basic validation for .csv and .db files.
-# Todo: Add better validation and file size limits if needed.
+# Uploads are streamed to disk in chunks and validated from their first block
+# (see upload_ingest). Big files can also be sent as resumable chunked PUTs.
+# Content is stored once under uploads/objects/<sha256>.<ext>, each upload gets a
+# uuid named alias of it, so re-uploading the same export costs no disk and hits
+# the caches/profile/SQLite copy that already exist.
 
 import os
-import uuid  
+import json
+import time
+import uuid
+import shutil
+import hashlib
 import logging
+import threading
+from flask import current_app, has_app_context
+from app.utils.dataset_profile import build_profile
+from app.utils.dataset_catalog import dataset_catalog
+from app.utils.materialize import build_parquet_copy
+from app.utils.parquet_copy import get_parquet_copy
+from app.utils.upload_ingest import (
+    StreamingUpload, UploadError, ALLOWED_EXTENSIONS, write_ingest_info, ingest_info_path_for,
+    hash_file
+)
 
 logging.basicConfig(
-    level=logging.DEBUG, 
+    level=logging.DEBUG,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# unfinished chunked uploads older than this get cleaned up (seconds)
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+
+# sha256 state of in-progress chunked uploads, so chunks are hashed as they arrive.
+# If the server restarts mid upload the file just gets hashed once at the end instead.
+_session_hashers = {}
+_session_locks = {}
+_sessions_guard = threading.Lock()
+# one upload of a given content finalises at a time, so duplicates arriving together
+# don't both store and profile it
+_object_locks = {}
+
+
+# backend/uploads, used outside a request or when the app doesn't set UPLOAD_FOLDER
+DEFAULT_UPLOAD_FOLDER = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "uploads"
+)
+
+
+def get_upload_folder():
+    # the app's UPLOAD_FOLDER, so tests (and deployments) can put uploads somewhere else
+    upload_folder = DEFAULT_UPLOAD_FOLDER
+    if has_app_context():
+        upload_folder = current_app.config.get('UPLOAD_FOLDER') or DEFAULT_UPLOAD_FOLDER
+    os.makedirs(upload_folder, exist_ok=True)
+    return upload_folder
+
+
+def _extension_for(filename):
+    if not filename or "." not in filename:
+        raise UploadError("Invalid filename format")
+    file_extension = filename.rsplit(".", 1)[-1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise UploadError("Only .csv or .db files can be uploaded")
+    return file_extension
+
+
+def _objects_dir():
+    path = os.path.join(get_upload_folder(), "objects")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _object_path(sha256, file_extension):
+    return os.path.join(_objects_dir(), f"{sha256}.{file_extension}")
+
+
+def _object_lock(sha256):
+    with _sessions_guard:
+        return _object_locks.setdefault(sha256, threading.Lock())
+
+
+def _link_alias(object_path, alias_path):
+    # relative symlink so the uploads folder can be moved around
+    try:
+        os.symlink(os.path.relpath(object_path, os.path.dirname(alias_path)), alias_path)
+        return
+    except (OSError, NotImplementedError):
+        pass
+    # no symlinks (e.g. Windows without the privilege): hardlink or copy, still works
+    # but that alias gets its own sidecars/caches
+    try:
+        os.link(object_path, alias_path)
+    except OSError:
+        shutil.copyfile(object_path, alias_path)
+
+
+def _upload_response(object_path, sha256, original_filename, file_extension, deduplicated):
+    # every upload still gets its own uuid name, as an alias of the stored content
+    unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
+    file_path = os.path.join(get_upload_folder(), unique_filename)
+    _link_alias(object_path, file_path)
+    return {
+        "success": True,
+        "filename": unique_filename,
+        "original_filename": original_filename,
+        "path": file_path,
+        "size": os.path.getsize(object_path),
+        "sha256": sha256,
+        "deduplicated": deduplicated
+    }
+
+
+def _finalize_upload(tmp_path, info, original_filename, file_extension):
+    """Moves a fully received upload into place, records how to read it, profiles it,
+    writes the Parquet copy of CSVs and adds it to the dataset catalog.
+
+    Content already uploaded before is not stored again, the new name points at the
+    existing copy and reuses its profile and SQLite copy. Its Parquet copy is written
+    then if it has none (stored before there were Parquet copies) or an outdated one.
+    """
+    object_path = _object_path(info["sha256"], file_extension)
+    with _object_lock(info["sha256"]):
+        deduplicated = os.path.exists(object_path)
+        if deduplicated:
+            os.remove(tmp_path)
+            logger.info(f"{original_filename} already stored as {os.path.basename(object_path)}")
+        else:
+            os.replace(tmp_path, object_path)
+        if not os.path.exists(ingest_info_path_for(object_path)):
+            write_ingest_info(object_path, dict(info, original_filename=original_filename))
+        if not deduplicated:
+            # one off profiling pass so queries don't have to rebuild schema/stats every time
+            try:
+                build_profile(object_path)
+            except Exception as e:
+                # not fatal, the profile gets rebuilt on first query
+                logger.info(f"Could not profile {original_filename}: {str(e)}")
+        if file_extension == "csv" and (not deduplicated or get_parquet_copy(object_path) is None):
+            try:
+                build_parquet_copy(object_path)
+            except Exception as e:
+                # readers fall back to the CSV
+                logger.info(f"Could not write a Parquet copy of {original_filename}: {str(e)}")
+        if not deduplicated:
+            try:
+                dataset_catalog.add(object_path)
+            except Exception as e:
+                # catalogued on its first query instead
+                logger.info(f"Could not catalog {original_filename}: {str(e)}")
+    return _upload_response(object_path, info["sha256"], original_filename, file_extension, deduplicated)
+
+
 # Save uploaded file to the 'uploads' folder
 # todo: delete uploads folder content before pushing
 def save_file(file):
-    allowed_extensions = {"csv", "db"}
     if not file.filename:
         logger.info("Nothing uploaded")
-        return {"Nothing uploaded"}
-    try:
-        file_extension = file.filename.split(".")[-1].lower()
-    except:
-        return {"error": "Invalid filename format"}
-    if file_extension not in allowed_extensions:
-        return {"PLease upload a .csv or .db file"}
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    upload_folder = os.path.join(project_root, "uploads")
-    
+        return {"success": False, "error": "Nothing uploaded"}
     try:
-        os.makedirs(upload_folder, exist_ok=True)
+        file_extension = _extension_for(file.filename)
+        upload_folder = get_upload_folder()
+    except UploadError as e:
+        return {"success": False, "error": str(e)}
     except Exception as e:
-        return {"Error ": f"cant create: {str(e)}"}
-    
+        return {"success": False, "error": f"cant create: {str(e)}"}
+
+    tmp_path = os.path.join(upload_folder, f".{uuid.uuid4().hex}.part")
+    upload = StreamingUpload(tmp_path, file_extension)
     try:
-        # get a unique filename 
-        unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+        # chunk by chunk, never holding the whole file in memory
+        upload.write_stream(file.stream)
+        info = upload.finish()
+    except UploadError as e:
+        upload.abort()
+        logger.info(f"Rejected upload {file.filename}: {str(e)}")
+        return {"success": False, "error": str(e)}
     except Exception as e:
+        upload.abort()
         logger.info(f"Problem saving {str(e)}")
-        return {f"Cant save {str(e)}"}
-    return {
-        "success": True, 
-        "filename": unique_filename, 
-        "original_filename": file.filename,
-        "path": file_path
-    }
\ No newline at end of file
+        return {"success": False, "error": f"Cant save {str(e)}"}
+    return _finalize_upload(tmp_path, info, file.filename, file_extension)
+
+
+# Resumable chunked uploads: create a session, PUT the bytes in order (any number of
+# requests, each one resumes from the offset the server has), then complete it.
+
+def _session_dir():
+    path = os.path.join(get_upload_folder(), ".sessions")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _session_paths(upload_id):
+    # ids are always uuid hex, anything else could be a path trick
+    if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+        raise UploadError("Unknown upload id", status=404)
+    base = os.path.join(_session_dir(), upload_id)
+    return base + ".json", base + ".part"
+
+
+def _load_session(upload_id):
+    state_path, part_path = _session_paths(upload_id)
+    try:
+        with open(state_path) as f:
+            return json.load(f), state_path, part_path
+    except (OSError, ValueError):
+        raise UploadError("Unknown upload id", status=404)
+
+
+def _save_session(state_path, state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def _session_lock(upload_id):
+    with _sessions_guard:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+
+def _drop_session(upload_id, state_path, part_path):
+    for path in (state_path, part_path):
+        if os.path.exists(path):
+            os.remove(path)
+    with _sessions_guard:
+        _session_hashers.pop(upload_id, None)
+        _session_locks.pop(upload_id, None)
+
+
+def cleanup_stale_sessions(now=None):
+    now = now or time.time()
+    session_dir = _session_dir()
+    for name in os.listdir(session_dir):
+        if not name.endswith(".json"):
+            continue
+        upload_id = name[:-len(".json")]
+        try:
+            state, state_path, part_path = _load_session(upload_id)
+        except UploadError:
+            continue
+        if now - state.get("updated", 0) > UPLOAD_SESSION_TTL:
+            logger.info(f"Dropping abandoned upload {upload_id}")
+            _drop_session(upload_id, state_path, part_path)
+
+
+def create_upload_session(filename, total_size=None):
+    file_extension = _extension_for(filename)
+    cleanup_stale_sessions()
+    upload_id = uuid.uuid4().hex
+    state_path, part_path = _session_paths(upload_id)
+    state = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "extension": file_extension,
+        "total_size": total_size,
+        "offset": 0,
+        "detected": None,
+        "updated": time.time()
+    }
+    open(part_path, "wb").close()
+    _save_session(state_path, state)
+    return state
+
+
+def get_upload_session(upload_id):
+    return _load_session(upload_id)[0]
+
+
+def append_upload_chunk(upload_id, stream, offset):
+    """Appends one chunk at `offset`, which has to be exactly where the last one ended"""
+    with _session_lock(upload_id):
+        state, state_path, part_path = _load_session(upload_id)
+        if offset != state["offset"]:
+            raise UploadError(f"Expected a chunk starting at byte {state['offset']}", status=409)
+        # a previous request may have died half way through a chunk
+        if os.path.getsize(part_path) != offset:
+            with open(part_path, "ab") as f:
+                f.truncate(offset)
+            _session_hashers.pop(upload_id, None)
+
+        hasher = _session_hashers.get(upload_id)
+        if hasher is None and offset == 0:
+            hasher = _session_hashers.setdefault(upload_id, hashlib.sha256())
+        upload = StreamingUpload(part_path, state["extension"], append=True,
+                                 sha256=hasher, detected=state["detected"])
+        try:
+            upload.write_stream(stream)
+            if offset == 0 and upload.size > 0:
+                state["detected"] = upload.detect()
+        except UploadError:
+            upload.abort()
+            _drop_session(upload_id, state_path, part_path)
+            raise
+        finally:
+            upload.close()
+        if hasher is None:
+            # hash was lost (restart), hash the whole thing at the end instead
+            _session_hashers.pop(upload_id, None)
+
+        state["offset"] = upload.size
+        state["updated"] = time.time()
+        _save_session(state_path, state)
+        return state
+
+
+def complete_upload_session(upload_id):
+    with _session_lock(upload_id):
+        state, state_path, part_path = _load_session(upload_id)
+        if state["total_size"] is not None and state["offset"] != state["total_size"]:
+            raise UploadError(f"Upload incomplete, have {state['offset']} of {state['total_size']} bytes", status=409)
+        if state["offset"] == 0 or state["detected"] is None:
+            raise UploadError("Uploaded file is empty")
+        hasher = _session_hashers.get(upload_id)
+        sha256 = hasher.hexdigest() if hasher is not None else hash_file(part_path)
+        info = dict(state["detected"], sha256=sha256, size=state["offset"])
+        result = _finalize_upload(part_path, info, state["filename"], state["extension"])
+        _drop_session(upload_id, state_path, part_path)
+        return result
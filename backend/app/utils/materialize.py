@@ -0,0 +1,259 @@
+# On-disk SQLite copy of CSV uploads for the SQL path.
+# The SQL fallback used to parse the CSV and insert every row into a :memory: database
+# on every query. Now each CSV is converted once into <upload>.sqlite (table 'data')
+# with indexes on likely filter columns, and rebuilt only when the source changes.
+# CSVs can also get an Arrow IPC copy (<upload>.arrow) that sandbox worker processes
+# memory map, so the data is shared through the page cache instead of pickled to them.
+# At ingest every CSV also gets a Parquet copy (<upload>.parquet, see parquet_copy)
+# that readers prefer over parsing the text.
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+import importlib.util
+from app.utils.dataset_cache import load_dataframe, file_fingerprint
+from app.utils.dataset_profile import get_profile
+from app.utils.upload_ingest import resolve_upload_path
+from app.utils.sqlite_pool import sqlite_pool
+from app.utils.chunked_query import is_large_csv, iter_csv_chunks
+from app.utils.parquet_copy import (
+    parquet_path_for, source_stamp, PARQUET_SOURCE_KEY, PARQUET_ROW_GROUP_ROWS, PARQUET_COMPRESSION
+)
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+MATERIALIZED_SUFFIX = ".sqlite"
+MATERIALIZE_VERSION = 1
+TABLE_NAME = "data"
+MAX_INDEXES = 8
+# string columns with at most this many distinct values are worth an index
+INDEX_MAX_DISTINCT = 5000
+
+ARROW_SUFFIX = ".arrow"
+# schema metadata key holding the (mtime_ns, size) the Arrow copy was made from
+ARROW_SOURCE_KEY = b"terranova_source"
+
+_build_locks = {}
+_locks_guard = threading.Lock()
+# fingerprints of files Arrow can't hold (mixed type columns...), not retried
+_arrow_unsupported = set()
+
+
+def materialized_path_for(file_path):
+    return resolve_upload_path(file_path) + MATERIALIZED_SUFFIX
+
+
+def _lock_for(abs_file_path):
+    with _locks_guard:
+        return _build_locks.setdefault(abs_file_path, threading.Lock())
+
+
+def _pick_index_columns(profile):
+    """Id columns first, then low cardinality text columns (state, status, type...)"""
+    table = profile["tables"][0]
+    row_count = table.get("row_count", 0)
+    id_cols = []
+    category_cols = []
+    for col in table["columns"]:
+        name = col["name"].lower()
+        if name == "id" or name.endswith("_id"):
+            id_cols.append(col["name"])
+        elif not col.get("numeric") and col.get("distinct", 0) <= INDEX_MAX_DISTINCT \
+                and col.get("distinct", 0) <= max(row_count, 1) / 2:
+            category_cols.append(col["name"])
+    return (id_cols + category_cols)[:MAX_INDEXES]
+
+
+def _source_matches(db_path, mtime_ns, size):
+    try:
+        with sqlite_pool.connection(db_path) as conn:
+            row = conn.execute("SELECT version, mtime_ns, size FROM _source").fetchone()
+    except (OSError, sqlite3.Error):
+        return False
+    return row == (MATERIALIZE_VERSION, mtime_ns, size)
+
+
+def build_materialized_db(file_path):
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    db_path = materialized_path_for(abs_file_path)
+    tmp_path = f"{db_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    logger.info(f"Materialising {abs_file_path} into {db_path}")
+
+    # big CSVs go in chunk by chunk instead of through one in-memory frame
+    frames = iter_csv_chunks(abs_file_path) if is_large_csv(abs_file_path) else [load_dataframe(abs_file_path)]
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # bulk load, no need for durability on a file we can always rebuild
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        for i, df in enumerate(frames):
+            df.to_sql(TABLE_NAME, conn, index=False, if_exists="replace" if i == 0 else "append", chunksize=50000)
+        for i, col in enumerate(_pick_index_columns(get_profile(abs_file_path))):
+            quoted = col.replace('"', '""')
+            conn.execute(f'CREATE INDEX "idx_{TABLE_NAME}_{i}" ON {TABLE_NAME} ("{quoted}")')
+        conn.execute("CREATE TABLE _source (version INTEGER, mtime_ns INTEGER, size INTEGER)")
+        conn.execute("INSERT INTO _source VALUES (?, ?, ?)", (MATERIALIZE_VERSION, mtime_ns, size))
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return db_path
+
+
+def get_materialized_db(file_path):
+    """Path to an up to date SQLite copy of a CSV, building it the first time"""
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    db_path = materialized_path_for(abs_file_path)
+    if _source_matches(db_path, mtime_ns, size):
+        return db_path
+    with _lock_for(abs_file_path):
+        # someone else may have built it while we waited
+        if _source_matches(db_path, mtime_ns, size):
+            return db_path
+        return build_materialized_db(abs_file_path)
+
+
+def arrow_path_for(file_path):
+    return resolve_upload_path(file_path) + ARROW_SUFFIX
+
+
+def _arrow_source_matches(arrow_path, mtime_ns, size):
+    import pyarrow as pa
+    try:
+        with pa.memory_map(arrow_path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return metadata.get(ARROW_SOURCE_KEY) == json.dumps([mtime_ns, size]).encode()
+
+
+def build_arrow_copy(file_path):
+    import pyarrow as pa
+    abs_file_path, mtime_ns, size = file_fingerprint(file_path)
+    arrow_path = arrow_path_for(abs_file_path)
+    tmp_path = f"{arrow_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    logger.info(f"Writing Arrow copy of {abs_file_path}")
+
+    frame = load_dataframe(abs_file_path)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    # float NaN kept as a value rather than made a null, so readers map the column
+    # straight into pandas; a column with nulls is copied on every read
+    for i, dtype in enumerate(frame.dtypes):
+        if dtype in ("float32", "float64"):
+            table = table.set_column(i, table.field(i), pa.array(frame.iloc[:, i].to_numpy(), type=table.field(i).type))
+    metadata = dict(table.schema.metadata or {})
+    metadata[ARROW_SOURCE_KEY] = json.dumps([mtime_ns, size]).encode()
+    table = table.replace_schema_metadata(metadata)
+    try:
+        # uncompressed IPC file, so readers can map it instead of decoding it
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, arrow_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return arrow_path
+
+
+def get_arrow_copy(file_path):
+    """Path to an up to date Arrow IPC copy of a CSV, None without pyarrow or when the
+    data doesn't convert (callers then load the CSV itself)"""
+    if importlib.util.find_spec("pyarrow") is None:
+        return None
+    fingerprint = file_fingerprint(file_path)
+    abs_file_path, mtime_ns, size = fingerprint
+    if fingerprint in _arrow_unsupported:
+        return None
+    arrow_path = arrow_path_for(abs_file_path)
+    if _arrow_source_matches(arrow_path, mtime_ns, size):
+        return arrow_path
+    with _lock_for(arrow_path):
+        if _arrow_source_matches(arrow_path, mtime_ns, size):
+            return arrow_path
+        try:
+            return build_arrow_copy(abs_file_path)
+        except (TypeError, ValueError) as e:
+            # pyarrow's ArrowInvalid / ArrowTypeError are ValueError / TypeError
+            logger.info(f"No Arrow copy for {abs_file_path}: {str(e)}")
+            _arrow_unsupported.add(fingerprint)
+            return None
+
+
+def read_arrow_copy(arrow_path, columns=None):
+    """DataFrame over the memory mapped Arrow copy, columns are read straight from the map"""
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+def _parquet_schema(frame, profile):
+    """Schema of the first chunk, with the column types the profile found for the whole file
+    (a column can be all empty or all ints in one chunk)"""
+    import pyarrow as pa
+    types = {"int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(), "str": pa.string()}
+    dtypes = {col["name"]: col["dtype"] for col in profile["tables"][0]["columns"]} if profile else {}
+    frame = frame.astype({col: kind for col, kind in dtypes.items() if kind in types and col in frame.columns})
+    schema = pa.Schema.from_pandas(frame, preserve_index=False)
+    for col, kind in dtypes.items():
+        if kind in types and col in schema.names:
+            i = schema.get_field_index(col)
+            schema = schema.set(i, schema.field(i).with_type(types[kind]))
+    return schema, {col: kind for col, kind in dtypes.items() if kind in types}
+
+
+def build_parquet_copy(file_path):
+    """Writes <upload>.parquet for a CSV upload, None without pyarrow or when the data
+    doesn't convert (readers then keep using the CSV)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+    abs_file_path = resolve_upload_path(file_path)
+    parquet_path = parquet_path_for(abs_file_path)
+    tmp_path = f"{parquet_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    # taken before reading, a file changed halfway through won't match it
+    stamp = source_stamp(abs_file_path)
+    large = is_large_csv(abs_file_path)
+    logger.info(f"Writing Parquet copy of {abs_file_path}")
+    with _lock_for(parquet_path):
+        writer = None
+        try:
+            for frame in iter_csv_chunks(abs_file_path) if large else [load_dataframe(abs_file_path)]:
+                if writer is None:
+                    schema, dtypes = _parquet_schema(frame, get_profile(abs_file_path) if large else None)
+                    metadata = dict(schema.metadata or {})
+                    metadata[PARQUET_SOURCE_KEY] = stamp
+                    schema = schema.with_metadata(metadata)
+                    writer = pq.ParquetWriter(tmp_path, schema, compression=PARQUET_COMPRESSION)
+                if dtypes:
+                    frame = frame.astype({col: kind for col, kind in dtypes.items() if col in frame.columns})
+                table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+                writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_ROWS)
+            if writer is None:
+                return None
+            writer.close()
+            writer = None
+            os.replace(tmp_path, parquet_path)
+        except (TypeError, ValueError) as e:
+            # pyarrow's ArrowInvalid / ArrowTypeError are ValueError / TypeError
+            logger.info(f"No Parquet copy for {abs_file_path}: {str(e)}")
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return parquet_path
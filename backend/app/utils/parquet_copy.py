@@ -0,0 +1,135 @@
+# Reading the Parquet copy of CSV uploads.
+# Every CSV upload gets <upload>.parquet written next to it at ingest (see
+# materialize.build_parquet_copy), holding the dtypes the CSV parsed to. Readers use
+# it when it is up to date instead of parsing the text again:
+#   - only the requested columns are decoded
+#   - row groups whose min/max statistics rule out a row filter are skipped; the rows
+#     that are read keep their row numbers from the file, so code that only looks at
+#     rows matching the filter gives the same result as on the whole file
+# The CSV itself is left alone (downloads, and the fallback when there is no copy).
+
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from app.utils.csv_engine import arrow_table_to_frame
+from app.utils.upload_ingest import resolve_upload_path
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+PARQUET_SUFFIX = ".parquet"
+# schema metadata key holding the (mtime_ns, size) the copy was made from
+PARQUET_SOURCE_KEY = b"terranova_source"
+PARQUET_ROW_GROUP_ROWS = int(os.getenv('PARQUET_ROW_GROUP_ROWS', 100000))
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+
+# filter op -> does a row group with values in [lo, hi] possibly have a match
+_RANGE_CHECKS = {
+    "==": lambda lo, hi, v: lo <= v <= hi,
+    "<": lambda lo, hi, v: lo < v,
+    "<=": lambda lo, hi, v: lo <= v,
+    ">": lambda lo, hi, v: hi > v,
+    ">=": lambda lo, hi, v: hi >= v,
+    "in": lambda lo, hi, values: any(lo <= v <= hi for v in values),
+}
+
+
+def parquet_path_for(file_path):
+    return resolve_upload_path(file_path) + PARQUET_SUFFIX
+
+
+def source_stamp(file_path):
+    stat = os.stat(resolve_upload_path(file_path))
+    return json.dumps([stat.st_mtime_ns, stat.st_size]).encode()
+
+
+def get_parquet_copy(file_path):
+    """Path to the Parquet copy of a CSV if there is one made from its current contents"""
+    parquet_path = parquet_path_for(file_path)
+    if not os.path.exists(parquet_path):
+        return None
+    try:
+        import pyarrow.parquet as pq
+        metadata = pq.read_schema(parquet_path).metadata or {}
+        if metadata.get(PARQUET_SOURCE_KEY) == source_stamp(file_path):
+            return parquet_path
+    except ImportError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.info(f"Ignoring unreadable Parquet copy {parquet_path}: {str(e)}")
+    return None
+
+
+def _may_match(statistics, op, value):
+    if statistics is None or not statistics.has_min_max:
+        return True
+    try:
+        return bool(_RANGE_CHECKS[op](statistics.min, statistics.max, value))
+    except TypeError:
+        # '5' against a numeric column etc., can't tell
+        return True
+
+
+def matching_row_groups(parquet_file, filters):
+    """Indexes of the row groups that can hold rows passing every (column, op, value) filter"""
+    metadata = parquet_file.metadata
+    names = parquet_file.schema_arrow.names
+    groups = []
+    for i in range(metadata.num_row_groups):
+        group = metadata.row_group(i)
+        if all(col not in names or _may_match(group.column(names.index(col)).statistics, op, value)
+               for col, op, value in filters or ()):
+            groups.append(i)
+    return groups
+
+
+def _row_offsets(metadata):
+    offsets = [0]
+    for i in range(metadata.num_row_groups):
+        offsets.append(offsets[-1] + metadata.row_group(i).num_rows)
+    return offsets
+
+
+def _categories(frame, dtype):
+    categories = [col for col, kind in (dtype or {}).items() if kind == "category" and col in frame.columns]
+    return frame.astype({col: "category" for col in categories}) if categories else frame
+
+
+def read_parquet_copy(parquet_path, columns=None, dtype=None, filters=None):
+    """DataFrame from the Parquet copy. With `filters` row groups that can't match are
+    left out and the index holds each row's number in the file."""
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(parquet_path, memory_map=True)
+    if not filters:
+        return _categories(arrow_table_to_frame(parquet_file.read(columns=columns)), dtype)
+    groups = matching_row_groups(parquet_file, filters)
+    offsets = _row_offsets(parquet_file.metadata)
+    logger.info(f"Reading {len(groups)} of {parquet_file.metadata.num_row_groups} row groups")
+    if not groups:
+        frame = arrow_table_to_frame(parquet_file.schema_arrow.empty_table().select(
+            columns if columns is not None else parquet_file.schema_arrow.names))
+        return _categories(frame, dtype)
+    frame = arrow_table_to_frame(parquet_file.read_row_groups(groups, columns=columns))
+    frame.index = pd.Index(np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in groups]))
+    return _categories(frame, dtype)
+
+
+def iter_parquet_chunks(parquet_path, chunk_rows, columns=None, filters=None):
+    """Chunks of at most chunk_rows rows, indexed by row number like read_csv chunks are"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(parquet_path, memory_map=True)
+    offsets = _row_offsets(parquet_file.metadata)
+    for i in matching_row_groups(parquet_file, filters):
+        start = offsets[i]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, row_groups=[i], columns=columns):
+            chunk = arrow_table_to_frame(pa.Table.from_batches([batch]))
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
@@ -0,0 +1,191 @@
+# Token budget for the code generation prompts.
+# The prompts inlined the whole enhanced schema: stats, values and sample values of every
+# column. On a wide table that is thousands of tokens, and Ollama's prefill time grows
+# with the prompt. The schema now gets what is left of PROMPT_TOKEN_BUDGET after the
+# instructions and the part kept for the question:
+#   - the full enhanced schema when it fits (the same text as before)
+#   - otherwise columns are ranked by relevance to the question (name mentioned, values
+#     mentioned, key columns) and only the best ones keep their stats and sample
+#     values; every column is still listed by name so the model uses real names
+#   - on very wide tables the name list is cut too, least relevant names first
+# The schema sits in the prompt prefix that Ollama keeps cached between questions, so
+# it's compacted without the question (key columns, then table order) and comes out the
+# same for every question. The stats of columns the question is about that it leaves out
+# are added after it, next to the question (relevant_column_stats).
+# Token counts are estimates (there is no tokenizer here), on the high side for
+# llama style BPE vocabularies.
+
+import os
+import re
+from collections import Counter
+from app.utils.dataset_profile import render_column_stats
+
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 3000))
+# the schema gets at least this much, however long the rest of the prompt is
+MIN_SCHEMA_TOKENS = int(os.getenv('MIN_SCHEMA_TOKENS', 400))
+# kept free for the part of the prompt that changes per question: examples, the stats of
+# the columns it's about and the question itself
+PROMPT_SUFFIX_TOKENS = int(os.getenv('PROMPT_SUFFIX_TOKENS', 800))
+RELEVANT_COLUMN_TOKENS = int(os.getenv('RELEVANT_COLUMN_TOKENS', 250))
+
+_PIECES = re.compile(r"[A-Za-z]+|[0-9]+|[^\sA-Za-z0-9]")
+_NAME_TOKENS = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+")
+_KEY_NAME = re.compile(r"(^|_)(id|key|code)$", re.IGNORECASE)
+# column name parts that say nothing on their own
+_GENERIC_PARTS = {"id", "at", "of", "to", "is", "no", "num", "nr"}
+
+# relevance weights
+NAME_MENTIONED = 10
+NAME_PART_MENTIONED = 3
+VALUE_MENTIONED = 5
+KEY_COLUMN = 0.5
+
+
+def estimate_tokens(text):
+    """Rough token count: words ~5 letters a token, numbers 3 digits, symbols 1 each"""
+    count = 0
+    for piece in _PIECES.findall(text):
+        if piece.isalpha():
+            count += max(1, round(len(piece) / 5))
+        elif piece.isdigit():
+            count += -(-len(piece) // 3)
+        else:
+            count += 1
+    return count
+
+
+def _name_parts(column_name):
+    return {part.lower() for part in _NAME_TOKENS.findall(column_name)} - _GENERIC_PARTS
+
+
+def _question_words(question):
+    words = set(re.findall(r"[a-z0-9]+", question.lower()))
+    # "payments" asks about payment_value too
+    return words | {word[:-1] for word in words if word.endswith("s") and len(word) > 3}
+
+
+def common_name_parts(columns):
+    """Name parts shared by so many columns they don't single one out (metric_1 ... metric_300)"""
+    counts = Counter(part for column in columns for part in _name_parts(column["name"]))
+    return {part for part, n in counts.items() if n > max(2, len(columns) // 10)}
+
+
+def _mentions(value, lowered, words):
+    value = value.lower()
+    return value in words or re.search(rf"\b{re.escape(value)}\b", lowered) is not None
+
+
+def column_relevance(question, column, common_parts=()):
+    """How much a column looks like it matters for the question"""
+    lowered = question.lower()
+    words = _question_words(question)
+    name = column["name"]
+    score = 0.0
+    if name.lower() in lowered or name.lower().replace("_", " ") in lowered:
+        score += NAME_MENTIONED
+    parts = _name_parts(name) - set(common_parts)
+    if parts:
+        score += NAME_PART_MENTIONED * len(parts & words) / len(parts)
+    values = column.get("values") or [value for value, _ in column.get("top_values", [])]
+    if any(len(value) > 1 and _mentions(value, lowered, words) for value in values):
+        score += VALUE_MENTIONED
+    if _KEY_NAME.search(name):
+        score += KEY_COLUMN
+    return score
+
+
+def rank_columns(question, columns):
+    """Column indexes, most relevant to the question first (ties keep table order)"""
+    common_parts = common_name_parts(columns)
+    scores = [column_relevance(question, column, common_parts) for column in columns]
+    return sorted(range(len(columns)), key=lambda i: (-scores[i], i))
+
+
+def _render(table, listed, detailed):
+    """Schema text listing the `listed` columns and giving stats and samples for `detailed`"""
+    columns = table["columns"]
+    total = len(columns)
+    names = ", ".join(columns[i]["name"] for i in sorted(listed))
+    if len(listed) < total:
+        names += f", ... ({total - len(listed)} more columns not shown)"
+    text = "Database Schema:\n"
+    text += f"Table: {table['name']}\n"
+    text += f"Columns: {names}\n"
+    text += f"Row count: {table['row_count']}\n\n"
+    if not detailed:
+        return text
+    order = sorted(detailed)
+    text += f"\nColumn Statistics ({len(order)} of {total} columns):\n"
+    text += "".join(render_column_stats(columns[i]) for i in order)
+    headers = " | ".join(columns[i]["name"] for i in order)
+    text += f"\nSample Data (first {len(table['sample_rows'])} rows, same columns):\n"
+    text += headers + "\n" + "-" * len(headers) + "\n"
+    for row in table["sample_rows"]:
+        text += " | ".join(row[i][:20] for i in order) + "\n"
+    return text
+
+
+def compact_enhanced_schema(profile, question, token_budget):
+    """The enhanced schema of a profile in at most ~token_budget tokens"""
+    full = profile["enhanced_schema_text"]
+    if estimate_tokens(full) <= token_budget:
+        return full
+    if profile["type"] != "csv":
+        # .db schemas: leave the sample rows out
+        return profile["schema_text"]
+    table = profile["tables"][0]
+    columns = table["columns"]
+    ranked = rank_columns(question, columns)
+
+    # names first, all of them if they fit in half the budget
+    listed = list(ranked)
+    while len(listed) > 1 and estimate_tokens(_render(table, listed, [])) > token_budget // 2:
+        listed = listed[:max(1, len(listed) * 3 // 4)]
+    base = estimate_tokens(_render(table, listed, []))
+
+    # then stats + sample values, best columns first, while they fit
+    detailed = []
+    used = base + estimate_tokens("Column Statistics ( of columns):")
+    used += estimate_tokens("Sample Data (first rows, same columns):") + 2 * (len(table["sample_rows"]) + 1)
+    for i in ranked:
+        cost = estimate_tokens(render_column_stats(columns[i]) + columns[i]["name"])
+        cost += sum(estimate_tokens(row[i][:20]) + 1 for row in table["sample_rows"])
+        if used + cost > token_budget:
+            break
+        detailed.append(i)
+        used += cost
+    text = _render(table, listed, detailed)
+    while detailed and estimate_tokens(text) > token_budget:
+        detailed.pop()
+        text = _render(table, listed, detailed)
+    return text
+
+
+def relevant_column_stats(profile, question, schema_text, token_budget=RELEVANT_COLUMN_TOKENS):
+    """Stats of the columns the question looks to be about that schema_text leaves out, "" if none"""
+    if profile["type"] != "csv":
+        return ""
+    columns = profile["tables"][0]["columns"]
+    common_parts = common_name_parts(columns)
+    scores = [column_relevance(question, column, common_parts) for column in columns]
+    text = "Columns this question may need:\n"
+    used = estimate_tokens(text)
+    lines = []
+    for i in sorted(range(len(columns)), key=lambda i: (-scores[i], i)):
+        # key columns get a little bonus even when the question doesn't mention them
+        if scores[i] <= KEY_COLUMN:
+            break
+        line = render_column_stats(columns[i])
+        if f"\n{line}" in schema_text:
+            continue
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    return text + "".join(lines) if lines else ""
+
+
+def schema_budget(prompt_without_schema, token_budget=PROMPT_TOKEN_BUDGET - PROMPT_SUFFIX_TOKENS):
+    """Tokens left for the schema once the rest of the prompt prefix is in"""
+    return max(token_budget - estimate_tokens(prompt_without_schema), MIN_SCHEMA_TOKENS)
@@ -4,6 +4,9 @@
 # Tod: Add more examples, patterns if time
 
 import random 
+import threading
+from app.utils.example_index import EXAMPLE_INDEX_DIR
+from app.utils.rag_index import RagIndex
 
 # file info for given training csv files
 csv_files = {
@@ -174,62 +177,49 @@ query_examples = [
 ]
 
 
+# The metadata above is searched through a RagIndex (inverted index, compiled patterns,
+# vector indexes), built once by load_indexes() at startup. More datasets, examples and
+# patterns can be registered at runtime with the register_* functions.
+_index = None
+_index_lock = threading.Lock()
+
+def load_indexes(index_dir=EXAMPLE_INDEX_DIR):
+    """(Re)builds the RAG index; vector indexes saved in index_dir are reused"""
+    global _index
+    with _index_lock:
+        _index = RagIndex(csv_files, query_examples, query_patterns, index_dir=index_dir)
+    return _index
+
+def get_rag_index():
+    return _index or load_indexes()
+
+def register_dataset(name, metadata):
+    get_rag_index().register_dataset(name, metadata)
+
+def register_datasets(datasets):
+    get_rag_index().register_datasets(datasets)
+
+def register_examples(examples):
+    get_rag_index().register_examples(examples)
+
+def register_pattern(pattern):
+    get_rag_index().register_pattern(pattern)
 
-    
-# Todo: Replace with vector DB if time    
 def find_examples(query, file_type=None, max_count=3):
-    if file_type:
-        filtered = [ex for ex in query_examples 
-                    if ex["file_type"] == file_type or ex["file_type"] == "any"]
-    else:
-        filtered = query_examples
-    
-    # simple word matching (not great but works for now)
-    query_words = set(query.lower().split())
-    matches = []
-    for ex in filtered:
-        ex_words = set(ex["query"].lower().split())
-        common = query_words.intersection(ex_words)
-        if common:
-            matches.append({
-                "example": ex,
-                "score": len(common) / len(query_words)  
-            })
-    
-    return [item["example"] for item in 
-            sorted(matches, key=lambda x: x["score"], reverse=True)[:max_count]]
+    return get_rag_index().find_examples(query, file_type, max_count)
 
 def guess_relevant_files(query):
-    relevance = {}
-    for file_name, metadata in csv_files.items():
-        relevance[file_name] = 0
-        
-        for col in metadata["columns"]:
-            if col.lower() in query.lower():
-                relevance[file_name] += 2
-        
-        for q in metadata["example_qs"]:
-            q_words = set(q.lower().split())
-            query_words = set(query.lower().split())
-            matches = q_words.intersection(query_words)
-            relevance[file_name] += len(matches) * 0.5
-    
-    relevant = [file for file, score in 
-                     sorted(relevance.items(), key=lambda x: x[1], reverse=True) 
-                     if score > 0]
-    
-    if not relevant:
-        return list(csv_files.keys())
-    
-    return relevant
+    return get_rag_index().guess_relevant_files(query)
+
+def match_patterns(query):
+    """The query_patterns (and registered patterns) the question matches"""
+    index = get_rag_index()
+    return [index.patterns[i] for i in index.match_patterns(query)]
 
 
 # Todo: draw this and include in evaluation/code structure part of paper
 def get_file_connections(file_name):
-    if file_name not in csv_files:
-        return ""
-    
-    links = csv_files[file_name].get("links", [])
+    links = get_rag_index().get_links(file_name)
     if not links:
         return ""
     
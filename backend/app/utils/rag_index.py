@@ -0,0 +1,140 @@
+# Lookup structures over the RAG metadata, built once instead of rescanned per request.
+# guess_relevant_files used to lowercase the question and test every column of every
+# dataset against it, and query_patterns were never compiled or used. Now:
+#   - column names -> datasets, looked up with the words of the question
+#   - file type -> example rows, so a file's examples aren't found by scanning them all
+#   - query patterns compiled once; each knows which examples it matches, and examples
+#     matching the same pattern as the question rank higher
+#   - example questions (and each dataset's example questions) in vector indexes
+# Datasets, examples and patterns can be registered at runtime, the structures are
+# updated in place. A dataset registered again has the questions it no longer lists
+# cleared from the question index.
+
+import re
+import logging
+import threading
+from collections import defaultdict
+import numpy as np
+from app.utils.example_index import ExampleIndex, top_k, EXAMPLE_MIN_SCORE
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# column names keep their underscores
+_WORD = re.compile(r"[a-z0-9_]+")
+# added to the similarity of examples that match the same query pattern as the question
+PATTERN_MATCH_BONUS = 0.1
+COLUMN_MATCH_SCORE = 2
+
+
+class RagIndex:
+    def __init__(self, datasets=None, examples=None, patterns=None, index_dir=None):
+        self.datasets = {}
+        self.examples = []
+        self.patterns = []
+        self._column_datasets = defaultdict(set)
+        self._type_examples = defaultdict(list)
+        # pattern number -> example rows it matches
+        self._pattern_examples = []
+        self._lock = threading.Lock()
+        self.example_index = ExampleIndex("examples", [ex["query"] for ex in examples or ()], index_dir=index_dir)
+        questions = [(name, q) for name, metadata in (datasets or {}).items() for q in metadata.get("example_qs", ())]
+        self.question_index = ExampleIndex("file_questions", [q for _, q in questions], index_dir=index_dir)
+        # row of question_index -> the dataset it's about
+        self._question_datasets = [name for name, _ in questions]
+        for pattern in patterns or ():
+            self._add_pattern(pattern)
+        for name, metadata in (datasets or {}).items():
+            self._add_dataset(name, metadata)
+        self._add_examples(examples or ())
+
+    def _add_pattern(self, pattern):
+        regex = re.compile(pattern["pattern"], re.IGNORECASE)
+        self.patterns.append(dict(pattern, regex=regex))
+        self._pattern_examples.append({i for i, ex in enumerate(self.examples) if regex.search(ex["query"])})
+
+    def _add_dataset(self, name, metadata):
+        self.datasets[name] = metadata
+        for col in metadata.get("columns", ()):
+            self._column_datasets[col.lower()].add(name)
+
+    def _add_examples(self, examples):
+        for ex in examples:
+            row = len(self.examples)
+            self.examples.append(ex)
+            self._type_examples[ex.get("file_type", "any")].append(row)
+            for i, pattern in enumerate(self.patterns):
+                if pattern["regex"].search(ex["query"]):
+                    self._pattern_examples[i].add(row)
+
+    def register_dataset(self, name, metadata):
+        """Adds a dataset (description, columns, links, example_qs) or replaces its metadata"""
+        self.register_datasets({name: metadata})
+
+    def register_datasets(self, datasets):
+        """register_dataset for many datasets, their new questions are embedded in one go"""
+        with self._lock:
+            new_questions = []
+            for name, metadata in datasets.items():
+                old = self.datasets.get(name)
+                if old is not None:
+                    for col in old.get("columns", ()):
+                        self._column_datasets[col.lower()].discard(name)
+                old_questions = (old or {}).get("example_qs", ())
+                questions = metadata.get("example_qs", ())
+                new_questions += [(name, q) for q in questions if q not in old_questions]
+                if old is not None:
+                    self.question_index.clear([row for row, dataset in enumerate(self._question_datasets)
+                                               if dataset == name and self.question_index.texts[row] not in questions])
+                self._add_dataset(name, metadata)
+            self.question_index.add([q for _, q in new_questions])
+            self._question_datasets = self._question_datasets + [name for name, _ in new_questions]
+
+    def register_examples(self, examples):
+        """Adds example question/code pairs, each with a file_type ("any" for all files)"""
+        examples = list(examples)
+        with self._lock:
+            self.example_index.add([ex["query"] for ex in examples])
+            self._add_examples(examples)
+
+    def register_pattern(self, pattern):
+        """Adds a query pattern: a regex ("pattern") plus desc/pandas/sql templates"""
+        with self._lock:
+            self._add_pattern(pattern)
+
+    def match_patterns(self, query):
+        """Numbers of the patterns the question matches"""
+        return [i for i, pattern in enumerate(self.patterns) if pattern["regex"].search(query)]
+
+    def find_examples(self, query, file_type=None, max_count=3):
+        # rows being registered right now may be in one of the two but not yet the other
+        count = min(len(self.example_index), len(self.examples))
+        scores = self.example_index.scores(query)[:count]
+        for i in self.match_patterns(query):
+            scores[[row for row in self._pattern_examples[i] if row < count]] += PATTERN_MATCH_BONUS
+        rows = None
+        if file_type:
+            rows = [row for row in sorted(self._type_examples.get(file_type, []) + self._type_examples.get("any", []))
+                    if row < count]
+        return [self.examples[row] for row, _ in top_k(scores, max_count, rows)]
+
+    def guess_relevant_files(self, query):
+        """Dataset names ranked by column mentions and similar example questions, best first"""
+        relevance = dict.fromkeys(self.datasets, 0)
+        for word in set(_WORD.findall(query.lower())):
+            for name in self._column_datasets.get(word, ()):
+                relevance[name] += COLUMN_MATCH_SCORE
+        # every example question of a dataset that is like this one adds its similarity
+        scores = self.question_index.scores(query)
+        question_datasets = self._question_datasets
+        for row in np.flatnonzero(scores >= EXAMPLE_MIN_SCORE):
+            if row < len(question_datasets):
+                relevance[question_datasets[row]] += float(scores[row])
+        relevant = [name for name, score in sorted(relevance.items(), key=lambda x: x[1], reverse=True) if score > 0]
+        return relevant or list(self.datasets)
+
+    def get_links(self, name):
+        return self.datasets.get(name, {}).get("links", [])
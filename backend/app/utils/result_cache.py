@@ -0,0 +1,116 @@
+# Cache of executed query results.
+# Dashboard refreshes re-run the exact same generated code against the same upload, so
+# result frames are kept (serialised, under a byte budget) keyed by
+# (dataset fingerprint, query type, normalised code).
+# Frames are kept as Arrow IPC buffers, so a /results/<handle> page only decodes its own
+# rows (get_page) instead of unpickling the whole result. Frames Arrow can't hold (mixed
+# type columns...) are pickled.
+
+import os
+import re
+import ast
+import pickle
+import hashlib
+import pandas as pd
+import logging
+from app.utils.dataset_cache import LRUByteCache
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_BYTES = int(os.getenv('RESULT_CACHE_BYTES', 256 * 1024 * 1024))
+
+# quoted strings in SQL, so whitespace inside them is left alone
+_SQL_STRING = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_code(query_type, code):
+    code = code.strip()
+    if query_type == "pandas":
+        # the AST ignores whitespace/formatting differences but keeps string values intact
+        try:
+            return ast.dump(ast.parse(code, mode="eval"))
+        except SyntaxError:
+            return code
+    parts = _SQL_STRING.split(code.rstrip(";").strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+
+
+def _arrow_buffer(frame):
+    """Arrow IPC file of a DataFrame in memory, None without pyarrow or for frames Arrow can't hold"""
+    if not isinstance(frame, pd.DataFrame):
+        return None
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    except (TypeError, ValueError):
+        # pyarrow's ArrowInvalid / ArrowTypeError are ValueError / TypeError
+        return None
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _arrow_table(buffer):
+    # reads straight from the buffer, nothing is copied yet
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.BufferReader(buffer)).read_all()
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        # stored serialised so the budget is the real size and callers can't mutate entries
+        self._cache = LRUByteCache(max_bytes, sizeof=len)
+
+    @staticmethod
+    def make_key(dataset_fingerprint, query_type, code):
+        raw = f"{dataset_fingerprint}|{query_type}|{normalize_code(query_type, code)}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        blob = self._cache.get(key)
+        if blob is None:
+            return None
+        if isinstance(blob, bytes):
+            return pickle.loads(blob)
+        return _arrow_table(blob).to_pandas()
+
+    def get_page(self, key, offset=0, limit=None):
+        """(rows offset..offset+limit of a cached frame, its total row count), None if not cached"""
+        blob = self._cache.get(key)
+        if blob is None:
+            return None
+        if isinstance(blob, bytes):
+            frame = pickle.loads(blob)
+            page = frame.iloc[offset:] if limit is None else frame.iloc[offset:offset + limit]
+            return page, len(frame)
+        table = _arrow_table(blob)
+        # slicing the table is zero copy, only the page gets converted
+        return table.slice(offset, limit).to_pandas(), table.num_rows
+
+    def put(self, key, frame):
+        """Returns False if the frame was too big to keep"""
+        # cheap size estimate first, no point serialising something that can't fit anyway
+        if int(frame.memory_usage(deep=False).sum()) > self._cache.max_bytes:
+            return False
+        blob = _arrow_buffer(frame)
+        if blob is None:
+            blob = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+        self._cache.put(key, blob)
+        return key in self._cache
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+result_cache = ResultCache()
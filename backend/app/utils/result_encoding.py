@@ -0,0 +1,70 @@
+# Response encodings for query results.
+# records  - list of {column: value} dicts (what the frontend uses)
+# columnar - {"columns": [...], "data": [[col 1 values], [col 2 values], ...]}, written
+#            straight from the DataFrame so column names aren't repeated on every row
+# arrow    - Arrow IPC stream, needs pyarrow
+
+import json
+import logging
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+FORMAT_RECORDS = "records"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_ARROW = "arrow"
+FORMATS = (FORMAT_RECORDS, FORMAT_COLUMNAR, FORMAT_ARROW)
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+
+
+def negotiate_format(params, accept_header=""):
+    """?format= / "format" in the body wins, otherwise look at the Accept header"""
+    fmt = (params.get("format") or "").lower()
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}', use one of: {', '.join(FORMATS)}")
+        return fmt
+    if ARROW_MIME in (accept_header or ""):
+        return FORMAT_ARROW
+    return FORMAT_RECORDS
+
+
+def encode_records(frame):
+    # NaN/NaT -> None (plain NaN isn't valid JSON), to_dict already unboxes numpy scalars
+    if not frame.isna().values.any():
+        return frame.to_dict(orient="records")
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def encode_columnar(frame):
+    """JSON text for the columnar shape, serialised column by column by pandas itself"""
+    data = ",".join(
+        frame.iloc[:, i].to_json(orient="values", date_format="iso", default_handler=str)
+        for i in range(frame.shape[1])
+    )
+    return f'{{"columns":{json.dumps([str(col) for col in frame.columns])},"data":[{data}]}}'
+
+
+def encode_arrow(frame, metadata=None):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("Arrow output needs pyarrow, run: pip install pyarrow")
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, terranova=json.dumps(metadata, default=str)))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def json_with_raw_results(envelope, results_json):
+    """envelope as JSON with an already encoded "results" value spliced in"""
+    body = json.dumps(envelope, default=str)
+    if body == "{}":
+        return f'{{"results":{results_json}}}'
+    return f'{body[:-1]},"results":{results_json}}}'
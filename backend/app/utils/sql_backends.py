@@ -0,0 +1,236 @@
+# SQL execution backends for the SQL path.
+# Generated SQL runs against a table called `data`. For CSV uploads that table used
+# to be the SQLite copy (see materialize), a row store that is slow at the
+# GROUP BY / COUNT / SUM queries the prompts ask for. When duckdb is installed CSV
+# uploads are queried by DuckDB instead: vectorized, multi-threaded and reading the
+# Parquet copy (or the CSV itself) directly, nothing is converted first.
+# .db uploads always use SQLite.
+#
+# The SQL is written for SQLite, so DuckDB gets SQLite's integer division, NULL
+# ordering and case-insensitive LIKE. Queries DuckDB can't run (SQLite-only functions
+# like strftime('%Y', col), bare columns in GROUP BY...) are rerun on SQLite, so
+# errors the user sees are still SQLite's.
+# SQL_BACKEND=auto|duckdb|sqlite picks the backend for CSVs, auto is DuckDB when it's there.
+#
+# Rows are pulled from the cursor SQL_FETCH_ROWS at a time. With max_rows the fetch
+# stops once that many rows are in, so a SELECT * over a big table only reads (and
+# holds) the rows the client is going to be sent.
+
+import os
+import re
+import sqlite3
+import logging
+import importlib.util
+import numpy as np
+import pandas as pd
+from app.utils.csv_engine import PANDAS_NA_VALUES
+from app.utils.dataset_profile import get_profile
+from app.utils.materialize import get_materialized_db, TABLE_NAME
+from app.utils.parquet_copy import get_parquet_copy
+from app.utils.sqlite_pool import sqlite_pool
+from app.utils.upload_ingest import read_ingest_info, resolve_upload_path
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+SQL_BACKEND = os.getenv('SQL_BACKEND', 'auto').lower()
+# 0 = DuckDB's default, one thread per core
+DUCKDB_THREADS = int(os.getenv('DUCKDB_THREADS', 0))
+DUCKDB_MEMORY_LIMIT = os.getenv('DUCKDB_MEMORY_LIMIT', '')
+SQL_FETCH_ROWS = int(os.getenv('SQL_FETCH_ROWS', 10000))
+# DuckDB hands results over in vectors of this many rows
+DUCKDB_VECTOR_ROWS = 2048
+
+# profile dtype -> DuckDB column type for reading a CSV directly
+DUCKDB_TYPES = {"int64": "BIGINT", "float64": "DOUBLE", "bool": "BOOLEAN"}
+DUCKDB_ENCODINGS = {"utf-8": "utf-8", "utf-8-sig": "utf-8", "latin-1": "latin-1"}
+SQLITE_COMPAT_SETTINGS = [
+    "SET integer_division = true",
+    # SQLite sorts NULL as the smallest value
+    "SET default_null_order = 'nulls_first_on_asc_last_on_desc'",
+]
+# string literals, quoted identifiers and comments, left alone when rewriting SQL
+_SQL_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/)""", re.DOTALL)
+_LIKE = re.compile(r"\bLIKE\b", re.IGNORECASE)
+
+
+def _quote_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sqlite_to_duckdb(sql_query):
+    """SQLite's LIKE ignores case, DuckDB's doesn't"""
+    parts = _SQL_QUOTED.split(sql_query)
+    # odd parts are the quoted bits
+    return "".join(part if i % 2 else _LIKE.sub("ILIKE", part) for i, part in enumerate(parts))
+
+
+def fetch_batches(cursor, max_rows=None, batch_rows=None):
+    """fetchmany() batches from an executed DB-API cursor, stopping after max_rows rows"""
+    batch_rows = batch_rows or SQL_FETCH_ROWS
+    fetched = 0
+    while max_rows is None or fetched < max_rows:
+        size = batch_rows if max_rows is None else min(batch_rows, max_rows - fetched)
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        fetched += len(rows)
+        yield rows
+
+
+class SqliteBackend:
+    name = "sqlite"
+    errors = (sqlite3.Error,)
+
+    def available(self):
+        return True
+
+    def run(self, abs_file_path, sql_query, max_rows=None):
+        # .db uploads as they are, CSVs through their on-disk SQLite copy (table 'data')
+        db_path = abs_file_path if abs_file_path.lower().endswith(".db") else get_materialized_db(abs_file_path)
+        with sqlite_pool.connection(db_path) as conn:
+            logger.info(f"Executing SQL Query: {sql_query}")
+            cursor = conn.execute(sql_query)
+            try:
+                rows = [row for batch in fetch_batches(cursor, max_rows) for row in batch]
+                columns = [column[0] for column in cursor.description or ()]
+            finally:
+                cursor.close()
+        # what pd.read_sql_query builds from the rows
+        results = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        logger.info(f"Query results shape: {results.shape}")
+        return results
+
+
+class DuckDBBackend:
+    name = "duckdb"
+
+    def available(self):
+        return importlib.util.find_spec("duckdb") is not None
+
+    @property
+    def errors(self):
+        import duckdb
+        return (duckdb.Error,)
+
+    def _source(self, abs_file_path):
+        """(path, table function call) DuckDB reads the upload with, None if it can't"""
+        parquet_path = get_parquet_copy(abs_file_path)
+        if parquet_path:
+            return parquet_path, f"read_parquet({_quote_literal(parquet_path)})"
+        info = read_ingest_info(abs_file_path)
+        encoding = DUCKDB_ENCODINGS.get(info.get("encoding", "utf-8"))
+        profile = get_profile(abs_file_path)
+        if encoding is None or not profile or profile.get("type") != "csv":
+            return None
+        # column types from the profile, so values come out as they do from pandas (dates stay text)
+        columns = ", ".join(
+            f"{_quote_literal(col['name'])}: '{DUCKDB_TYPES.get(col['dtype'], 'VARCHAR')}'"
+            for col in profile["tables"][0]["columns"]
+        )
+        null_strings = ", ".join(_quote_literal(value) for value in PANDAS_NA_VALUES)
+        csv_path = resolve_upload_path(abs_file_path)
+        return csv_path, (
+            f"read_csv({_quote_literal(csv_path)}, header = true, auto_detect = false, "
+            f"delim = {_quote_literal(info.get('delimiter', ','))}, encoding = '{encoding}', "
+            f"columns = {{{columns}}}, nullstr = [{null_strings}])"
+        )
+
+    def _connect(self, source_path, source_sql):
+        import duckdb
+        config = {}
+        if DUCKDB_THREADS:
+            config["threads"] = DUCKDB_THREADS
+        if DUCKDB_MEMORY_LIMIT:
+            config["memory_limit"] = DUCKDB_MEMORY_LIMIT
+        conn = duckdb.connect(config=config)
+        try:
+            conn.execute(f"CREATE VIEW {TABLE_NAME} AS SELECT * FROM {source_sql}")
+            for setting in SQLITE_COMPAT_SETTINGS:
+                conn.execute(setting)
+            # generated SQL can read the upload and nothing else: no other files, no
+            # COPY/ATTACH/extension installs, and that can't be switched back
+            conn.execute(f"SET allowed_paths = [{_quote_literal(source_path)}]")
+            conn.execute("SET enable_external_access = false")
+            conn.execute("SET lock_configuration = true")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _fetch(self, cursor, max_rows):
+        if max_rows is None:
+            return cursor.fetchdf()
+        vectors = max(SQL_FETCH_ROWS // DUCKDB_VECTOR_ROWS, 1)
+        # the first chunk even when empty, it has the columns
+        chunks = [cursor.fetch_df_chunk(vectors)]
+        fetched = len(chunks[0])
+        while fetched < max_rows:
+            chunk = cursor.fetch_df_chunk(vectors)
+            if chunk.empty:
+                break
+            chunks.append(chunk)
+            fetched += len(chunk)
+        results = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+        return results.iloc[:max_rows]
+
+    def run(self, abs_file_path, sql_query, max_rows=None):
+        source = self._source(abs_file_path)
+        if source is None:
+            return None
+        conn = self._connect(*source)
+        try:
+            logger.info(f"Executing SQL Query with DuckDB: {sql_query}")
+            cursor = conn.execute(sqlite_to_duckdb(sql_query))
+            results = self._fetch(cursor, max_rows)
+            types = [str(column[1]) for column in cursor.description]
+        finally:
+            conn.close()
+        # SUM over integers is HUGEINT, which pandas gets as float; SQLite gives ints
+        for i, kind in enumerate(types):
+            values = results.iloc[:, i]
+            if kind == "HUGEINT" and values.notna().all() and \
+                    np.all(np.abs(values) < 2 ** 63) and np.all(values == np.round(values)):
+                results.isetitem(i, values.astype("int64"))
+        logger.info(f"Query results shape: {results.shape}")
+        return results
+
+
+SQL_BACKENDS = {}
+
+
+def register_sql_backend(backend):
+    SQL_BACKENDS[backend.name] = backend
+
+
+register_sql_backend(SqliteBackend())
+register_sql_backend(DuckDBBackend())
+
+
+def get_sql_backend(file_extension):
+    """The backend SQL over an upload of this kind runs on"""
+    if file_extension == ".db" or SQL_BACKEND == "sqlite":
+        return SQL_BACKENDS["sqlite"]
+    name = "duckdb" if SQL_BACKEND == "auto" else SQL_BACKEND
+    backend = SQL_BACKENDS.get(name)
+    if backend is None or not backend.available():
+        if SQL_BACKEND != "auto":
+            logger.warning(f"SQL backend {SQL_BACKEND!r} isn't available, using SQLite")
+        return SQL_BACKENDS["sqlite"]
+    return backend
+
+
+def run_sql(abs_file_path, file_extension, sql_query, max_rows=None):
+    """Generated SQL against the upload's `data` table, as a DataFrame of at most max_rows rows"""
+    backend = get_sql_backend(file_extension)
+    if backend.name != "sqlite":
+        try:
+            results = backend.run(abs_file_path, sql_query, max_rows)
+            if results is not None:
+                return results
+        except backend.errors as e:
+            logger.info(f"{backend.name} couldn't run the query ({str(e).splitlines()[0]}), using SQLite")
+    return SQL_BACKENDS["sqlite"].run(abs_file_path, sql_query, max_rows)
@@ -0,0 +1,121 @@
+# Pooled read-only SQLite connections.
+# Every schema lookup and SQL query used to open (and sometimes reopen) its own
+# connection, with the default page cache and no mmap. Connections are now kept per
+# database file and handed out again:
+#   - opened read-only (mode=ro) with query_only on, generated SQL can't change a file
+#   - mmap_size so reads come straight from the page cache, shared by all connections
+#   - a bigger page cache and statement cache per connection
+# Pools are keyed on (path, mtime, size), a replaced file never gets an old connection.
+
+import os
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# idle connections kept per file, and files kept open
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 4))
+SQLITE_POOL_FILES = int(os.getenv('SQLITE_POOL_FILES', 32))
+SQLITE_MMAP_BYTES = int(os.getenv('SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', 64 * 1024))
+SQLITE_STATEMENT_CACHE = int(os.getenv('SQLITE_STATEMENT_CACHE', 256))
+
+
+def readonly_uri(db_path):
+    # escapes '?', '#' etc. in the path so sqlite doesn't read them as URI parts
+    return f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+
+
+def open_readonly(db_path):
+    conn = sqlite3.connect(
+        readonly_uri(db_path), uri=True, check_same_thread=False, cached_statements=SQLITE_STATEMENT_CACHE
+    )
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_BYTES}")
+    # negative = KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KB}")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def _reusable(conn):
+    """False when the last user left state behind (ATTACH, query_only switched off...)"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        if len(conn.execute("PRAGMA database_list").fetchall()) > 1:
+            return False
+        return conn.execute("PRAGMA query_only").fetchone()[0] == 1
+    except sqlite3.Error:
+        return False
+
+
+class SQLitePool:
+    def __init__(self, size=SQLITE_POOL_SIZE, max_files=SQLITE_POOL_FILES):
+        self.size = size
+        self.max_files = max_files
+        # (path, mtime_ns, size) -> idle connections
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, db_path):
+        abs_path = os.path.realpath(db_path)
+        stat = os.stat(abs_path)
+        return abs_path, stat.st_mtime_ns, stat.st_size
+
+    def _take(self, key):
+        with self._lock:
+            stale = [k for k in self._idle if k[0] == key[0] and k != key]
+            closing = [conn for k in stale for conn in self._idle.pop(k)]
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+            if key in self._idle:
+                self._idle.move_to_end(key)
+        for old in closing:
+            old.close()
+        return conn
+
+    def _give_back(self, key, conn):
+        closing = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.size:
+                idle.append(conn)
+                conn = None
+            while len(self._idle) > self.max_files:
+                closing.extend(self._idle.popitem(last=False)[1])
+        if conn is not None:
+            closing.append(conn)
+        for old in closing:
+            old.close()
+
+    @contextmanager
+    def connection(self, db_path):
+        """A read-only connection to db_path for the duration of the block"""
+        key = self._key(db_path)
+        conn = self._take(key) or open_readonly(key[0])
+        try:
+            yield conn
+        finally:
+            if _reusable(conn):
+                self._give_back(key, conn)
+            else:
+                conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+sqlite_pool = SQLitePool()
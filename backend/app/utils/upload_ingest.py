@@ -0,0 +1,168 @@
+# Streaming ingestion for uploads.
+# Uploads are written to disk in chunks instead of being buffered whole, hashed while
+# they stream, and checked from the first block: .db files must have the SQLite header,
+# CSVs get their encoding and delimiter sniffed. What was detected is kept next to the
+# upload as <upload>.ingest.json so every reader parses the file the same way.
+# Uploads are stored once per content hash, the names handed out are symlinks to that
+# copy, so sidecars (ingest info, profile, SQLite copy) are keyed on the resolved path.
+
+import os
+import csv
+import json
+import hashlib
+import logging
+
+from app.utils.csv_engine import read_csv
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# how much of the file is used to validate/sniff it
+SNIFF_BYTES = 64 * 1024
+SQLITE_HEADER = b"SQLite format 3\x00"
+INGEST_SUFFIX = ".ingest.json"
+ALLOWED_EXTENSIONS = {"csv", "db"}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_csv(block):
+    """Encoding + delimiter from the first block of a CSV, raises UploadError if it isn't one"""
+    if b"\x00" in block:
+        raise UploadError("File doesn't look like a CSV (binary content)")
+    # cut at the last full line so a multi-byte character isn't split in half
+    if len(block) >= SNIFF_BYTES and b"\n" in block:
+        block = block[:block.rindex(b"\n")]
+    encoding = "utf-8"
+    if block.startswith(b"\xef\xbb\xbf"):
+        encoding = "utf-8-sig"
+    try:
+        text = block.decode(encoding)
+    except UnicodeDecodeError:
+        # latin-1 decodes anything, most non utf-8 exports (Excel etc.) are cp1252/latin-1
+        encoding = "latin-1"
+        text = block.decode(encoding)
+    if not text.strip():
+        raise UploadError("CSV file is empty")
+    try:
+        delimiter = csv.Sniffer().sniff(text, delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    return {"encoding": encoding, "delimiter": delimiter}
+
+
+def validate_first_block(file_extension, block):
+    if file_extension == "db":
+        if not block.startswith(SQLITE_HEADER):
+            raise UploadError("File is not a valid SQLite database")
+        return {}
+    return sniff_csv(block)
+
+
+class StreamingUpload:
+    """Writes an upload to `tmp_path` chunk by chunk, hashing and validating as it goes.
+
+    For resumed uploads pass append=True with the hasher and detected info from the
+    earlier chunks.
+    """
+
+    def __init__(self, tmp_path, file_extension, append=False, sha256=None, detected=None):
+        self.tmp_path = tmp_path
+        self.file_extension = file_extension
+        self.sha256 = sha256 or hashlib.sha256()
+        self.size = os.path.getsize(tmp_path) if append and os.path.exists(tmp_path) else 0
+        self.detected = detected
+        self._head = b""
+        self._file = open(tmp_path, "ab" if append else "wb")
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        if self.detected is None and len(self._head) < SNIFF_BYTES:
+            self._head += chunk[:SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= SNIFF_BYTES:
+                # fail before writing anything else if the file is the wrong kind
+                self.detect()
+        self._file.write(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+
+    def write_stream(self, stream, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            self.write(chunk)
+
+    def detect(self):
+        if self.detected is None:
+            self.detected = validate_first_block(self.file_extension, self._head)
+        return self.detected
+
+    def close(self):
+        self._file.close()
+
+    def finish(self):
+        """Closes the file and returns what was learnt about it"""
+        self.close()
+        if self.size == 0:
+            raise UploadError("Uploaded file is empty")
+        return dict(self.detect(), sha256=self.sha256.hexdigest(), size=self.size)
+
+    def abort(self):
+        self.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def hash_file(file_path, chunk_size=CHUNK_SIZE):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def resolve_upload_path(file_path):
+    """The stored file behind an upload name, so every alias shares its sidecars and caches"""
+    return os.path.realpath(file_path)
+
+
+def ingest_info_path_for(file_path):
+    return resolve_upload_path(file_path) + INGEST_SUFFIX
+
+
+def write_ingest_info(file_path, info):
+    with open(ingest_info_path_for(file_path), "w") as f:
+        json.dump(info, f)
+
+
+def read_ingest_info(file_path):
+    try:
+        with open(ingest_info_path_for(file_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def csv_read_options(file_path):
+    """pd.read_csv kwargs matching what was sniffed at upload (defaults if nothing was)"""
+    info = read_ingest_info(file_path)
+    options = {}
+    if info.get("delimiter", ",") != ",":
+        options["sep"] = info["delimiter"]
+    if info.get("encoding", "utf-8") != "utf-8":
+        options["encoding"] = info["encoding"]
+    return options
+
+
+def read_uploaded_csv(file_path, **kwargs):
+    return read_csv(file_path, **dict(csv_read_options(file_path), **kwargs))
@@ -0,0 +1,177 @@
+# Parse time and peak memory of the CSV engines on Olist style files.
+#
+#   python benchmarks/csv_engines.py                  # generated sample files
+#   python benchmarks/csv_engines.py --rows 2000000   # bigger ones
+#   python benchmarks/csv_engines.py --dir ~/olist    # the real dataset
+#
+# Every read runs in a fresh process so peak RSS (VmHWM) belongs to that read alone;
+# the number reported is the peak minus the process' RSS before parsing.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# name -> how it's read
+ENGINES = {
+    "c": {"engine": "c"},
+    "c+mmap": {"engine": "c", "memory_map": True},
+    "pandas-pyarrow": {"engine": "pyarrow"},
+    "csv_engine auto": None,
+}
+# Olist file names, for --dir
+OLIST_FILES = {
+    "Customers": "olist_customers_dataset.csv",
+    "Orders": "olist_orders_dataset.csv",
+    "OrderItems": "olist_order_items_dataset.csv",
+    "Payments": "olist_order_payments_dataset.csv",
+    "Products": "olist_products_dataset.csv",
+}
+
+
+def _ids(rng, n, pool=None):
+    pool = pool or n
+    return np.char.add("id", rng.integers(0, pool, n).astype(str))
+
+
+def _timestamps(rng, n):
+    start = np.datetime64("2016-09-01T00:00:00")
+    return (start + rng.integers(0, 2 * 365 * 24 * 3600, n).astype("timedelta64[s]")).astype(str)
+
+
+def generate_samples(directory, rows):
+    """Writes Olist shaped CSVs (rows for the largest, the others scaled like the real set)"""
+    rng = np.random.default_rng(0)
+    states = np.array(["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "DF"])
+    cities = np.array(["sao paulo", "rio de janeiro", "belo horizonte", "curitiba", "campinas", "brasilia"])
+    categories = np.array(["beleza_saude", "informatica_acessorios", "cama_mesa_banho", "esporte_lazer", ""])
+    n_orders = rows
+    frames = {
+        "Customers": pd.DataFrame({
+            "customer_id": _ids(rng, n_orders),
+            "customer_unique_id": _ids(rng, n_orders, n_orders // 2 or 1),
+            "customer_zip_code_prefix": rng.integers(1000, 99999, n_orders),
+            "customer_city": rng.choice(cities, n_orders),
+            "customer_state": rng.choice(states, n_orders),
+        }),
+        "Orders": pd.DataFrame({
+            "order_id": _ids(rng, n_orders),
+            "customer_id": _ids(rng, n_orders),
+            "order_status": rng.choice(["delivered", "shipped", "canceled"], n_orders, p=[0.9, 0.08, 0.02]),
+            "order_purchase_timestamp": _timestamps(rng, n_orders),
+            "order_approved_at": _timestamps(rng, n_orders),
+            "order_delivered_customer_date": _timestamps(rng, n_orders),
+            "order_estimated_delivery_date": _timestamps(rng, n_orders),
+        }),
+        "OrderItems": pd.DataFrame({
+            "order_id": _ids(rng, n_orders, n_orders),
+            "order_item_id": rng.integers(1, 4, n_orders),
+            "product_id": _ids(rng, n_orders, n_orders // 3 or 1),
+            "seller_id": _ids(rng, n_orders, 3000),
+            "shipping_limit_date": _timestamps(rng, n_orders),
+            "price": np.round(rng.gamma(2, 60, n_orders), 2),
+            "freight_value": np.round(rng.gamma(2, 10, n_orders), 2),
+        }),
+        "Payments": pd.DataFrame({
+            "order_id": _ids(rng, n_orders),
+            "payment_sequential": rng.integers(1, 3, n_orders),
+            "payment_type": rng.choice(["credit_card", "boleto", "voucher", "debit_card"], n_orders),
+            "payment_installments": rng.integers(1, 10, n_orders),
+            "payment_value": np.round(rng.gamma(2, 80, n_orders), 2),
+        }),
+        "Products": pd.DataFrame({
+            "product_id": _ids(rng, n_orders // 3 or 1),
+            "product_category_name": rng.choice(categories, n_orders // 3 or 1),
+            "product_weight_g": rng.integers(50, 30000, n_orders // 3 or 1).astype(float),
+            "product_length_cm": rng.integers(10, 100, n_orders // 3 or 1).astype(float),
+            "product_photos_qty": rng.integers(1, 6, n_orders // 3 or 1),
+        }),
+    }
+    paths = {}
+    for name, frame in frames.items():
+        paths[name] = os.path.join(directory, f"{name}.csv")
+        frame.to_csv(paths[name], index=False)
+    return paths
+
+
+def _peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so a spawned child would report the parent's
+    # peak; VmHWM belongs to the child's own address space
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+
+def _timed_read(path, engine, conn):
+    from app.utils.csv_engine import read_csv
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    if ENGINES[engine] is None:
+        frame = read_csv(path)
+    else:
+        frame = pd.read_csv(path, **ENGINES[engine])
+    elapsed = time.perf_counter() - start
+    conn.send((elapsed, (_peak_rss_kb() - baseline) / 1024, len(frame)))
+    conn.close()
+
+
+def measure(path, engine, context):
+    parent, child = context.Pipe()
+    process = context.Process(target=_timed_read, args=(path, engine, child))
+    process.start()
+    child.close()
+    try:
+        return parent.recv()
+    except EOFError:
+        return None
+    finally:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSV engine parse time and peak memory")
+    parser.add_argument("--rows", type=int, default=500000, help="rows in the generated files")
+    parser.add_argument("--dir", help="folder with the real Olist CSVs instead of generated ones")
+    parser.add_argument("--repeat", type=int, default=3, help="reads per engine, the best time is kept")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.dir:
+            paths = {name: os.path.join(args.dir, file) for name, file in OLIST_FILES.items()
+                     if os.path.exists(os.path.join(args.dir, file))}
+        else:
+            paths = generate_samples(tmp_dir, args.rows)
+        print(f"{'file':<12}{'MB':>8}  {'engine':<18}{'seconds':>9}{'peak MB':>10}")
+        for name, path in paths.items():
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            for engine in ENGINES:
+                runs = [measure(path, engine, context) for _ in range(args.repeat)]
+                runs = [run for run in runs if run]
+                if not runs:
+                    print(f"{name:<12}{size_mb:>8.1f}  {engine:<18}{'failed':>9}")
+                    continue
+                best = min(run[0] for run in runs)
+                peak = max(run[1] for run in runs)
+                print(f"{name:<12}{size_mb:>8.1f}  {engine:<18}{best:>9.3f}{peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Time to first token of consecutive questions on the same dataset, with the prompt
+# split into a cached system prefix + the question, against the old single message.
+#
+#   python benchmarks/prompt_prefix.py                      # mock Ollama, generated files
+#   python benchmarks/prompt_prefix.py --idle 600           # 10 idle minutes between questions
+#   python benchmarks/prompt_prefix.py --url http://localhost:11434/api/chat --model llama3
+#
+# The mock behaves like Ollama with one slot: it keeps the KV cache of the last prompt
+# and only prefills the tokens after the prefix it shares with it (--prefill-ms each),
+# and it unloads the model keep_alive seconds after the last request (--load-ms to load
+# it again). --idle moves its clock forward between questions instead of sleeping.
+#
+# The old layout is rebuilt from the same text: one user message with the schema, the
+# question's examples, the instructions and then the question, as the prompts were
+# before. Its schema is the question independent one, so it's the kinder baseline.
+# Runs with --url use a real Ollama; the old layout goes first, each layout's first
+# question pays for a cold prefix.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csv_engines import generate_samples  # noqa: E402
+from app.services.llm_client import LLMClient  # noqa: E402
+from app.services.ollama_service import (  # noqa: E402
+    build_pandas_payload, build_sql_payload, PANDAS_INSTRUCTIONS, SQL_INSTRUCTIONS
+)
+from app.utils.dataset_profile import build_profile  # noqa: E402
+
+QUESTIONS = {
+    "Payments": [
+        "What is the total payment value by payment type?",
+        "How many payments used more than 5 installments?",
+        "Which payment type has the highest average payment value?",
+        "Show the first 10 payments paid by voucher",
+        "What is the average number of installments for credit card payments?",
+    ],
+    "Orders": [
+        "How many orders were canceled?",
+        "How many orders were placed each month?",
+        "Which orders were delivered after the estimated delivery date?",
+        "Show the 5 most recent orders",
+        "What share of orders is still shipped but not delivered?",
+    ],
+}
+# Ollama's default keep_alive
+DEFAULT_KEEP_ALIVE = 300
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def _seconds(keep_alive):
+    if isinstance(keep_alive, (int, float)):
+        return float("inf") if keep_alive < 0 else keep_alive
+    units = {"s": 1, "m": 60, "h": 3600}
+    return float(keep_alive[:-1]) * units[keep_alive[-1]]
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        # llama 3 chat template, close enough for prefix matching
+        prompt = "".join(f"<|start_header_id|>{m['role']}<|end_header_id|>\n\n{m['content']}<|eot_id|>"
+                         for m in payload["messages"])
+        tokens = _TOKEN.findall(prompt)
+        with server.lock:
+            now = time.monotonic() + server.clock_offset
+            delay = 0.0
+            num_ctx = payload.get("options", {}).get("num_ctx")
+            if now > server.loaded_until or server.num_ctx not in (None, num_ctx):
+                delay += server.load_ms / 1000
+                server.cache = []
+                server.num_ctx = num_ctx
+            shared = 0
+            for a, b in zip(server.cache, tokens):
+                if a != b:
+                    break
+                shared += 1
+            evaluated = len(tokens) - shared
+            delay += evaluated * server.prefill_ms / 1000
+            server.cache = tokens
+            server.loaded_until = now + delay + _seconds(payload.get("keep_alive", DEFAULT_KEEP_ALIVE))
+        time.sleep(delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in ({"message": {"content": "SELECT"}, "done": False},
+                      {"message": {"content": ""}, "done": True, "prompt_eval_count": evaluated}):
+            line = json.dumps(chunk).encode() + b"\n"
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def reset_mock(server):
+    """Model loaded (main.py preloads it), nothing cached"""
+    with server.lock:
+        server.cache = []
+        server.num_ctx = None
+        server.loaded_until = float("inf")
+
+
+def start_mock(prefill_ms, load_ms):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOllamaHandler)
+    server.lock = threading.Lock()
+    server.clock_offset = 0.0
+    server.prefill_ms = prefill_ms
+    server.load_ms = load_ms
+    reset_mock(server)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/chat"
+
+
+def old_layout(payload, instructions):
+    """The same text as one user message, in the order the prompts used to have"""
+    system, user = (message["content"] for message in payload["messages"])
+    schema = system[len(instructions):]
+    question_parts, question = user.rstrip().rsplit("\n", 1)
+    content = f"{schema.strip()}\n{question_parts}\n\n{instructions}\n\n{question}\n"
+    # no keep_alive, as before: Ollama's default applies
+    return dict(payload, messages=[{"role": "user", "content": content}], keep_alive=f"{DEFAULT_KEEP_ALIVE}s")
+
+
+def first_token(client, payload):
+    """(seconds to the first token, prompt tokens Ollama evaluated)"""
+    start = time.perf_counter()
+    ttft = None
+    evaluated = None
+    for chunk in client.chat_stream(payload):
+        if ttft is None and chunk.get("message", {}).get("content"):
+            ttft = time.perf_counter() - start
+        if chunk.get("done"):
+            evaluated = chunk.get("prompt_eval_count")
+            break
+    return ttft if ttft is not None else time.perf_counter() - start, evaluated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first token with and without the cached prompt prefix")
+    parser.add_argument("--url", help="a real Ollama chat endpoint instead of the mock")
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--rows", type=int, default=20000, help="rows in the generated files")
+    parser.add_argument("--prefill-ms", type=float, default=2.0, help="mock: ms to prefill a token")
+    parser.add_argument("--load-ms", type=float, default=3000, help="mock: ms to load the model")
+    parser.add_argument("--idle", type=float, default=0, help="mock: idle seconds between questions")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_mock(args.prefill_ms, args.load_ms)
+    client = LLMClient(api_url=url)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = generate_samples(tmp_dir, args.rows)
+        print(f"{'dataset':<14}{'layout':<8}{'prompt':>8}{'1st ttft':>10}{'next ttft':>11}{'next eval':>11}")
+        for name, questions in QUESTIONS.items():
+            build_profile(paths[name])
+            for build, instructions in ((build_sql_payload, SQL_INSTRUCTIONS),
+                                        (build_pandas_payload, PANDAS_INSTRUCTIONS)):
+                payloads = [dict(build(question, None, paths[name]), model=args.model) for question in questions]
+                for layout, runs in (("old", [old_layout(p, instructions) for p in payloads]), ("split", payloads)):
+                    if server:
+                        reset_mock(server)
+                    timings = []
+                    for i, payload in enumerate(runs):
+                        if server and i:
+                            server.clock_offset += args.idle
+                        timings.append(first_token(client, payload))
+                    prompt_tokens = len(_TOKEN.findall("".join(m["content"] for m in runs[0]["messages"])))
+                    rest = timings[1:]
+                    next_ttft = sum(t for t, _ in rest) / len(rest)
+                    evaluated = [e for _, e in rest if e is not None]
+                    next_eval = f"{sum(evaluated) / len(evaluated):.0f}" if evaluated else "-"
+                    label = f"{name} {'sql' if build is build_sql_payload else 'pd'}"
+                    print(f"{label:<14}{layout:<8}{prompt_tokens:>8}{timings[0][0]:>10.3f}{next_ttft:>11.3f}{next_eval:>11}")
+    client.close()
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
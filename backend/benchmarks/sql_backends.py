@@ -0,0 +1,101 @@
+# Aggregate query times of the SQL backends on Olist style files.
+#
+#   python benchmarks/sql_backends.py                 # generated sample files
+#   python benchmarks/sql_backends.py --rows 5000000
+#   python benchmarks/sql_backends.py --dir ~/olist   # the real dataset
+#
+# Compares the SQLite copy against DuckDB reading the CSV and the Parquet copy. The
+# copies are built before timing, every query runs --repeat times, the best is kept.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csv_engines import generate_samples, OLIST_FILES  # noqa: E402
+from app.utils.dataset_profile import build_profile  # noqa: E402
+from app.utils.materialize import build_parquet_copy, get_materialized_db  # noqa: E402
+from app.utils.parquet_copy import parquet_path_for  # noqa: E402
+from app.utils.sql_backends import SQL_BACKENDS  # noqa: E402
+
+QUERIES = {
+    "Orders": [
+        "SELECT order_status, COUNT(*) AS n FROM data GROUP BY order_status ORDER BY n DESC",
+        "SELECT substr(order_purchase_timestamp, 1, 7) AS month, COUNT(*) AS n FROM data GROUP BY month ORDER BY month",
+    ],
+    "OrderItems": [
+        "SELECT seller_id, SUM(price) AS revenue, AVG(freight_value) AS freight FROM data "
+        "GROUP BY seller_id ORDER BY revenue DESC LIMIT 10",
+        "SELECT COUNT(DISTINCT product_id) AS products, SUM(price + freight_value) AS total FROM data",
+    ],
+    "Payments": [
+        "SELECT payment_type, COUNT(*) AS n, SUM(payment_value) AS total, AVG(payment_installments) AS inst "
+        "FROM data GROUP BY payment_type ORDER BY total DESC",
+        "SELECT payment_installments, COUNT(*) AS n FROM data WHERE payment_value > 100 "
+        "GROUP BY payment_installments ORDER BY payment_installments",
+    ],
+    "Customers": [
+        "SELECT customer_state, COUNT(DISTINCT customer_unique_id) AS customers FROM data "
+        "GROUP BY customer_state ORDER BY customers DESC",
+    ],
+}
+
+
+def best_time(run, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQL backend aggregate query times")
+    parser.add_argument("--rows", type=int, default=1000000, help="rows in the generated files")
+    parser.add_argument("--dir", help="folder with the real Olist CSVs instead of generated ones")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query, the best time is kept")
+    args = parser.parse_args()
+
+    sqlite, duckdb = SQL_BACKENDS["sqlite"], SQL_BACKENDS["duckdb"]
+    if not duckdb.available():
+        sys.exit("duckdb isn't installed: pip install duckdb")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.dir:
+            paths = {}
+            for name, file in OLIST_FILES.items():
+                if os.path.exists(os.path.join(args.dir, file)):
+                    # copies, the sidecars are written next to the file
+                    paths[name] = shutil.copy(os.path.join(args.dir, file), tmp_dir)
+        else:
+            paths = generate_samples(tmp_dir, args.rows)
+
+        print(f"{'query':<60}{'sqlite':>9}{'duck csv':>10}{'duck pq':>10}{'speedup':>9}")
+        for name, queries in QUERIES.items():
+            if name not in paths:
+                continue
+            path = paths[name]
+            build_profile(path)
+            get_materialized_db(path)
+            build_parquet_copy(path)
+            parquet_path = parquet_path_for(path)
+            for sql in queries:
+                sqlite_time = best_time(lambda: sqlite.run(path, sql), args.repeat)
+                parquet_time = best_time(lambda: duckdb.run(path, sql), args.repeat)
+                # hide the Parquet copy so DuckDB reads the CSV
+                with patch("app.utils.sql_backends.get_parquet_copy", return_value=None):
+                    csv_time = best_time(lambda: duckdb.run(path, sql), args.repeat)
+                label = f"{name}: {sql}"
+                label = label if len(label) <= 58 else label[:55] + "..."
+                print(f"{label:<60}{sqlite_time:>9.3f}{csv_time:>10.3f}{parquet_time:>10.3f}"
+                      f"{sqlite_time / parquet_time:>8.1f}x")
+            os.remove(parquet_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
 import os
-from flask import Flask, jsonify
-from flask_cors import CORS
+import threading
 from dotenv import load_dotenv
-from app.routes.file_routes import file_routes
-from app.routes.query_routes import query_bp
+from app import create_app
 import logging
 
 # Author: Haris Kamran, K21084769 — March 2025
@@ -16,42 +14,34 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-print("Starting server...")
-print("Loading environment variables....")
-load_dotenv()
+def startup(upload_folder):
+    """One-off work for the server process. Not at import time: sandbox workers re-run
+    this file as __mp_main__, and they must not rebuild indexes or call Ollama"""
+    from app.utils.rag_examples import load_indexes
+    from app.utils.dataset_catalog import dataset_catalog
+    from app.services.ollama_service import preload_model
+
+    if not os.path.exists(upload_folder):
+        print(f"Creating uploads Folder: {upload_folder}")
+        os.makedirs(upload_folder)
+    # RAG example indexes, built (or loaded from disk) now rather than on the first question
+    load_indexes(os.getenv('EXAMPLE_INDEX_DIR') or os.path.join(upload_folder, 'indexes'))
+    # catalog entries of earlier uploads, so their metadata is in the RAG index too
+    dataset_catalog.load(os.path.join(upload_folder, 'objects'))
+    # load the model now rather than on the first question, keep_alive keeps it loaded
+    threading.Thread(target=preload_model, daemon=True).start()
+
 
+load_dotenv()
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    print(f"Creating uploads Folder: {UPLOAD_FOLDER}")
-    os.makedirs(UPLOAD_FOLDER)
-
-
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-# Allow larger files sizes
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
-app.register_blueprint(file_routes)
-app.register_blueprint(query_bp)
-
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({"status": "healthy", "message": "Server is running"}), 200
-
-@app.route('/', methods=['GET'])
-def root():
-    return jsonify({
-        "message": "Welcome to the Terranova API",
-        "endpoints": {
-            "file_upload": "/upload",
-            "active_file": "/active-file",
-            "query": "/query"
-        },
-        "version": "1.0.0"
-    })
-    
+# module level so `flask run` (FLASK_APP=main.py) and main:app WSGI servers find it.
+# Creating it does no startup work, sandbox workers re-running this file get just the app.
+app = create_app(UPLOAD_FOLDER)
+
 
 if __name__ == '__main__':
+    print("Starting server...")
+    startup(UPLOAD_FOLDER)
     port = int(os.environ.get('PORT', 5050))
     print(f"Starting server on port {port}...")
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,111 @@
+# Tests for chunk by chunk (out-of-core) pandas execution on big CSVs
+
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.chunked_query import run_chunked_query, NotDecomposable
+from app.utils.dataset_profile import _profile_csv, _profile_csv_chunked
+from app.utils.db_handler import execute_pandas_query
+from app.utils.result_cache import result_cache
+
+
+class TestChunkedQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "orders.csv")
+        rng = np.random.default_rng(0)
+        n = 2000
+        df = pd.DataFrame({
+            'order_id': [f"o{i}" for i in range(n)],
+            'customer_state': rng.choice(['SP', 'RJ', 'MG', None], n),
+            'payment_type': rng.choice(['voucher', 'boleto', 'credit_card'], n),
+            'price': np.round(rng.random(n) * 100, 2),
+            'qty': rng.integers(1, 5, n)
+        })
+        df.loc[5, 'price'] = np.nan
+        df.to_csv(self.csv_path, index=False)
+        self.df = pd.read_csv(self.csv_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertSameAsFullLoad(self, code):
+        expected = eval(code, {'pd': pd, 'np': np}, {'df': self.df})
+        result = run_chunked_query(self.csv_path, code, chunk_rows=137)
+        if isinstance(expected, pd.DataFrame):
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        elif isinstance(expected, pd.Series):
+            pd.testing.assert_series_equal(result, expected, check_dtype=False)
+        else:
+            self.assertAlmostEqual(result, expected)
+
+    def test_filters_and_head(self):
+        self.assertSameAsFullLoad("df.head(10)")
+        self.assertSameAsFullLoad("df[df['customer_state'] == 'SP']['price']")
+        self.assertSameAsFullLoad("df[(df['price'] > 50) & (df['qty'] >= 2)][['order_id', 'price']].head(20)")
+        self.assertSameAsFullLoad("df.loc[df['qty'] > 3, ['order_id', 'qty']]")
+
+    def test_value_counts(self):
+        self.assertSameAsFullLoad("df['customer_state'].value_counts()")
+        self.assertSameAsFullLoad("df['customer_state'].value_counts(normalize=True, dropna=False)")
+        self.assertSameAsFullLoad("df[['customer_state', 'payment_type']].value_counts()")
+
+    def test_groupby_aggregations(self):
+        self.assertSameAsFullLoad("df.groupby('customer_state')['price'].mean()")
+        self.assertSameAsFullLoad("df.groupby('customer_state').size()")
+        self.assertSameAsFullLoad("df.groupby(['customer_state', 'payment_type'])['qty'].count()")
+        self.assertSameAsFullLoad("df.groupby('customer_state').agg({'price': 'mean', 'qty': 'sum'})")
+        self.assertSameAsFullLoad("df.groupby('customer_state')['price'].agg(['sum', 'min', 'max'])")
+        self.assertSameAsFullLoad("df.groupby('customer_state').agg(total=('price', 'sum'), n=('qty', 'count'))")
+        self.assertSameAsFullLoad("df.groupby('customer_state', as_index=False)['price'].sum()")
+        self.assertSameAsFullLoad(
+            "df.groupby('payment_type').size().reset_index(name='n').sort_values('n', ascending=False)"
+        )
+
+    def test_top_n_and_scalars(self):
+        self.assertSameAsFullLoad("df.sort_values('price', ascending=False).head(5)")
+        self.assertSameAsFullLoad("df.nlargest(7, 'price')")
+        self.assertSameAsFullLoad("df.assign(total=df['price'] * df['qty']).sort_values('total', ascending=False).head(3)")
+        self.assertSameAsFullLoad("df[df['payment_type'] == 'credit_card']['price'].mean()")
+        self.assertSameAsFullLoad("(df['price'] > 50).sum()")
+        self.assertSameAsFullLoad("df['customer_state'].nunique()")
+
+    def test_not_decomposable(self):
+        for code in ["df", "df[df['price'] > df['price'].mean()]",
+                     "df.groupby('customer_state')['price'].median()", "len(df)"]:
+            with self.assertRaises(NotDecomposable):
+                run_chunked_query(self.csv_path, code)
+
+    def test_chunked_profile_matches(self):
+        with patch('app.utils.chunked_query.CSV_CHUNK_ROWS', 211):
+            chunked = _profile_csv_chunked(self.csv_path, 5)
+        self.assertEqual(chunked, _profile_csv(self.csv_path, 5))
+
+    def test_big_csv_never_loaded_whole(self):
+        result_cache.clear()
+        code = "df.groupby('payment_type')['qty'].sum()"
+        # in process, so the patches apply
+        with patch('app.utils.code_sandbox.SANDBOX_ENABLED', False), \
+                patch('app.utils.chunked_query.CHUNKED_CSV_BYTES', 0), \
+                patch('app.utils.db_handler.load_dataframe') as mock_load:
+            chunked = execute_pandas_query(self.csv_path, code)
+            mock_load.assert_not_called()
+            result_cache.clear()
+            # falls back to the normal path when the code can't be split up
+            mock_load.return_value = self.df
+            execute_pandas_query(self.csv_path, "df.groupby('payment_type')['qty'].median()")
+            mock_load.assert_called_once()
+        result_cache.clear()
+        self.assertEqual(chunked["results"], execute_pandas_query(self.csv_path, code)["results"])
+
+
+if __name__ == '__main__':
+    unittest.main()
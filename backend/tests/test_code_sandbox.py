@@ -0,0 +1,164 @@
+# Tests for running generated code in sandbox worker processes
+
+import unittest
+import os
+import sys
+import time
+import tempfile
+import threading
+import runpy
+from unittest.mock import patch
+import pandas as pd
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routes.query_routes import query_bp
+from app.utils.code_sandbox import (
+    SandboxPool, SandboxError, SandboxTimeout, SandboxMemoryError, SandboxCancelled, SandboxBusy
+)
+from app.utils.db_handler import run_pandas_job
+from app.utils.materialize import get_arrow_copy, read_arrow_copy
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestSandboxPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "payments.csv")
+        pd.DataFrame({
+            'payment_type': ['credit_card', 'boleto', 'credit_card'],
+            'payment_value': [10.0, 20.0, 30.0]
+        }).to_csv(self.csv_path, index=False)
+        self.pool = SandboxPool(workers=1, timeout=20, memory_mb=100)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.tmp_dir.cleanup()
+
+    def _dataset_job(self, code):
+        return {"kind": "dataset", "file_path": self.csv_path, "code": code}
+
+    def test_dataset_job_matches_in_process(self):
+        code = "df.groupby('payment_type')['payment_value'].sum()"
+        result = self.pool.run(self._dataset_job(code))
+        pd.testing.assert_frame_equal(result, run_pandas_job(self.csv_path, code))
+        # the worker mapped the Arrow copy instead of getting the frame pickled
+        self.assertTrue(os.path.exists(self.csv_path + ".arrow"))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow not installed")
+    def test_arrow_copy_read_without_copying(self):
+        pd.DataFrame({'value': [1.5, None, 2.5], 'count': [1, 2, 3]}).to_csv(self.csv_path, index=False)
+        arrow_path = get_arrow_copy(self.csv_path)
+        self.assertTrue(read_arrow_copy(arrow_path)['value'].isna().iloc[1])
+        # NaN is a value in the Arrow copy, not a null, so pandas uses the mapped buffer as is
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(arrow_path)).read_all()
+        self.assertEqual(table.column('value').null_count, 0)
+        frame = table.to_pandas(split_blocks=True)
+        for col in frame:
+            address = frame[col].to_numpy().__array_interface__['data'][0]
+            self.assertEqual(address, table.column(col).chunk(0).buffers()[1].address)
+
+    def test_waits_for_a_worker_with_timeout(self):
+        pool = SandboxPool(workers=1, timeout=20, memory_mb=100, queue_timeout=0.2)
+        slow = {"kind": "frame", "frame": pd.DataFrame(), "code": "__import__('time').sleep(3)"}
+        thread = threading.Thread(target=pool.run, args=(slow,))
+        thread.start()
+        try:
+            time.sleep(0.5)
+            with self.assertRaises(SandboxBusy):
+                pool.run({"kind": "frame", "frame": pd.DataFrame(), "code": "1"}, cancel_key="req-3")
+            # its cancel key isn't left behind
+            self.assertFalse(pool.cancel("req-3"))
+        finally:
+            thread.join(10)
+            pool.shutdown()
+
+    def test_error_message_passed_back(self):
+        with self.assertRaises(SandboxError) as ctx:
+            self.pool.run(self._dataset_job("df['nonexistent']"))
+        self.assertIn("nonexistent", str(ctx.exception))
+        # worker is still usable after a plain error
+        self.assertEqual(len(self.pool.run(self._dataset_job("df.head(2)"))), 2)
+
+    def test_timeout_kills_job(self):
+        job = {"kind": "frame", "frame": pd.DataFrame(), "code": "sum(i for i in range(10 ** 12))"}
+        start = time.monotonic()
+        with self.assertRaises(SandboxTimeout):
+            self.pool.run(job, timeout=0.5)
+        self.assertLess(time.monotonic() - start, 10)
+        # replaced by a fresh worker
+        self.assertEqual(self.pool.run({"kind": "frame", "frame": pd.DataFrame({'a': [1]}), "code": "len(df)"}), 1)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "needs /proc for RSS")
+    def test_memory_limit(self):
+        code = "[b'x' * 10 ** 6 for i in range(400)] and sum(i for i in range(10 ** 12))"
+        with self.assertRaises(SandboxMemoryError):
+            self.pool.run({"kind": "frame", "frame": pd.DataFrame(), "code": code})
+
+    def test_cancel(self):
+        errors = []
+
+        def run():
+            try:
+                self.pool.run({"kind": "frame", "frame": pd.DataFrame(), "code": "sum(i for i in range(10 ** 12))"},
+                              cancel_key="req-1")
+            except SandboxError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not self.pool.cancel("req-1") and time.monotonic() < deadline:
+            time.sleep(0.05)
+        thread.join(10)
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], SandboxCancelled)
+        self.assertFalse(self.pool.cancel("req-1"))
+
+
+class TestCancelRoute(unittest.TestCase):
+
+    def test_unknown_request_id(self):
+        app = Flask(__name__)
+        app.register_blueprint(query_bp)
+        response = app.test_client().delete('/query/nothing-running')
+        self.assertEqual(response.status_code, 404)
+
+    def test_streamed_query_can_be_cancelled(self):
+        app = Flask(__name__)
+        app.register_blueprint(query_bp)
+        generated = {"success": True, "query_type": "pandas", "pandas_query": "df.head()"}
+        with patch('app.routes.query_routes._generate_query', return_value=(generated, None)), \
+                patch('app.routes.query_routes.execute_pandas_query',
+                      return_value={"success": False, "error": "Query cancelled"}) as execute:
+            response = app.test_client().post('/query', json={
+                "query": "first rows", "filePath": "payments.csv", "stream": True, "requestId": "req-2"
+            })
+            response.get_data()
+        self.assertEqual(execute.call_args.kwargs["cancel_key"], "req-2")
+
+
+class TestWorkerStartup(unittest.TestCase):
+
+    def test_rerunning_main_does_no_startup(self):
+        # what a spawn/forkserver worker does with the parent's main script
+        main_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+        with patch('app.utils.rag_examples.load_indexes') as load_indexes, \
+                patch('app.utils.dataset_catalog.dataset_catalog.load') as catalog_load, \
+                patch('app.services.ollama_service.preload_model') as preload_model:
+            module = runpy.run_path(main_path, run_name="__mp_main__")
+        load_indexes.assert_not_called()
+        catalog_load.assert_not_called()
+        preload_model.assert_not_called()
+        # the app is still there for flask run / WSGI servers
+        self.assertIn("app", module)
+
+
+if __name__ == '__main__':
+    unittest.main()
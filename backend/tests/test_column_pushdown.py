@@ -0,0 +1,86 @@
+# Tests for column projection / dtype pushdown when loading CSVs for pandas code
+
+import unittest
+import os
+import sys
+import tempfile
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.column_pushdown import referenced_columns, pandas_load_options
+from app.utils.dataset_cache import dataset_cache, load_dataframe
+from app.utils.dataset_profile import get_profile
+from app.utils.db_handler import run_pandas_job, _run_pandas_code
+
+COLUMNS = ['order_id', 'customer_state', 'payment_type', 'payment_value', 'installments']
+
+
+class TestReferencedColumns(unittest.TestCase):
+
+    def test_narrowed_to_named_columns(self):
+        self.assertEqual(
+            referenced_columns("df[df['customer_state'] == 'SP']['payment_value'].mean()", COLUMNS),
+            ['customer_state', 'payment_value']
+        )
+        self.assertEqual(referenced_columns("df.groupby('payment_type').size()", COLUMNS), ['payment_type'])
+        self.assertEqual(
+            referenced_columns("df.query('installments > 3').payment_value.max()", COLUMNS),
+            ['payment_value', 'installments']
+        )
+
+    def test_whole_frame_needed(self):
+        for code in ["df[df['customer_state'] == 'SP']", "df.describe()", "df.head()",
+                     "df.groupby('payment_type').sum()", "df.iloc[:, 0]", "df.dropna()['order_id']"]:
+            self.assertIsNone(referenced_columns(code, COLUMNS), code)
+
+
+class TestPushdownLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "payments.csv")
+        n = 400
+        pd.DataFrame({
+            'order_id': [f"o{i}" for i in range(n)],
+            'customer_state': ['SP', 'RJ', 'MG', None] * (n // 4),
+            'payment_type': ['voucher', 'boleto'] * (n // 2),
+            'payment_value': [float(i) for i in range(n)],
+            'installments': [i % 5 for i in range(n)]
+        }).to_csv(self.csv_path, index=False)
+        self.profile = get_profile(self.csv_path)
+        dataset_cache.invalidate()
+
+    def tearDown(self):
+        dataset_cache.invalidate()
+        self.tmp_dir.cleanup()
+
+    def test_categoricals_only_when_safe(self):
+        options = pandas_load_options("df[df['customer_state'] == 'SP']['order_id'].count()", self.profile)
+        self.assertEqual(options["columns"], ['order_id', 'customer_state'])
+        self.assertEqual(options["dtype"]["customer_state"], "category")
+        # order_id is unique per row, not worth a category
+        self.assertNotEqual(options["dtype"]["order_id"], "category")
+        # value_counts on a categorical would list unused categories too
+        options = pandas_load_options("df['customer_state'].value_counts()", self.profile)
+        self.assertNotEqual(options["dtype"]["customer_state"], "category")
+
+    def test_same_results_as_full_load(self):
+        full = pd.read_csv(self.csv_path)
+        for code in ["df[df['customer_state'] == 'SP']['payment_value'].mean()",
+                     "df[df['customer_state'].isin(['SP', 'RJ'])][['order_id', 'customer_state']].head(5)",
+                     "df.groupby('payment_type')['installments'].sum()"]:
+            expected = _run_pandas_code(full.copy(), code)
+            result = run_pandas_job(self.csv_path, code)
+            pd.testing.assert_frame_equal(result.astype(object), expected.astype(object), check_categorical=False)
+
+    def test_projection_sliced_from_cached_full_frame(self):
+        load_dataframe(self.csv_path)
+        df = load_dataframe(self.csv_path, columns=['order_id', 'payment_value'], dtype={'order_id': 'category'})
+        self.assertEqual(df.columns.tolist(), ['order_id', 'payment_value'])
+        # served from the whole frame, not parsed again with the categorical
+        self.assertEqual(str(df['order_id'].dtype), "str")
+
+
+if __name__ == '__main__':
+    unittest.main()
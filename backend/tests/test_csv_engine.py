@@ -0,0 +1,67 @@
+# Tests for CSV engine selection (pyarrow reads have to match the C engine)
+
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.csv_engine import read_csv, choose_engine, _pyarrow_available
+
+SAMPLE = (
+    "order_id,purchased_at,state,value,paid,note\n"
+    "o1,2017-10-02 10:56:33,SP,,True,NA\n"
+    "o2,2018-07-24 20:41:37,,1.5,False,\n"
+    "o3,2018-08-08 08:38:49,n/a,2,,\"a, quoted\nnote\"\n"
+)
+
+
+@unittest.skipUnless(_pyarrow_available(), "needs pyarrow")
+class TestCsvEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, text, name="data.csv", encoding="utf-8"):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding=encoding) as f:
+            f.write(text)
+        return path
+
+    def test_matches_c_engine(self):
+        path = self._write(SAMPLE)
+        self.assertEqual(choose_engine({}), "pyarrow")
+        # timestamps stay text, NA strings / bools / quoted newlines parse the same
+        pd.testing.assert_frame_equal(read_csv(path), pd.read_csv(path))
+        kwargs = {"usecols": ["value", "order_id", "state"], "dtype": {"state": "category", "value": "float64"}}
+        pd.testing.assert_frame_equal(read_csv(path, **kwargs), pd.read_csv(path, **kwargs))
+
+    def test_dialects(self):
+        path = self._write("nome;valor\nJoão;1\nSão Paulo;2\n", encoding="latin-1")
+        kwargs = {"sep": ";", "encoding": "latin-1"}
+        pd.testing.assert_frame_equal(read_csv(path, **kwargs), pd.read_csv(path, **kwargs))
+        # pandas renames duplicate headers, left to the C engine
+        path = self._write("a,a,b\n1,2,3\n", name="dup.csv")
+        self.assertEqual(read_csv(path).columns.tolist(), ["a", "a.1", "b"])
+
+    def test_falls_back_to_c_engine(self):
+        self.assertEqual(choose_engine({"chunksize": 10}), "c")
+        self.assertEqual(choose_engine({"nrows": 0}), "c")
+        self.assertEqual(choose_engine({}, engine="python"), "python")
+        # pyarrow rejects the short row, the C engine pads it
+        path = self._write('a,b\n1,x\n2\n')
+        with patch("app.utils.csv_engine.pd.read_csv", wraps=pd.read_csv) as c_read:
+            frame = read_csv(path)
+            c_read.assert_called_once()
+        self.assertEqual(frame["a"].tolist(), [1, 2])
+        self.assertTrue(pd.isna(frame["b"][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Tests for the parsed dataset cache
+
+import unittest
+import os
+import sys
+import time
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.dataset_cache import DatasetCache, LRUByteCache
+
+
+class TestDatasetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "data.csv")
+        pd.DataFrame({'name': ['John', 'Jane'], 'city': ['London', 'New York']}).to_csv(self.csv_path, index=False)
+        self.cache = DatasetCache(max_bytes=10 * 1024 * 1024)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_file_is_parsed_once(self):
+        with patch('app.utils.dataset_cache.pd.read_csv', wraps=pd.read_csv) as mock_read:
+            for _ in range(4):
+                df = self.cache.get_dataframe(self.csv_path, loader=mock_read)
+            self.assertEqual(mock_read.call_count, 1)
+        self.assertEqual(len(df), 2)
+
+    def test_changed_file_is_reparsed(self):
+        self.cache.get_dataframe(self.csv_path)
+        time.sleep(0.01)
+        pd.DataFrame({'name': ['John'], 'city': ['London']}).to_csv(self.csv_path, index=False)
+        df = self.cache.get_dataframe(self.csv_path)
+        self.assertEqual(len(df), 1)
+        # the stale version should have been dropped
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_callers_cant_change_cached_frame(self):
+        df = self.cache.get_dataframe(self.csv_path)
+        df['extra'] = 1
+        df.columns = ['a', 'b', 'c']
+        self.assertEqual(self.cache.get_dataframe(self.csv_path).columns.tolist(), ['name', 'city'])
+
+    def test_in_place_edit_doesnt_reach_cached_frame(self):
+        df = self.cache.get_dataframe(self.csv_path)
+        expected = df.iloc[0, 0]
+        df.iloc[0, 0] = 'changed'
+        df.loc[1:, 'name'] = 'changed too'
+        self.assertEqual(self.cache.get_dataframe(self.csv_path).iloc[0, 0], expected)
+        self.assertNotIn('changed too', self.cache.get_dataframe(self.csv_path)['name'].tolist())
+
+
+class TestLRUByteCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = LRUByteCache(max_bytes=10, sizeof=len)
+        cache.put("a", "xxxx")
+        cache.put("b", "xxxx")
+        cache.get("a")
+        cache.put("c", "xxxx")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.total_bytes, 8)
+
+    def test_oversized_entry_not_cached(self):
+        cache = LRUByteCache(max_bytes=3, sizeof=len)
+        cache.put("a", "xxxx")
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# Tests for the dataset catalog: entries, join key detection and persistence
+
+import unittest
+import os
+import sys
+import json
+import tempfile
+import threading
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.dataset_cache import dataset_cache
+from app.utils.dataset_catalog import (
+    DatasetCatalog, column_sketch, estimate_containment, catalog_path_for, build_entry, _write_entry
+)
+from app.utils.rag_examples import load_indexes, find_examples, get_file_connections, register_datasets
+
+
+class TestSketches(unittest.TestCase):
+
+    def test_containment(self):
+        ids = pd.Series([f"c{i}" for i in range(10000)])
+        subset = ids.iloc[::3]
+        other = pd.Series([f"x{i}" for i in range(5000)])
+        self.assertGreater(estimate_containment(column_sketch(subset), len(subset), column_sketch(ids), len(ids)), 0.8)
+        self.assertEqual(estimate_containment(column_sketch(other), 5000, column_sketch(ids), 10000), 0.0)
+        # ints and their text form hash the same
+        np.testing.assert_array_equal(column_sketch(pd.Series([1, 2, 3])), column_sketch(pd.Series(["1", "2", "3"])))
+
+
+class TestDatasetCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        n = 400
+        customers = pd.DataFrame({
+            'customer_id': [f"c{i}" for i in range(n)],
+            'customer_zip_code_prefix': rng.integers(10000, 99999, n),
+            'customer_city': rng.choice(['sao paulo', 'rio de janeiro'], n),
+            'customer_state': rng.choice(['SP', 'RJ'], n)
+        })
+        orders = pd.DataFrame({
+            'order_id': [f"o{i}" for i in range(2 * n)],
+            'customer_id': rng.choice(customers['customer_id'], 2 * n),
+            'status': rng.choice(['delivered', 'shipped', 'canceled'], 2 * n),
+            'amount': np.round(rng.random(2 * n) * 100, 2)
+        })
+        reviews = pd.DataFrame({
+            'review_id': range(300),
+            'reviewed_order_id': rng.choice(orders['order_id'], 300),
+            'score': rng.integers(1, 6, 300)
+        })
+        self.paths = {}
+        for name, df in [("customers", customers), ("shop_orders", orders), ("reviews", reviews)]:
+            self.paths[name] = os.path.join(self.tmp_dir.name, f"{name}.csv")
+            df.to_csv(self.paths[name], index=False)
+        dataset_cache.invalidate()
+        load_indexes(index_dir=None)
+
+    def tearDown(self):
+        dataset_cache.invalidate()
+        load_indexes(index_dir=None)
+        self.tmp_dir.cleanup()
+
+    def test_entries_and_links(self):
+        catalog = DatasetCatalog()
+        for path in self.paths.values():
+            catalog.add(path)
+        customers, orders, reviews = (catalog.entry_for(self.paths[name]) for name in ("customers", "shop_orders", "reviews"))
+
+        # same columns as the Customers training file, so its curated examples apply
+        self.assertEqual(customers["file_type"], "customers")
+        self.assertEqual(orders["file_type"], "shop_orders")
+        self.assertIn("800 rows", orders["description"])
+
+        self.assertEqual(customers["links"], [{"connects_to": "shop_orders", "via": "customer_id", "type": "one-to-many"}])
+        self.assertIn({"connects_to": "customers", "via": "customer_id", "type": "many-to-one"}, orders["links"])
+        # differently named, found from the values
+        self.assertEqual(reviews["links"], [
+            {"connects_to": "shop_orders", "via": "reviewed_order_id = shop_orders.order_id", "type": "many-to-one"}
+        ])
+        self.assertIn("Connected to reviews", get_file_connections("shop_orders"))
+
+        # seed examples, found under the upload's file type
+        codes = [ex["code"] for ex in find_examples("total amount by status", "shop_orders")]
+        self.assertIn("df.groupby('status')['amount'].sum()", codes)
+
+    def test_saved_and_loaded(self):
+        catalog = DatasetCatalog()
+        for path in self.paths.values():
+            catalog.add(path)
+        self.assertTrue(os.path.exists(catalog_path_for(self.paths["reviews"])))
+
+        load_indexes(index_dir=None)
+        reloaded = DatasetCatalog()
+        with patch('app.utils.dataset_catalog.register_datasets', wraps=register_datasets) as mock_register:
+            self.assertEqual(reloaded.load(self.tmp_dir.name), 3)
+        # registered together, their questions embedded in one go
+        mock_register.assert_called_once()
+        self.assertEqual(len(mock_register.call_args[0][0]), 3)
+        self.assertEqual(reloaded.entry_for(self.paths["shop_orders"]), catalog.entry_for(self.paths["shop_orders"]))
+        self.assertIn("Connected to customers", get_file_connections("shop_orders"))
+
+        # a changed file is catalogued again
+        with open(self.paths["reviews"], "a") as f:
+            f.write("300,o1,5\n")
+        self.assertEqual(DatasetCatalog().load(self.tmp_dir.name), 2)
+
+    def test_build_does_not_block_other_lookups(self):
+        catalog = DatasetCatalog()
+        customers = catalog.add(self.paths["customers"])
+        lookups = []
+        served = []
+
+        def slow_build(file_path):
+            # another dataset's entry is served while this one is being built
+            thread = threading.Thread(target=lambda: lookups.append(catalog.entry_for(self.paths["customers"])))
+            thread.start()
+            thread.join(5)
+            served.append(not thread.is_alive())
+            return build_entry(file_path)
+
+        with patch('app.utils.dataset_catalog.build_entry', side_effect=slow_build) as mock_build:
+            entry = catalog.entry_for(self.paths["shop_orders"])
+            # built once, then found
+            self.assertIs(catalog.entry_for(self.paths["shop_orders"]), entry)
+        self.assertEqual(served, [True])
+        self.assertEqual(lookups, [customers])
+        self.assertEqual(mock_build.call_count, 1)
+
+    def test_writes_after_releasing_the_lock(self):
+        catalog = DatasetCatalog()
+        catalog.add(self.paths["customers"])
+        free = []
+
+        def write_entry(path, text):
+            # the catalog lock can be taken by another thread while the sidecars are written
+            thread = threading.Thread(target=catalog.entries)
+            thread.start()
+            thread.join(5)
+            free.append(not thread.is_alive())
+            _write_entry(path, text)
+
+        with patch('app.utils.dataset_catalog._write_entry', side_effect=write_entry):
+            catalog.add(self.paths["shop_orders"])
+        # the new entry and the customers entry it links to
+        self.assertEqual(free, [True, True])
+        with open(catalog_path_for(self.paths["customers"])) as f:
+            self.assertEqual(json.load(f)["links"], catalog.entry_for(self.paths["customers"])["links"])
+
+
+if __name__ == '__main__':
+    unittest.main()
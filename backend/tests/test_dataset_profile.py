@@ -0,0 +1,56 @@
+# Tests for the upload time schema/profile artifact
+
+import unittest
+import os
+import sys
+import time
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.dataset_profile import build_profile, get_profile, profile_path_for
+
+
+class TestDatasetProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "data.csv")
+        pd.DataFrame({
+            'name': ['John', 'Jane', 'Jim'],
+            'city': ['London', 'New York', 'London'],
+            'age': [30, 40, 50]
+        }).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_profile_written_next_to_upload(self):
+        profile = build_profile(self.csv_path)
+        self.assertTrue(os.path.exists(profile_path_for(self.csv_path)))
+        columns = {col["name"]: col for col in profile["tables"][0]["columns"]}
+        self.assertEqual(columns["age"]["min"], 30)
+        self.assertEqual(columns["age"]["max"], 50)
+        self.assertEqual(columns["city"]["distinct"], 2)
+        self.assertEqual(columns["city"]["top_values"][0], ["London", 2])
+        self.assertIn("Columns: name, city, age", profile["schema_text"])
+        self.assertIn("Sample Data (first 5 rows)", profile["enhanced_schema_text"])
+
+    def test_existing_profile_is_reused(self):
+        build_profile(self.csv_path)
+        with patch('app.utils.dataset_profile.compute_profile') as mock_compute:
+            get_profile(self.csv_path)
+            mock_compute.assert_not_called()
+
+    def test_stale_profile_is_rebuilt(self):
+        build_profile(self.csv_path)
+        time.sleep(0.01)
+        pd.DataFrame({'name': ['John'], 'city': ['Paris'], 'age': [1]}).to_csv(self.csv_path, index=False)
+        profile = get_profile(self.csv_path)
+        self.assertEqual(profile["tables"][0]["row_count"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Tests for the vector index behind RAG example lookup
+
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.example_index import ExampleIndex, HashingEmbedder
+from app.utils.rag_examples import find_examples, guess_relevant_files, load_indexes
+
+QUESTIONS = [
+    "Show me the first 5 rows",
+    "What's the average payment value for credit card payments?",
+    "When was order 12345 delivered?",
+    "Which product has the largest volume?",
+]
+
+
+class TestExampleIndex(unittest.TestCase):
+
+    def test_hashing_vectors(self):
+        embedder = HashingEmbedder(dim=512)
+        vectors = embedder.embed(["Average payment value", "average  PAYMENT value?", "the of what"])
+        np.testing.assert_allclose(np.linalg.norm(vectors[:2], axis=1), 1, rtol=1e-6)
+        np.testing.assert_allclose(vectors[0], vectors[1])
+        # stopwords only
+        self.assertFalse(vectors[2].any())
+
+    def test_search(self):
+        index = ExampleIndex("questions", QUESTIONS, embedder=HashingEmbedder())
+        self.assertEqual(index.search("mean credit card payment")[0][0], 1)
+        self.assertEqual([row for row, _ in index.search("when did order abc get delivered", k=1)], [2])
+        self.assertEqual([row for row, _ in index.search("delivered order", rows=[0, 1, 3])], [])
+        self.assertEqual(index.search("what is the weather"), [])
+
+    def test_saved_and_reloaded(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = ExampleIndex("questions", QUESTIONS, embedder=HashingEmbedder(), index_dir=tmp_dir)
+            self.assertTrue(os.path.exists(index.path))
+            with patch.object(HashingEmbedder, 'embed', wraps=HashingEmbedder().embed) as mock_embed:
+                again = ExampleIndex("questions", QUESTIONS, embedder=HashingEmbedder(), index_dir=tmp_dir)
+                mock_embed.assert_not_called()
+                np.testing.assert_array_equal(again.matrix, index.matrix)
+                # different texts, rebuilt
+                ExampleIndex("questions", QUESTIONS[:2], embedder=HashingEmbedder(), index_dir=tmp_dir)
+                mock_embed.assert_called_once()
+
+    def test_added_texts_not_saved(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = ExampleIndex("questions", QUESTIONS, embedder=HashingEmbedder(), index_dir=tmp_dir)
+            saved = os.path.getmtime(index.path), os.path.getsize(index.path)
+            index.add(["How many orders were late?"])
+            self.assertEqual(index.search("how many late orders", k=1)[0][0], 4)
+            self.assertEqual((os.path.getmtime(index.path), os.path.getsize(index.path)), saved)
+            # what was saved still matches the start-up texts
+            with patch.object(HashingEmbedder, 'embed', wraps=HashingEmbedder().embed) as mock_embed:
+                ExampleIndex("questions", QUESTIONS, embedder=HashingEmbedder(), index_dir=tmp_dir)
+                mock_embed.assert_not_called()
+
+
+class TestRagLookups(unittest.TestCase):
+
+    def setUp(self):
+        load_indexes(index_dir=None)
+
+    def test_find_examples(self):
+        examples = find_examples("average value of credit card payments")
+        self.assertEqual(examples[0]["code"], "df[df['payment_type'] == 'credit_card']['payment_value'].mean()")
+        # other file types are left out, "any" examples stay in
+        self.assertEqual(find_examples("average value of credit card payments", "orders"), [])
+        self.assertEqual(find_examples("show the first 10 rows", "orders")[0]["code"], "df.head(5)")
+
+    def test_guess_relevant_files(self):
+        self.assertEqual(guess_relevant_files("which payment method brings in the most revenue")[0], "Payments")
+        self.assertEqual(guess_relevant_files("average product_weight_g")[0], "Products")
+        self.assertEqual(len(guess_relevant_files("hello there")), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# Tests for the deferred result explanations and the /explain/<id> route
+
+import unittest
+import os
+import sys
+import json
+import threading
+from unittest.mock import patch
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routes.query_routes import query_bp
+from app.services.explanation_jobs import submit_explanation, get_explanation
+from app.services.ollama_service import build_explanation_payload
+
+
+class TestExplanationJobs(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(query_bp)
+        self.client = app.test_client()
+        self.results = {
+            "success": True,
+            "results": [{"name": "John", "city": "London"}],
+            "columns": ["name", "city"]
+        }
+
+    def test_payload_uses_actual_result_rows(self):
+        payload = build_explanation_payload(self.results, "Who lives in London?")
+        self.assertIn('"name": "John"', payload["messages"][0]["content"])
+
+    @patch('app.services.explanation_jobs.explain_query_results')
+    def test_pending_then_done(self, mock_explain):
+        release = threading.Event()
+        mock_explain.side_effect = lambda results, query: release.wait() and "John lives in London"
+
+        explanation_id = submit_explanation(self.results, "Who lives in London?")
+        response = self.client.get(f'/explain/{explanation_id}')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.data)["status"], "pending")
+
+        release.set()
+        response = self.client.get(f'/explain/{explanation_id}?wait=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["explanation"], "John lives in London")
+        mock_explain.assert_called_once_with(self.results, "Who lives in London?")
+
+    def test_unknown_id(self):
+        self.assertIsNone(get_explanation("nope"))
+        self.assertEqual(self.client.get('/explain/nope').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
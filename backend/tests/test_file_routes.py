@@ -6,6 +6,7 @@ import os
 import sys
 import io
 import json
+import tempfile
 from unittest.mock import patch
 # Add parent directory to path for app imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,7 +17,10 @@ from app.utils.shared_state import SharedState
 class FileUploadRouteTests(unittest.TestCase):
     def setUp(self):
         # Initialize test client and reset shared state
-        self.app = create_app()
+        # uploads go to a temp folder, not the real backend/uploads
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.app = create_app(upload_folder=self.tmp_dir.name)
         self.app.config['TESTING'] = True
         self.client = self.app.test_client()
         self.shared_state = SharedState()
@@ -0,0 +1,91 @@
+# Tests for the LLM response cache
+
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.llm_cache import LLMResponseCache, llm_cache
+from app.services.ollama_service import get_pandas_query, remember_query, forget_query
+
+
+class TestLLMResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "llm_cache.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_question_is_normalised(self):
+        a = LLMResponseCache.make_key("llama3", "pandas", "How many customers per state?", "abc", 1)
+        b = LLMResponseCache.make_key("llama3", "pandas", "  how many customers  per state", "abc", 1)
+        c = LLMResponseCache.make_key("llama3", "pandas", "how many customers per state", "other", 1)
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+    def test_disk_tier_survives_restart(self):
+        cache = LLMResponseCache(db_path=self.db_path)
+        cache.put("k", {"pandas_query": "df.head(5)"})
+        cache = LLMResponseCache(db_path=self.db_path)
+        self.assertEqual(cache.get("k"), {"pandas_query": "df.head(5)"})
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+        self.assertEqual(cache.get("k"), {"pandas_query": "df.head(5)"})
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    def test_disk_entries_expire(self):
+        cache = LLMResponseCache(db_path=self.db_path, ttl=-1)
+        cache.put("k", {"pandas_query": "df.head(5)"})
+        cache = LLMResponseCache(db_path=self.db_path, ttl=-1)
+        self.assertIsNone(cache.get("k"))
+
+    @patch('app.services.ollama_service.get_llm_client')
+    def test_repeated_question_skips_llm(self, mock_client):
+        csv_path = os.path.join(self.tmp_dir.name, "customers.csv")
+        pd.DataFrame({'customer_state': ['SP', 'RJ']}).to_csv(csv_path, index=False)
+        mock_client.return_value.chat.return_value = {"message": {"content": "df['customer_state'].value_counts()"}}
+        llm_cache.clear()
+
+        first = get_pandas_query("How many customers per state?", "", csv_path)
+        remember_query(first)
+        second = get_pandas_query("how many customers per state", "", csv_path)
+        self.assertEqual(second["pandas_query"], first["pandas_query"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(mock_client.return_value.chat.call_count, 1)
+
+    @patch('app.services.ollama_service.get_llm_client')
+    def test_only_code_that_ran_is_cached(self, mock_client):
+        csv_path = os.path.join(self.tmp_dir.name, "customers.csv")
+        pd.DataFrame({'customer_state': ['SP', 'RJ']}).to_csv(csv_path, index=False)
+        mock_client.return_value.chat.return_value = {"message": {"content": "df['state'].value_counts()"}}
+        llm_cache.clear()
+
+        # never ran (or failed): asked again
+        get_pandas_query("How many customers per state?", "", csv_path)
+        cached = get_pandas_query("How many customers per state?", "", csv_path)
+        self.assertEqual(mock_client.return_value.chat.call_count, 2)
+        self.assertNotIn("cached", cached)
+
+        # a cached answer that fails is dropped
+        remember_query(cached)
+        cached = get_pandas_query("How many customers per state?", "", csv_path)
+        self.assertTrue(cached["cached"])
+        forget_query(cached)
+        get_pandas_query("How many customers per state?", "", csv_path)
+        self.assertEqual(mock_client.return_value.chat.call_count, 3)
+
+    def test_delete_reaches_disk_tier(self):
+        cache = LLMResponseCache(db_path=self.db_path)
+        cache.put("k", {"pandas_query": "df.head(5)"})
+        cache.delete("k")
+        self.assertIsNone(cache.get("k"))
+        self.assertIsNone(LLMResponseCache(db_path=self.db_path).get("k"))
+
+
+if __name__ == '__main__':
+    unittest.main()
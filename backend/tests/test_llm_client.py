@@ -0,0 +1,82 @@
+# Tests for the pooled Ollama client, run against a local stub server
+
+import unittest
+import os
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.llm_client import LLMClient
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so connections are kept alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.client_ports.add(self.client_address[1])
+        self.server.payloads.append(payload)
+        time.sleep(self.server.delay)
+        body = json.dumps({"message": {"role": "assistant", "content": f"echo {payload['model']}"}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLLMClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+        self.server.client_ports = set()
+        self.server.payloads = []
+        self.server.delay = 0
+        # clients hanging up early (timeouts) aren't errors here
+        self.server.handle_error = lambda *args: None
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/chat"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_calls_reuse_one_connection(self):
+        client = LLMClient(api_url=self.url)
+        for _ in range(3):
+            data = client.chat({"model": "llama3", "messages": []})
+        client.close()
+        self.assertEqual(data["message"]["content"], "echo llama3")
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_model_kept_loaded(self):
+        client = LLMClient(api_url=self.url)
+        client.chat({"model": "llama3", "messages": []})
+        client.chat({"model": "llama3", "messages": [], "keep_alive": 0, "options": {"temperature": 0}})
+        client.close()
+        first, second = self.server.payloads
+        self.assertEqual(first["keep_alive"], "30m")
+        self.assertEqual(first["options"], {"num_ctx": 4096})
+        # the caller's own values win
+        self.assertEqual(second["keep_alive"], 0)
+        self.assertEqual(second["options"], {"num_ctx": 4096, "temperature": 0})
+
+    def test_read_timeout(self):
+        self.server.delay = 0.5
+        client = LLMClient(api_url=self.url, read_timeout=0.1)
+        with self.assertRaises(requests.Timeout):
+            client.chat({"model": "llama3", "messages": []})
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Tests for the on-disk SQLite copy of CSV uploads
+
+import unittest
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.materialize import get_materialized_db, materialized_path_for
+from app.utils.db_handler import execute_query
+
+
+class TestMaterialize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "orders.csv")
+        pd.DataFrame({
+            'order_id': ['a', 'b', 'c', 'd'],
+            'order_status': ['delivered', 'shipped', 'delivered', 'delivered'],
+            'price': [10.0, 20.0, 30.0, 40.0]
+        }).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sql_query_uses_materialized_copy(self):
+        with patch('app.utils.sql_backends.SQL_BACKEND', 'sqlite'):
+            result = execute_query(self.csv_path, "SELECT order_status, COUNT(*) AS n FROM data GROUP BY order_status ORDER BY n DESC")
+        self.assertTrue(result["success"])
+        self.assertEqual(result["results"][0], {"order_status": "delivered", "n": 3})
+        self.assertTrue(os.path.exists(materialized_path_for(self.csv_path)))
+
+    def test_built_once(self):
+        get_materialized_db(self.csv_path)
+        with patch('app.utils.materialize.build_materialized_db') as mock_build:
+            get_materialized_db(self.csv_path)
+            mock_build.assert_not_called()
+
+    def test_indexes_on_filter_columns(self):
+        conn = sqlite3.connect(get_materialized_db(self.csv_path))
+        indexed = {row[0] for row in conn.execute(
+            "SELECT il.name FROM pragma_index_list('data') AS l, pragma_index_info(l.name) AS il")}
+        conn.close()
+        self.assertIn('order_id', indexed)
+        self.assertIn('order_status', indexed)
+
+    def test_rebuilt_when_source_changes(self):
+        get_materialized_db(self.csv_path)
+        time.sleep(0.01)
+        pd.DataFrame({'order_id': ['z'], 'order_status': ['lost'], 'price': [1.0]}).to_csv(self.csv_path, index=False)
+        result = execute_query(self.csv_path, "SELECT * FROM data")
+        self.assertEqual(result["results"], [{"order_id": "z", "order_status": "lost", "price": 1.0}])
+
+    def test_sql_cannot_modify_copy(self):
+        result = execute_query(self.csv_path, "DELETE FROM data")
+        self.assertFalse(result["success"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Tests for the Parquet copy of CSV uploads and row group skipping
+
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.chunked_query import row_filters, run_chunked_query
+from app.utils.dataset_cache import dataset_cache, load_dataframe
+from app.utils.db_handler import run_pandas_job, _run_pandas_code
+from app.utils.materialize import build_parquet_copy
+from app.utils.csv_engine import _pyarrow_available
+from app.utils.parquet_copy import get_parquet_copy, read_parquet_copy
+
+COLUMNS = ['order_id', 'purchased_at', 'state', 'price', 'qty']
+
+
+class TestRowFilters(unittest.TestCase):
+
+    def test_filters_from_mask(self):
+        self.assertEqual(row_filters("df[df['qty'] > 3]", COLUMNS), [('qty', '>', 3)])
+        self.assertEqual(
+            row_filters("df[(df['state'] == 'SP') & (5 <= df.price)]['qty'].sum()", COLUMNS),
+            [('state', '==', 'SP'), ('price', '>=', 5)]
+        )
+        self.assertEqual(
+            row_filters("df.loc[df['qty'].between(1, 2), ['order_id']]", COLUMNS),
+            [('qty', '>=', 1), ('qty', '<=', 2)]
+        )
+        self.assertEqual(row_filters("df[df['state'].isin(['SP', 'RJ'])]", COLUMNS), [('state', 'in', ['SP', 'RJ'])])
+
+    def test_no_filters_when_other_rows_matter(self):
+        for code in ["df[df['price'] > df['price'].mean()]", "df.head()", "len(df[df['qty'] > 3]) / len(df)",
+                     "df[(df['qty'] > 3) | (df['state'] == 'SP')]", "df[df['state'] != 'SP']",
+                     "df[df['state'].isin(['SP', None])]"]:
+            self.assertEqual(row_filters(code, COLUMNS), [], code)
+
+
+@unittest.skipUnless(_pyarrow_available(), "needs pyarrow")
+class TestParquetCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "orders.csv")
+        rng = np.random.default_rng(0)
+        n = 3000
+        df = pd.DataFrame({
+            'order_id': [f"o{i}" for i in range(n)],
+            'purchased_at': pd.date_range('2017-01-01', periods=n, freq='h').astype(str),
+            'state': rng.choice(['SP', 'RJ', None], n),
+            'price': np.round(rng.random(n) * 100, 2),
+            'qty': np.arange(n)
+        })
+        # empty for the whole first chunk
+        df.loc[:1200, 'price'] = np.nan
+        df.to_csv(self.csv_path, index=False)
+        self.df = pd.read_csv(self.csv_path)
+        dataset_cache.invalidate()
+
+    def tearDown(self):
+        dataset_cache.invalidate()
+        self.tmp_dir.cleanup()
+
+    def _build(self, large=False):
+        with patch('app.utils.materialize.PARQUET_ROW_GROUP_ROWS', 500), \
+                patch('app.utils.chunked_query.CSV_CHUNK_ROWS', 1000), \
+                patch('app.utils.chunked_query.CHUNKED_CSV_BYTES', 0 if large else 10 ** 12):
+            return build_parquet_copy(self.csv_path)
+
+    def test_same_frame_as_csv(self):
+        for large in (False, True):
+            parquet_path = self._build(large)
+            self.assertEqual(get_parquet_copy(self.csv_path), parquet_path)
+            pd.testing.assert_frame_equal(read_parquet_copy(parquet_path), self.df)
+            dataset_cache.invalidate()
+            pd.testing.assert_frame_equal(load_dataframe(self.csv_path), self.df)
+        # stale once the CSV changes
+        with open(self.csv_path, "a") as f:
+            f.write("o9999,2020-01-01 00:00:00,SP,1.0,9999\n")
+        self.assertIsNone(get_parquet_copy(self.csv_path))
+
+    def test_row_groups_skipped(self):
+        parquet_path = self._build()
+        frame = read_parquet_copy(parquet_path, columns=['order_id', 'qty'], filters=[('qty', '==', 1234)])
+        # only the row group holding rows 1000-1499 is read, with its row numbers
+        self.assertEqual(len(frame), 500)
+        self.assertEqual(frame.index[0], 1000)
+        self.assertEqual(frame.loc[1234, 'order_id'], 'o1234')
+
+    def test_results_unchanged(self):
+        self._build()
+        codes = ["df[df['qty'] > 2800]", "df[(df['qty'] >= 100) & (df['qty'] < 300)]['price'].sum()",
+                 "df[df['purchased_at'] >= '2017-04-01'][['order_id', 'purchased_at']].head(3)",
+                 "df[df['qty'] > df['qty'].mean()]['qty'].count()"]
+        with patch('app.utils.code_sandbox.SANDBOX_ENABLED', False):
+            for code in codes:
+                dataset_cache.invalidate()
+                expected = _run_pandas_code(self.df.copy(), code)
+                pd.testing.assert_frame_equal(run_pandas_job(self.csv_path, code), expected)
+        result = run_chunked_query(self.csv_path, "df[df['qty'] == 7]", chunk_rows=100)
+        pd.testing.assert_frame_equal(result, self.df[self.df['qty'] == 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
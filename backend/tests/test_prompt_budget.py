@@ -0,0 +1,130 @@
+# Tests for fitting the enhanced schema into the prompt token budget and the cacheable prompt prefix
+
+import unittest
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.dataset_profile import compute_profile
+from app.utils.db_handler import get_prompt_schema
+from app.utils.prompt_budget import (
+    compact_enhanced_schema, estimate_tokens, rank_columns, relevant_column_stats, schema_budget
+)
+from app.services.ollama_service import build_pandas_payload, build_sql_payload
+
+
+class TestPromptBudget(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        columns = {f"metric_{i}": rng.random(40) for i in range(290)}
+        columns["order_id"] = [f"o{i}" for i in range(40)]
+        columns["payment_type"] = rng.choice(["boleto", "credit_card", "voucher"], 40)
+        columns["customer_state"] = rng.choice(["SP", "RJ", "GO"], 40)
+        for i in range(7):
+            columns[f"category_{i}"] = rng.choice(list("abcdef"), 40)
+        cls.csv_path = os.path.join(cls.tmp_dir.name, "wide.csv")
+        pd.DataFrame(columns).to_csv(cls.csv_path, index=False)
+        cls.profile = compute_profile(cls.csv_path)
+        cls.columns = cls.profile["tables"][0]["columns"]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("SELECT * FROM data"), 4)
+        self.assertEqual(estimate_tokens("payment_value: 1234"), 6)
+
+    def test_ranks_mentioned_columns_first(self):
+        names = [self.columns[i]["name"] for i in rank_columns("total payments by payment type in SP", self.columns)]
+        self.assertEqual(names[:2], ["payment_type", "customer_state"])
+        # nothing mentioned: key columns, then table order
+        names = [self.columns[i]["name"] for i in rank_columns("how many rows", self.columns)]
+        self.assertEqual(names[:3], ["order_id", "metric_0", "metric_1"])
+
+    def test_small_schema_unchanged(self):
+        small = dict(self.profile, enhanced_schema_text="Database Schema:\nTable: data\nColumns: a, b\n")
+        self.assertEqual(compact_enhanced_schema(small, "anything", 1000), small["enhanced_schema_text"])
+
+    def test_wide_schema_fits_budget(self):
+        self.assertGreater(estimate_tokens(self.profile["enhanced_schema_text"]), 10000)
+        text = compact_enhanced_schema(self.profile, "average metric_12 by customer state", 3000)
+        self.assertLessEqual(estimate_tokens(text), 3000)
+        # every column is still named, the relevant ones keep their stats
+        columns_line = next(line for line in text.splitlines() if line.startswith("Columns:"))
+        self.assertEqual(len(columns_line.split(",")), 300)
+        self.assertIn("metric_12: min=", text)
+        self.assertIn("Values: ", text)
+        self.assertNotIn("metric_250: min=", text)
+
+    def test_tight_budget_cuts_names(self):
+        text = compact_enhanced_schema(self.profile, "which payment_type is most used", 400)
+        self.assertLessEqual(estimate_tokens(text), 400)
+        self.assertIn("more columns not shown", text)
+        self.assertIn("payment_type: 3 unique values", text)
+
+    def test_prompt_schema(self):
+        text = get_prompt_schema(self.csv_path, 1500, "count orders by payment type")
+        self.assertLessEqual(estimate_tokens(text), 1500)
+        self.assertIn("payment_type: 3 unique values", text)
+        self.assertIn("error", get_prompt_schema(os.path.join(self.tmp_dir.name, "missing.csv"), 1500))
+
+    def test_relevant_column_stats(self):
+        schema = compact_enhanced_schema(self.profile, "", 1000)
+        self.assertNotIn("metric_250: min=", schema)
+        text = relevant_column_stats(self.profile, "average metric_250 for vouchers", schema)
+        self.assertTrue(text.startswith("Columns this question may need:"))
+        self.assertIn("metric_250: min=", text)
+        self.assertIn("payment_type: 3 unique values", text)
+        # nothing to add when the schema already has them, or the question names none
+        self.assertEqual(relevant_column_stats(self.profile, "average metric_250", self.profile["enhanced_schema_text"]), "")
+        self.assertEqual(relevant_column_stats(self.profile, "how many rows", schema), "")
+
+    def test_schema_budget(self):
+        self.assertEqual(schema_budget("one two three", 1000), 997)
+        self.assertLess(schema_budget(""), 3000)
+        # never less than the minimum
+        self.assertEqual(schema_budget("word " * 900, 1000), 400)
+
+
+class TestPromptPrefix(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        TestPromptBudget.setUpClass()
+        cls.csv_path = TestPromptBudget.csv_path
+
+    @classmethod
+    def tearDownClass(cls):
+        TestPromptBudget.tearDownClass()
+
+    def test_system_message_is_the_same_for_every_question(self):
+        questions = ["total payments by payment type", "average metric_250 in SP", "show 5 rows"]
+        for build in (build_sql_payload, build_pandas_payload):
+            payloads = [build(question, None, self.csv_path) for question in questions]
+            systems = {payload["messages"][0]["content"] for payload in payloads}
+            self.assertEqual(len(systems), 1)
+            for payload, question in zip(payloads, questions):
+                system, user = payload["messages"]
+                self.assertEqual((system["role"], user["role"]), ("system", "user"))
+                self.assertNotIn(question, system["content"])
+                self.assertIn(f'"{question}"', user["content"])
+                self.assertLessEqual(estimate_tokens(system["content"] + user["content"]), 3000)
+            # the wide table's stats left out of the prefix come with the question
+            self.assertIn("metric_250: min=", payloads[1]["messages"][1]["content"])
+
+    def test_without_file(self):
+        payload = build_sql_payload("how many rows", "Database Schema:\nTable: data\nColumns: a, b\n")
+        self.assertIn("Columns: a, b", payload["messages"][0]["content"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# Tests for the streaming (NDJSON/SSE) mode of /query
+# LLM calls are mocked, the generated pandas code runs for real on a small CSV
+
+import unittest
+import os
+import sys
+import json
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routes.query_routes import query_bp
+
+
+class TestQueryStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "test_data.csv")
+        pd.DataFrame({
+            'id': [1, 2, 3],
+            'name': ['John', 'Jane', 'Jim'],
+            'city': ['London', 'New York', 'London']
+        }).to_csv(self.csv_path, index=False)
+
+        app = Flask(__name__)
+        app.register_blueprint(query_bp)
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _post(self, **headers):
+        return self.client.post(
+            '/query',
+            data=json.dumps({'query': 'Who lives in London?', 'filePath': self.csv_path, 'stream': True}),
+            content_type='application/json',
+            headers=headers
+        )
+
+    @patch('app.services.ollama_service.get_llm_client')
+    @patch('app.routes.query_routes.get_pandas_query')
+    def test_ndjson_events_in_order(self, mock_pandas_query, mock_client):
+        mock_pandas_query.return_value = {
+            "success": True,
+            "query_type": "pandas",
+            "pandas_query": "df[df['city'] == 'London']"
+        }
+        mock_client.return_value.chat_stream.return_value = iter([
+            {"message": {"content": "Two people "}, "done": False},
+            {"message": {"content": "live in London."}, "done": True}
+        ])
+
+        response = self._post()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        events = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual([e["type"] for e in events], ["query", "rows", "explanation", "explanation", "done"])
+        self.assertEqual(events[0]["generated_code"], "df[df['city'] == 'London']")
+        self.assertEqual([row["name"] for row in events[1]["rows"]], ["John", "Jim"])
+        self.assertEqual("".join(e["token"] for e in events[2:4]), "Two people live in London.")
+
+    @patch('app.routes.query_routes.get_pandas_query')
+    def test_sse_error_event(self, mock_pandas_query):
+        mock_pandas_query.return_value = {
+            "success": True,
+            "query_type": "pandas",
+            "pandas_query": "df[df['missing'] == 1]"
+        }
+        response = self._post(Accept='text/event-stream')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = [c for c in response.data.decode().split("\n\n") if c]
+        self.assertTrue(all(c.startswith("data: ") for c in chunks))
+        self.assertEqual(json.loads(chunks[-1][len("data: "):])["type"], "error")
+
+
+if __name__ == '__main__':
+    unittest.main()
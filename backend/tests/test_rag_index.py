@@ -0,0 +1,71 @@
+# Tests for the RAG index: column lookup, compiled query patterns and registration
+
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.rag_index import RagIndex
+from app.utils.rag_examples import csv_files, query_examples, query_patterns
+
+REVIEWS = {
+    "description": "Customer reviews of orders",
+    "columns": ["review_id", "order_id", "review_score", "review_comment_message"],
+    "links": [{"connects_to": "Orders", "via": "order_id", "type": "many-to-one"}],
+    "example_qs": ["What is the average review score?", "How many reviews have a comment?"]
+}
+
+
+class TestRagIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RagIndex(csv_files, query_examples, query_patterns)
+
+    def test_column_mentions(self):
+        self.assertEqual(self.index.guess_relevant_files("sum of shipping_charges")[0], "OrderItems")
+        # order_id is in three files
+        self.assertEqual(set(self.index.guess_relevant_files("count order_id")[:3]), {"OrderItems", "Orders", "Payments"})
+
+    def test_patterns_compiled_and_matched(self):
+        self.assertTrue(all(pattern["regex"].pattern == pattern["pattern"] for pattern in self.index.patterns))
+        matched = [self.index.patterns[i]["desc"] for i in self.index.match_patterns("Show the FIRST 10 rows")]
+        self.assertEqual(matched, ["Get first N rows"])
+        self.assertEqual(self.index.match_patterns("hello"), [])
+
+    def test_pattern_ranks_examples(self):
+        index = RagIndex(examples=[
+            {"query": "number of orders in each city", "code": "a", "file_type": "any"},
+            {"query": "how many orders in each city", "code": "b", "file_type": "any"},
+        ], patterns=[{"pattern": "count|how many", "desc": "Count records"}])
+        # "a" is the closer question, "b" matches the same pattern
+        self.assertEqual([ex["code"] for ex in index.find_examples("count the orders in each city")], ["b", "a"])
+
+    def test_registered_dataset(self):
+        self.index.register_dataset("Reviews", REVIEWS)
+        self.index.register_examples([{
+            "query": "What's the average review score?", "code": "df['review_score'].mean()", "file_type": "Reviews"
+        }])
+        self.index.register_pattern({"pattern": "review|rating", "desc": "Review questions"})
+        self.assertEqual(self.index.guess_relevant_files("average review_score")[0], "Reviews")
+        self.assertEqual(self.index.find_examples("mean review score", "Reviews")[0]["code"], "df['review_score'].mean()")
+        self.assertEqual(self.index.find_examples("mean review score", "Orders"), [])
+        self.assertEqual(self.index.get_links("Reviews"), REVIEWS["links"])
+        self.assertEqual(self.index.patterns[self.index.match_patterns("any rating above 4")[-1]]["desc"], "Review questions")
+
+        # re-registering replaces the columns
+        self.index.register_dataset("Reviews", dict(REVIEWS, columns=["review_id"]))
+        self.assertEqual(self.index.guess_relevant_files("count review_id")[0], "Reviews")
+        self.assertNotIn("Reviews", self.index._column_datasets["review_score"])
+
+    def test_replaced_questions_cleared(self):
+        self.index.register_dataset("Reviews", REVIEWS)
+        self.assertEqual(self.index.guess_relevant_files("how many reviews have a comment")[0], "Reviews")
+        # the question it no longer lists doesn't point at it any more
+        self.index.register_dataset("Reviews", dict(REVIEWS, example_qs=["What is the average review score?"]))
+        self.assertNotIn("Reviews", self.index.guess_relevant_files("how many reviews have a comment"))
+        self.assertEqual(self.index.guess_relevant_files("what is the average review score")[0], "Reviews")
+
+
+if __name__ == '__main__':
+    unittest.main()
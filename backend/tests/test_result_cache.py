@@ -0,0 +1,84 @@
+# Tests for the executed query result cache
+
+import unittest
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.result_cache import ResultCache, normalize_code, result_cache
+from app.utils.db_handler import execute_pandas_query, execute_query
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "payments.csv")
+        pd.DataFrame({
+            'payment_type': ['credit_card', 'boleto', 'credit_card'],
+            'payment_value': [10.0, 20.0, 30.0]
+        }).to_csv(self.csv_path, index=False)
+        result_cache.clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_code_normalisation(self):
+        self.assertEqual(normalize_code("pandas", "df.head( 5 )"), normalize_code("pandas", "df.head(5)"))
+        self.assertNotEqual(normalize_code("pandas", "df[df['a'] == 'x  y']"), normalize_code("pandas", "df[df['a'] == 'x y']"))
+        self.assertEqual(normalize_code("sql", "SELECT  *\nFROM data;"), "SELECT * FROM data")
+        self.assertEqual(normalize_code("sql", "SELECT 'a  b'"), "SELECT 'a  b'")
+
+    def test_repeated_pandas_query_skips_loading(self):
+        code = "df.groupby('payment_type')['payment_value'].sum()"
+        first = execute_pandas_query(self.csv_path, code)
+        with patch('app.utils.db_handler.load_dataframe') as mock_load:
+            second = execute_pandas_query(self.csv_path, code)
+            mock_load.assert_not_called()
+        self.assertEqual(first["results"], second["results"])
+
+    def test_repeated_sql_query_skips_execution(self):
+        sql = "SELECT payment_type, SUM(payment_value) AS total FROM data GROUP BY payment_type"
+        first = execute_query(self.csv_path, sql)
+        with patch('app.utils.db_handler.run_sql') as mock_run:
+            second = execute_query(self.csv_path, sql + ";")
+            mock_run.assert_not_called()
+        self.assertEqual(first["results"], second["results"])
+
+    def test_cached_frame_cannot_be_mutated(self):
+        cache = ResultCache()
+        cache.put("k", pd.DataFrame({'a': [1]}))
+        frame = cache.get("k")
+        frame['a'] = 2
+        self.assertEqual(cache.get("k")['a'].tolist(), [1])
+
+    def test_page_of_cached_frame(self):
+        cache = ResultCache()
+        frame = pd.DataFrame({'a': range(10), 'b': list('abcdefghij')}, index=pd.RangeIndex(100, 110))
+        cache.put("k", frame)
+        page, row_count = cache.get_page("k", 4, 3)
+        self.assertEqual(row_count, 10)
+        pd.testing.assert_frame_equal(page, frame.iloc[4:7])
+        pd.testing.assert_frame_equal(cache.get("k"), frame)
+        self.assertIsNone(cache.get_page("missing"))
+
+    def test_frame_arrow_cannot_hold_is_pickled(self):
+        cache = ResultCache()
+        frame = pd.DataFrame({'a': [1, 'x', 2.5]})
+        cache.put("k", frame)
+        page, row_count = cache.get_page("k", 1)
+        self.assertEqual(row_count, 3)
+        self.assertEqual(page['a'].tolist(), ['x', 2.5])
+
+    def test_oversized_result_not_cached(self):
+        cache = ResultCache(max_bytes=10)
+        cache.put("k", pd.DataFrame({'a': range(100)}))
+        self.assertIsNone(cache.get("k"))
+
+
+if __name__ == '__main__':
+    unittest.main()
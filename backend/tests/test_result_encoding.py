@@ -0,0 +1,113 @@
+# Tests for the records/columnar/arrow result encodings
+
+import unittest
+import os
+import sys
+import json
+import tempfile
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routes.query_routes import query_bp
+from app.utils.result_encoding import (
+    negotiate_format, encode_records, encode_columnar, encode_arrow, ARROW_MIME
+)
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestResultEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = pd.DataFrame({
+            'state': ['SP', 'RJ', None],
+            'total': [np.int64(3), np.int64(2), np.int64(1)],
+            'avg': [1.5, np.nan, 2.0],
+            'when': pd.to_datetime(['2018-01-01', '2018-01-02', None])
+        })
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate_format({}, ""), "records")
+        self.assertEqual(negotiate_format({}, ARROW_MIME), "arrow")
+        self.assertEqual(negotiate_format({"format": "columnar"}, ARROW_MIME), "columnar")
+        with self.assertRaises(ValueError):
+            negotiate_format({"format": "xml"})
+
+    def test_records_have_no_nan(self):
+        records = encode_records(self.frame)
+        self.assertIsNone(records[1]["avg"])
+        self.assertIsNone(records[2]["state"])
+        # must be valid strict JSON
+        json.loads(json.dumps(records, default=str, allow_nan=False))
+
+    def test_columnar_shape(self):
+        decoded = json.loads(encode_columnar(self.frame))
+        self.assertEqual(decoded["columns"], ['state', 'total', 'avg', 'when'])
+        self.assertEqual(decoded["data"][0], ['SP', 'RJ', None])
+        self.assertEqual(decoded["data"][1], [3, 2, 1])
+        self.assertEqual(decoded["data"][2], [1.5, None, 2.0])
+        self.assertTrue(decoded["data"][3][0].startswith("2018-01-01"))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow not installed")
+    def test_arrow_round_trip(self):
+        body = encode_arrow(self.frame, metadata={"total_rows": 3})
+        table = pyarrow.ipc.open_stream(body).read_all()
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(json.loads(table.schema.metadata[b"terranova"])["total_rows"], 3)
+
+
+class TestResultFormatRoute(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "payments.csv")
+        pd.DataFrame({'payment_type': ['voucher', 'boleto'], 'payment_value': [1.0, None]}).to_csv(self.csv_path, index=False)
+        app = Flask(__name__)
+        app.register_blueprint(query_bp)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch('app.routes.query_routes.submit_explanation', return_value="abc")
+    @patch('app.routes.query_routes.get_pandas_query')
+    def test_columnar_query_response(self, mock_pandas_query, mock_explain):
+        mock_pandas_query.return_value = {"success": True, "query_type": "pandas", "pandas_query": "df"}
+        response = self.client.post(
+            '/query?format=columnar',
+            data=json.dumps({'query': 'everything', 'filePath': self.csv_path}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+        self.assertEqual(body["format"], "columnar")
+        self.assertEqual(body["results"]["data"], [['voucher', 'boleto'], [1.0, None]])
+        self.assertEqual(body["total_rows"], 2)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow not installed")
+    @patch('app.routes.query_routes.submit_explanation', return_value="abc")
+    @patch('app.routes.query_routes.get_pandas_query')
+    def test_arrow_falls_back_for_mixed_column(self, mock_pandas_query, mock_explain):
+        # numbers and text in one column, Arrow can't type it
+        code = "pd.DataFrame({'a': [1, 'x', None]})"
+        mock_pandas_query.return_value = {"success": True, "query_type": "pandas", "pandas_query": code}
+        response = self.client.post(
+            '/query?format=arrow',
+            data=json.dumps({'query': 'mixed', 'filePath': self.csv_path}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+        self.assertEqual(body["format"], "columnar")
+        self.assertEqual(body["results"]["data"], [[1, 'x', None]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Tests for row-capped /query results and the /results/<handle> page endpoint
+
+import unittest
+import os
+import sys
+import json
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routes.query_routes import query_bp
+
+
+class TestResultPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "items.csv")
+        pd.DataFrame({'item': range(25), 'price': [i * 1.5 for i in range(25)]}).to_csv(self.csv_path, index=False)
+
+        app = Flask(__name__)
+        app.register_blueprint(query_bp)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch('app.routes.query_routes.submit_explanation', return_value="abc")
+    @patch('app.routes.query_routes.get_pandas_query')
+    def test_query_is_capped_then_paged(self, mock_pandas_query, mock_explain):
+        mock_pandas_query.return_value = {
+            "success": True,
+            "query_type": "pandas",
+            "pandas_query": "df[df['price'] > 0]"
+        }
+        response = self.client.post(
+            '/query',
+            data=json.dumps({'query': 'Items with a price', 'filePath': self.csv_path, 'limit': 10}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        first = json.loads(response.data)
+        self.assertEqual(len(first["results"]), 10)
+        self.assertEqual(first["total_rows"], 24)
+        self.assertTrue(first["truncated"])
+        self.assertEqual(first["results"][0]["item"], 1)
+
+        response = self.client.get(f'/results/{first["handle"]}?offset=20&limit=10')
+        self.assertEqual(response.status_code, 200)
+        last = json.loads(response.data)
+        self.assertEqual([row["item"] for row in last["results"]], [21, 22, 23, 24])
+        self.assertFalse(last["truncated"])
+
+    def test_unknown_handle(self):
+        self.assertEqual(self.client.get('/results/missing').status_code, 404)
+
+    def test_bad_page_params(self):
+        self.assertEqual(self.client.get('/results/missing?limit=lots').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
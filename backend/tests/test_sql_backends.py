@@ -0,0 +1,137 @@
+# Tests for the DuckDB SQL backend over CSV uploads and batched result fetching
+
+import unittest
+import os
+import sys
+import sqlite3
+import tempfile
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.db_handler import execute_query, get_result_page
+from app.utils.materialize import build_parquet_copy, materialized_path_for
+from app.utils.result_cache import result_cache
+from app.utils.sql_backends import SQL_BACKENDS, run_sql, sqlite_to_duckdb
+
+duckdb_backend = SQL_BACKENDS["duckdb"]
+
+
+class TestSqlRewrite(unittest.TestCase):
+
+    def test_like_is_case_insensitive(self):
+        self.assertEqual(
+            sqlite_to_duckdb("SELECT * FROM data WHERE a like '%LIKE%' AND \"like\" NOT LIKE 'x' -- like"),
+            "SELECT * FROM data WHERE a ILIKE '%LIKE%' AND \"like\" NOT ILIKE 'x' -- like"
+        )
+
+
+@unittest.skipUnless(duckdb_backend.available(), "needs duckdb")
+class TestDuckDBBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "payments.csv")
+        pd.DataFrame({
+            'order_id': ['a', 'b', 'c', 'd', 'e'],
+            'purchased_at': ['2017-10-02 10:56:33', '2018-07-24 20:41:37', None, '2018-08-08 08:38:49', '2018-02-13 21:18:39'],
+            'payment_type': ['Voucher', 'boleto', 'voucher', 'credit_card', None],
+            'installments': [1, 3, 2, 8, 1],
+            'value': [10.5, 20.0, None, 40.25, 5.0]
+        }).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertSameAsSqlite(self, sql):
+        with patch('app.utils.sql_backends.SQL_BACKEND', 'sqlite'):
+            expected = run_sql(self.csv_path, ".csv", sql)
+        pd.testing.assert_frame_equal(duckdb_backend.run(self.csv_path, sql), expected)
+
+    def test_matches_sqlite(self):
+        for parquet in (False, True):
+            if parquet:
+                build_parquet_copy(self.csv_path)
+            self.assertSameAsSqlite("SELECT payment_type, SUM(installments) AS n, COUNT(*) AS c, AVG(value) AS v "
+                                    "FROM data GROUP BY payment_type ORDER BY payment_type")
+            self.assertSameAsSqlite("SELECT order_id, installments / 2 AS half FROM data WHERE payment_type LIKE 'VOUCHER'")
+            self.assertSameAsSqlite("SELECT substr(purchased_at, 1, 7) AS month, value FROM data ORDER BY value DESC")
+
+    def test_no_sqlite_copy_needed(self):
+        result = run_sql(self.csv_path, ".csv", "SELECT COUNT(*) AS n FROM data")
+        self.assertEqual(result["n"].tolist(), [5])
+        self.assertFalse(os.path.exists(materialized_path_for(self.csv_path)))
+
+    def test_falls_back_to_sqlite(self):
+        # strftime(format, text) is SQLite only
+        result = run_sql(self.csv_path, ".csv", "SELECT strftime('%Y', purchased_at) AS y FROM data WHERE order_id = 'a'")
+        self.assertEqual(result["y"].tolist(), ["2017"])
+
+    def test_only_the_upload_is_readable(self):
+        other = os.path.join(self.tmp_dir.name, "other.csv")
+        pd.DataFrame({'secret': [1]}).to_csv(other, index=False)
+        import duckdb
+        with self.assertRaises(duckdb.Error):
+            duckdb_backend.run(self.csv_path, f"SELECT * FROM read_csv('{other}')")
+        with self.assertRaises(duckdb.Error):
+            duckdb_backend.run(self.csv_path, f"COPY data TO '{other}'")
+
+
+class TestBatchedFetch(unittest.TestCase):
+    # abs() of the smallest integer is an overflow error, only raised if that row is read
+    SQL = "SELECT i, CASE WHEN i = 40000 THEN abs(-9223372036854775807 - 1) ELSE i * 2 END AS j, name FROM items"
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "items.db")
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE items (i INTEGER, name TEXT)")
+            conn.executemany("INSERT INTO items VALUES (?, ?)", ((i, None if i % 3 else f"n{i}") for i in range(50000)))
+        result_cache.clear()
+
+    def tearDown(self):
+        result_cache.clear()
+        self.tmp_dir.cleanup()
+
+    def test_stops_at_max_rows(self):
+        with patch('app.utils.sql_backends.SQL_FETCH_ROWS', 7):
+            result = run_sql(self.db_path, ".db", self.SQL, max_rows=25)
+        with sqlite3.connect(self.db_path) as conn:
+            expected = pd.read_sql_query("SELECT i, i * 2 AS j, name FROM items LIMIT 25", conn)
+        pd.testing.assert_frame_equal(result, expected)
+        with self.assertRaises(sqlite3.Error):
+            run_sql(self.db_path, ".db", self.SQL)
+
+    def test_pages_read_further(self):
+        first = execute_query(self.db_path, self.SQL, offset=0, limit=10)
+        self.assertEqual([row["i"] for row in first["results"]], list(range(10)))
+        self.assertIsNone(first["total_rows"])
+        self.assertTrue(first["truncated"])
+
+        page = get_result_page(first["handle"], offset=1000, limit=5)
+        self.assertEqual([row["j"] for row in page["results"]], [2000, 2002, 2004, 2006, 2008])
+        self.assertTrue(page["truncated"])
+        # the rows read so far are served from the cache
+        with patch('app.utils.db_handler.run_sql') as mock_run_sql:
+            again = execute_query(self.db_path, self.SQL, offset=20, limit=10)
+        mock_run_sql.assert_not_called()
+        self.assertEqual(again["results"][0]["i"], 20)
+
+        small = execute_query(self.db_path, "SELECT COUNT(*) AS n FROM items", offset=0, limit=10)
+        self.assertEqual(small["total_rows"], 1)
+        self.assertFalse(small["truncated"])
+
+    @unittest.skipUnless(duckdb_backend.available(), "needs duckdb")
+    def test_duckdb_reads_up_to_max_rows(self):
+        csv_path = os.path.join(self.tmp_dir.name, "items.csv")
+        pd.DataFrame({'i': range(50000), 'name': [f"n{i}" if i % 2 else None for i in range(50000)]}).to_csv(
+            csv_path, index=False)
+        sql = "SELECT i, name FROM data ORDER BY i DESC"
+        with patch('app.utils.sql_backends.SQL_FETCH_ROWS', 4096):
+            result = duckdb_backend.run(csv_path, sql, max_rows=5000)
+        pd.testing.assert_frame_equal(result, duckdb_backend.run(csv_path, sql).iloc[:5000])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# Tests for pooled read-only SQLite connections
+
+import unittest
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.sqlite_pool import SQLitePool, SQLITE_MMAP_BYTES
+from app.utils.db_handler import execute_query
+
+
+class TestSQLitePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = self._make_db("shop.db", [("a", 1), ("b", 2)])
+        self.pool = SQLitePool(size=2)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.tmp_dir.cleanup()
+
+    def _make_db(self, name, rows):
+        path = os.path.join(self.tmp_dir.name, name)
+        conn = sqlite3.connect(path)
+        conn.execute("DROP TABLE IF EXISTS items")
+        conn.execute("CREATE TABLE items (name TEXT, qty INTEGER)")
+        conn.executemany("INSERT INTO items VALUES (?, ?)", rows)
+        conn.commit()
+        conn.close()
+        return path
+
+    def test_connection_reused_and_tuned(self):
+        with self.pool.connection(self.db_path) as first:
+            self.assertEqual(first.execute("PRAGMA query_only").fetchone()[0], 1)
+            self.assertEqual(first.execute("PRAGMA mmap_size").fetchone()[0], SQLITE_MMAP_BYTES)
+        with self.pool.connection(self.db_path) as second:
+            self.assertIs(second, first)
+            # two at once get two connections
+            with self.pool.connection(self.db_path) as third:
+                self.assertIsNot(third, second)
+
+    def test_read_only(self):
+        with self.pool.connection(self.db_path) as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM items")
+        with self.pool.connection(self.db_path) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM items").fetchone()[0], 2)
+
+    def test_readonly_uri(self):
+        # characters that mean something in a URI
+        path = self._make_db("what?#.db", [("c", 3)])
+        with self.pool.connection(path) as conn:
+            self.assertEqual(conn.execute("SELECT qty FROM items").fetchone()[0], 3)
+
+    def test_left_over_state_not_reused(self):
+        other = self._make_db("other.db", [])
+        with self.pool.connection(self.db_path) as conn:
+            conn.execute(f"ATTACH DATABASE '{other}' AS other")
+        with self.pool.connection(self.db_path) as fresh:
+            self.assertIsNot(fresh, conn)
+            self.assertEqual(len(fresh.execute("PRAGMA database_list").fetchall()), 1)
+
+    def test_replaced_file_gets_new_connection(self):
+        with self.pool.connection(self.db_path) as conn:
+            pass
+        time.sleep(0.01)
+        tmp_path = self._make_db("new.db", [("c", 3)])
+        os.replace(tmp_path, self.db_path)
+        with self.pool.connection(self.db_path) as fresh:
+            self.assertIsNot(fresh, conn)
+            self.assertEqual(fresh.execute("SELECT name FROM items").fetchall(), [("c",)])
+
+    def test_db_upload_cannot_be_modified(self):
+        result = execute_query(self.db_path, "DELETE FROM items")
+        self.assertFalse(result["success"])
+        self.assertEqual(execute_query(self.db_path, "SELECT COUNT(*) AS n FROM items")["results"], [{"n": 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
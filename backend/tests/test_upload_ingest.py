@@ -0,0 +1,160 @@
+# Tests for streaming uploads, first-block validation and resumable chunked uploads
+
+import unittest
+import os
+import sys
+import io
+import json
+import hashlib
+import sqlite3
+import tempfile
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routes.file_routes import file_routes
+from app.utils.upload_ingest import sniff_csv, UploadError
+from app.utils.dataset_cache import load_dataframe, file_fingerprint
+from app.utils.dataset_profile import profile_path_for
+from app.utils.parquet_copy import get_parquet_copy, parquet_path_for
+
+
+class TestSniffing(unittest.TestCase):
+
+    def test_semicolon_latin1_csv(self):
+        detected = sniff_csv("cidade;estado\nSão Paulo;SP\nGoiânia;GO\n".encode("latin-1"))
+        self.assertEqual(detected, {"encoding": "latin-1", "delimiter": ";"})
+
+    def test_plain_csv(self):
+        self.assertEqual(sniff_csv(b"id,name\n1,John\n"), {"encoding": "utf-8", "delimiter": ","})
+
+    def test_binary_rejected(self):
+        with self.assertRaises(UploadError):
+            sniff_csv(b"\x89PNG\x00\x00")
+
+
+class TestUploadRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        app = Flask(__name__)
+        app.config['UPLOAD_FOLDER'] = self.tmp_dir.name
+        app.register_blueprint(file_routes)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _upload(self, content, filename):
+        return self.client.post(
+            '/upload',
+            data={'file': (io.BytesIO(content), filename)},
+            content_type='multipart/form-data'
+        )
+
+    def test_upload_streams_and_hashes(self):
+        content = "cidade;estado\nSão Paulo;SP\n".encode("latin-1")
+        response = self._upload(content, "cities.csv")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data["sha256"], hashlib.sha256(content).hexdigest())
+        # readers pick up the sniffed delimiter and encoding
+        df = load_dataframe(data["path"])
+        self.assertEqual(df.columns.tolist(), ["cidade", "estado"])
+        self.assertEqual(df.iloc[0]["cidade"], "São Paulo")
+
+    def test_fake_sqlite_rejected(self):
+        response = self._upload(b"id,name\n1,John\n", "data.db")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("SQLite", json.loads(response.data)["error"])
+        self.assertEqual([f for f in os.listdir(self.tmp_dir.name) if not f.startswith(".")], [])
+
+    def test_real_sqlite_accepted(self):
+        db_path = os.path.join(self.tmp_dir.name, "source.sqlite3")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE t (a INTEGER)")
+        conn.commit()
+        conn.close()
+        with open(db_path, "rb") as f:
+            response = self._upload(f.read(), "data.db")
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_extension(self):
+        response = self._upload(b"MZ", "malicious.exe")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("only", json.loads(response.data)["error"].lower())
+
+    def test_resumable_chunked_upload(self):
+        content = b"order_id,price\n" + b"".join(f"o{i},{i}.5\n".encode() for i in range(1000))
+        response = self.client.post('/uploads', json={"filename": "orders.csv", "size": len(content)})
+        self.assertEqual(response.status_code, 201)
+        upload_id = json.loads(response.data)["upload_id"]
+
+        first, rest = content[:4000], content[4000:]
+        response = self.client.put(f'/uploads/{upload_id}', data=first,
+                                   headers={"Content-Range": f"bytes 0-{len(first) - 1}/{len(content)}"})
+        self.assertEqual(json.loads(response.data)["offset"], len(first))
+
+        # wrong offset is refused, client asks where to resume from
+        response = self.client.put(f'/uploads/{upload_id}', data=rest, headers={"Upload-Offset": "0"})
+        self.assertEqual(response.status_code, 409)
+        offset = json.loads(self.client.get(f'/uploads/{upload_id}').data)["offset"]
+
+        response = self.client.put(f'/uploads/{upload_id}', data=rest,
+                                   headers={"Content-Range": f"bytes {offset}-{len(content) - 1}/{len(content)}"})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(f'/uploads/{upload_id}/complete')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data["sha256"], hashlib.sha256(content).hexdigest())
+        self.assertEqual(len(load_dataframe(data["path"])), 1000)
+        self.assertEqual(self.client.get(f'/uploads/{upload_id}').status_code, 404)
+
+    def test_duplicate_upload_is_aliased(self):
+        content = b"order_id,price\no1,10.5\no2,3.0\n"
+        first = json.loads(self._upload(content, "orders.csv").data)
+        second = json.loads(self._upload(content, "orders_copy.csv").data)
+        self.assertFalse(first["deduplicated"])
+        self.assertTrue(second["deduplicated"])
+        self.assertNotEqual(first["filename"], second["filename"])
+        # stored once (with ingest info, profile and Parquet copy), both names share the
+        # sidecars and cached frame
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir.name, "objects"))), 5)
+        self.assertEqual(os.path.realpath(first["path"]), os.path.realpath(second["path"]))
+        self.assertEqual(profile_path_for(first["path"]), profile_path_for(second["path"]))
+        self.assertEqual(file_fingerprint(first["path"]), file_fingerprint(second["path"]))
+        self.assertEqual(len(load_dataframe(second["path"])), 2)
+
+    def test_duplicate_upload_writes_missing_parquet_copy(self):
+        content = b"order_id,price\no1,10.5\no2,3.0\n"
+        first = json.loads(self._upload(content, "orders.csv").data)
+        # stored before Parquet copies were written
+        os.remove(parquet_path_for(first["path"]))
+        second = json.loads(self._upload(content, "orders_copy.csv").data)
+        self.assertTrue(second["deduplicated"])
+        self.assertIsNotNone(get_parquet_copy(second["path"]))
+
+    def test_known_hash_needs_the_bytes(self):
+        content = b"a,b\n1,2\n"
+        self._upload(content, "a.csv")
+        # the hash of stored content doesn't get a new name for it, the bytes still have to come
+        sha256 = hashlib.sha256(content).hexdigest()
+        response = self.client.post('/uploads', json={"filename": "a.csv", "size": len(content), "sha256": sha256})
+        self.assertEqual(response.status_code, 201)
+        upload_id = json.loads(response.data)["upload_id"]
+        self.assertEqual(self.client.post(f'/uploads/{upload_id}/complete').status_code, 409)
+
+        self.client.put(f'/uploads/{upload_id}', data=content, headers={"Upload-Offset": "0"})
+        data = json.loads(self.client.post(f'/uploads/{upload_id}/complete').data)
+        self.assertTrue(data["deduplicated"])
+        self.assertEqual(load_dataframe(data["path"])["b"].tolist(), [2])
+
+    def test_incomplete_chunked_upload(self):
+        upload_id = json.loads(self.client.post('/uploads', json={"filename": "a.csv", "size": 100}).data)["upload_id"]
+        self.client.put(f'/uploads/{upload_id}', data=b"a,b\n1,2\n", headers={"Upload-Offset": "0"})
+        self.assertEqual(self.client.post(f'/uploads/{upload_id}/complete').status_code, 409)
+
+
+if __name__ == '__main__':
+    unittest.main()